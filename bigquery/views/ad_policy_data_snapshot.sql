@@ -0,0 +1,33 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+/**
+ * Reconstruct the current snapshot of Ad Policy Data from the changes
+ * written in incremental mode: the last change of each ad that isn't
+ * resolved. event_date is the date of that change.
+ */
+SELECT
+  * EXCEPT (change_type, row_hash, change_number)
+FROM
+  (
+    SELECT
+      *,
+      ROW_NUMBER() OVER (
+        PARTITION BY customer_id, ad_group_id, ad_group_ad_ad_id
+        ORDER BY event_date DESC, _PARTITIONTIME DESC
+      ) AS change_number
+    FROM `${BQ_DATASET}.AdPolicyDataChanges`
+  )
+WHERE
+  change_number = 1
+  AND change_type != 'RESOLVED'
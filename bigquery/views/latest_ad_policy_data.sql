@@ -23,10 +23,13 @@ SELECT
     "&adGroupId=", AdPolicyData.ad_group_id,
     "&ocid=", Ocid.ocid) AS ads
    ) AS gads_links,
-  AdPolicyData.*,
-  SPLIT(
-    REPLACE(AdPolicyData.ad_group_ad_policy_summary_policy_topic_entries, ' ', ''),
-    "|") AS ad_policy_topics,
+  AdPolicyData.* EXCEPT (ad_policy_topics),
+  -- Topics written as arrays have no string to split
+  IFNULL(
+    SPLIT(
+      REPLACE(AdPolicyData.ad_group_ad_policy_summary_policy_topic_entries, ' ', ''),
+      "|"),
+    AdPolicyData.ad_policy_topics) AS ad_policy_topics,
 FROM
   `${BQ_DATASET}.AdPolicyData` AS AdPolicyData
 LEFT JOIN
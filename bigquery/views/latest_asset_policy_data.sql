@@ -24,10 +24,13 @@ SELECT
     IF(AssetPolicyData.example_ad_group_id is Null, "", "&adGroupId=" || AssetPolicyData.example_ad_group_id)
     ) AS assets
    ) AS gads_links,
-  AssetPolicyData.*,
-  SPLIT(
-    REPLACE(AssetPolicyData.asset_policy_summary_policy_topic_entries_topics, ' ', ''),
-    "|") AS asset_policy_topics,
+  AssetPolicyData.* EXCEPT (asset_policy_topics),
+  -- Topics written as arrays have no string to split
+  IFNULL(
+    SPLIT(
+      REPLACE(AssetPolicyData.asset_policy_summary_policy_topic_entries_topics, ' ', ''),
+      "|"),
+    AssetPolicyData.asset_policy_topics) AS asset_policy_topics,
 FROM
   `${BQ_DATASET}.AssetPolicyData` AS AssetPolicyData
 LEFT JOIN
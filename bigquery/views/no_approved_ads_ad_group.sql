@@ -14,42 +14,22 @@
 /**
  * A view that shows ad groups that have no approved ads.
  */
-WITH AdCounts AS (
-  SELECT
-    customer_id,
-    customer_descriptive_name,
-    campaign_id,
-    campaign_name,
-    ad_group_id,
-    ad_group_name,
-    ANY_VALUE(gads_links) AS gads_links,
-    SUM(impressions) AS total_impressions,
-    SUM(clicks) AS total_clicks,
-    COUNT(*) AS number_of_ads,
-  FROM
-    `${BQ_DATASET}.LatestAdPolicyData`
-  GROUP BY
-    1,2,3,4,5,6
-),
-DisapprovedAds AS (
-  SELECT
-    customer_id,
-    ad_group_id,
-    COUNT(*) AS disapproved_ads,
-  FROM
-    `${BQ_DATASET}.LatestAdPolicyData`
-  WHERE
-    ad_group_ad_policy_summary_approval_status != 'APPROVED'
-  GROUP BY
-    1,2
-)
-
 SELECT
-  AdCounts.*,
-  DisapprovedAds.disapproved_ads
+  customer_id,
+  customer_descriptive_name,
+  campaign_id,
+  campaign_name,
+  ad_group_id,
+  ad_group_name,
+  ANY_VALUE(gads_links) AS gads_links,
+  SUM(impressions) AS total_impressions,
+  SUM(clicks) AS total_clicks,
+  COUNT(*) AS number_of_ads,
+  COUNTIF(ad_group_ad_policy_summary_approval_status != 'APPROVED')
+    AS disapproved_ads,
 FROM
-  DisapprovedAds
-LEFT JOIN
-  AdCounts USING(customer_id, ad_group_id)
-WHERE
-  DisapprovedAds.disapproved_ads = AdCounts.number_of_ads
+  `${BQ_DATASET}.LatestAdPolicyData`
+GROUP BY
+  1,2,3,4,5,6
+HAVING
+  disapproved_ads = number_of_ads
@@ -0,0 +1,136 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Discovery of the accounts to run for, from the hierarchy of the login MCC.
+
+With payload.discover_customer_ids, the customer IDs are not listed by hand
+but read from the customer_client resource of the login customer, which has a
+row for every account under it, at any depth, in a single query. Only the
+enabled, visible & non-test client accounts are kept, so the reports don't
+spend a query on accounts that are cancelled, suspended or closed.
+
+The account index is cached for the login customer, so it's shared by all the
+reports of a run and by the warm invocations that follow, until it expires.
+"""
+import logging
+import sys
+from typing import List
+
+from gaarf.report import GaarfReport
+
+import google_ads
+import models
+import telemetry
+import utils
+
+logging.basicConfig(stream=sys.stdout)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# New & closed accounts are picked up by the next discovery after this time
+ACCOUNT_INDEX_TTL_SECONDS = 3600
+
+# Manager accounts have no ads of their own, so they're filtered by the API.
+# The other conditions are checked after the fetch, to log what is skipped.
+CUSTOMER_CLIENTS_QUERY = """
+SELECT
+  customer_client.id AS customer_id,
+  customer_client.status AS status,
+  customer_client.hidden AS hidden,
+  customer_client.test_account AS test_account
+FROM
+  customer_client
+WHERE
+  customer_client.manager = FALSE
+"""
+
+ENABLED_STATUS = 'ENABLED'
+
+account_index_pool = utils.ClientPool(ACCOUNT_INDEX_TTL_SECONDS)
+
+
+def with_discovered_customer_ids(payload: models.Payload) -> models.Payload:
+    """Set the customer IDs of a payload to the accounts under the login MCC.
+
+    Returns:
+        A copy of the payload with the discovered customer_ids, or the payload
+        itself if discover_customer_ids isn't set.
+    """
+    if not payload.discover_customer_ids:
+        return payload
+    customer_ids = get_customer_ids(payload)
+    return payload.model_copy(update={'customer_ids': customer_ids})
+
+
+def get_customer_ids(payload: models.Payload) -> List[int]:
+    """Get the accounts to run for, from the cached account index.
+
+    Args:
+        payload: the configuration used in this execution.
+
+    Returns:
+        The sorted IDs of the enabled client accounts of the login customer.
+    """
+    return account_index_pool.get(payload.google_ads_login_customer_id,
+                                  lambda: discover_customer_ids(payload))
+
+
+def discover_customer_ids(
+        payload: models.Payload,
+        report_fetcher: google_ads.AdsReportFetcher = None) -> List[int]:
+    """Query the customer clients of the login customer for its accounts.
+
+    Args:
+        payload: the configuration used in this execution.
+        report_fetcher: an instance of the AdsReportFetcher for dependency
+            injection.
+
+    Returns:
+        The sorted IDs of the enabled client accounts of the login customer.
+    """
+    if report_fetcher is None:
+        report_fetcher = google_ads.AdsReportFetcher(
+            google_ads.get_ads_client(payload))
+    login_customer_id = payload.google_ads_login_customer_id
+    with telemetry.stage('discover_customer_ids',
+                         login_customer_id=login_customer_id) as record:
+        report = google_ads.fetch_with_retry(CUSTOMER_CLIENTS_QUERY,
+                                             report_fetcher,
+                                             [login_customer_id])
+        customer_ids = select_serving_accounts(report)
+        record.rows = len(customer_ids)
+    logger.info('Discovered %d enabled accounts under %d, skipped %d others.',
+                len(customer_ids), login_customer_id,
+                len(report.results) - len(customer_ids))
+    return customer_ids
+
+
+def select_serving_accounts(report: GaarfReport) -> List[int]:
+    """Get the IDs of the enabled, visible & non-test accounts of a report.
+
+    Test accounts can't be queried with a production developer token, and
+    hidden accounts are those the login customer stopped managing.
+
+    Args:
+        report: the report of CUSTOMER_CLIENTS_QUERY.
+
+    Returns:
+        The sorted, unique account IDs.
+    """
+    columns = {name: index for index, name in enumerate(report.column_names)}
+    return sorted({
+        int(row[columns['customer_id']])
+        for row in report.results
+        if row[columns['status']] == ENABLED_STATUS and
+        not row[columns['hidden']] and not row[columns['test_account']]
+    })
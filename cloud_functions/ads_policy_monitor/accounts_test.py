@@ -0,0 +1,81 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for accounts.py"""
+import unittest
+from unittest.mock import MagicMock, patch
+
+from gaarf.report import GaarfReport
+
+import accounts
+import models
+
+CUSTOMER_CLIENTS_REPORT = GaarfReport(
+    results=[
+        [3, 'ENABLED', False, False],
+        [1, 'ENABLED', False, False],
+        [2, 'CANCELED', False, False],
+        [4, 'SUSPENDED', False, False],
+        [5, 'ENABLED', True, False],
+        [6, 'ENABLED', False, True],
+    ],
+    column_names=['customer_id', 'status', 'hidden', 'test_account'])
+
+
+class AccountsTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.payload = models.Payload(project_id='my_project',
+                                      bq_output_dataset='my_dataset',
+                                      region='europe-west2',
+                                      google_ads_login_customer_id=123,
+                                      discover_customer_ids=True)
+        accounts.account_index_pool.clear()
+        self.addCleanup(accounts.account_index_pool.clear)
+
+    def test_discover_customer_ids_keeps_enabled_accounts(self):
+        report_fetcher = MagicMock()
+        report_fetcher.fetch.return_value = CUSTOMER_CLIENTS_REPORT
+
+        customer_ids = accounts.discover_customer_ids(self.payload,
+                                                      report_fetcher)
+
+        self.assertEqual(customer_ids, [1, 3])
+        report_fetcher.fetch.assert_called_once_with(
+            accounts.CUSTOMER_CLIENTS_QUERY, [123])
+
+    @patch('accounts.discover_customer_ids', return_value=[1, 3])
+    def test_with_discovered_customer_ids_caches_the_index(
+            self, mock_discover_customer_ids):
+        first_payload = accounts.with_discovered_customer_ids(self.payload)
+        second_payload = accounts.with_discovered_customer_ids(self.payload)
+
+        self.assertEqual(first_payload.customer_ids, [1, 3])
+        self.assertEqual(second_payload.customer_ids, [1, 3])
+        self.assertEqual(self.payload.customer_ids, [])
+        mock_discover_customer_ids.assert_called_once()
+
+    @patch('accounts.discover_customer_ids')
+    def test_with_discovered_customer_ids_keeps_listed_accounts(
+            self, mock_discover_customer_ids):
+        payload = self.payload.model_copy(update={
+            'customer_ids': [7],
+            'discover_customer_ids': False
+        })
+
+        self.assertIs(accounts.with_discovered_customer_ids(payload), payload)
+        mock_discover_customer_ids.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
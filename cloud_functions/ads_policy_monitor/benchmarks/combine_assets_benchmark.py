@@ -0,0 +1,191 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmark for combining the asset reports.
+
+Compares google_ads.combine_assets_reports with the previous implementation,
+which converted, grouped and concatenated each report one at a time as
+dataframes.
+
+Run from the cloud function directory:
+
+    python -m benchmarks.combine_assets_benchmark --rows 1000000
+"""
+import argparse
+import time
+import tracemalloc
+from typing import Callable, List
+
+from gaarf.report import GaarfReport
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pandas.testing import assert_frame_equal
+
+import google_ads
+
+# The topics as returned by GAARF, a list per row
+TOPICS = [
+    ['TRADEMARKS_IN_AD_TEXT'],
+    ['TRADEMARKS_IN_AD_TEXT', 'TRADEMARKS'],
+    ['DESTINATION_NOT_WORKING'],
+    ['INSUFFICIENT_ORIGINAL_CONTENT', 'UNAVAILABLE_VIDEO'],
+    [],
+]
+
+
+def legacy_combine_assets_reports(
+        gaarf_reports: List[GaarfReport]) -> GaarfReport:
+    """The implementation of combine_assets_reports before vectorization."""
+    combined_assets_report = pd.DataFrame()
+    for report in gaarf_reports:
+        report_df = report.to_pandas()
+
+        if report_df.empty or report_df["customer_id"][0] == 0:
+            continue
+
+        if ("ad_group_id" in report_df.keys() and
+                "campaign_id" in report_df.keys()):
+            report_df["asset_level"] = "Ad Group"
+        elif ("campaign_id" in report_df.keys()):
+            report_df["asset_level"] = "Campaign"
+            report_df["ad_group_id"] = None
+        else:
+            report_df["asset_level"] = "Account"
+            report_df["ad_group_id"] = None
+            report_df["campaign_id"] = None
+
+        report_df[
+            "asset_policy_summary_policy_topic_entries_topics"] = report_df[
+                "asset_policy_summary_policy_topic_entries_topics"].apply(
+                    lambda x: x if isinstance(x, str) else ' | '.join(x))
+
+        report_df = report_df.groupby(
+            google_ads.GROUP_BY_ASSET_POLICY_COLUMNS).agg(
+                example_campaign_id=('campaign_id', 'first'),
+                example_ad_group_id=('ad_group_id', 'first'),
+                counts=('asset_id', 'count')).reset_index()
+
+        combined_assets_report = pd.concat([combined_assets_report, report_df])
+
+    if ('example_campaign_id' in combined_assets_report.keys() or
+            'example_ad_group_id' in combined_assets_report.keys()):
+        combined_assets_report['example_campaign_id'] = combined_assets_report[
+            'example_campaign_id'].fillna(0)
+        combined_assets_report['example_ad_group_id'] = combined_assets_report[
+            'example_ad_group_id'].fillna(0)
+
+    return GaarfReport.from_pandas(combined_assets_report)
+
+
+def generate_asset_report(num_rows: int, level_columns: List[str],
+                          rng: np.random.Generator) -> GaarfReport:
+    """Generate a synthetic asset report in the shape of the GAQL output.
+
+    Assets are shared across many campaigns and ad groups of an account, so
+    the rows collapse to a much smaller number of asset groups.
+    """
+    customer_ids = rng.integers(1, 200, num_rows) * 1000000
+    asset_ids = customer_ids + rng.integers(1, 100, num_rows)
+    data = {
+        'event_date': ['2024-01-01'] * num_rows,
+        'customer_id':
+            customer_ids,
+        'customer_descriptive_name': [
+            f'Account {customer_id}' for customer_id in customer_ids
+        ],
+        'asset_id':
+            asset_ids,
+        'asset_source':
+            np.where(asset_ids % 7 == 0, 'AUTOMATICALLY_CREATED', 'ADVERTISER'),
+        'asset_type':
+            np.array(['CALLOUT', 'SITELINK', 'IMAGE', 'TEXT'])[asset_ids % 4],
+        'asset_policy_summary_review_status': ['REVIEWED'] * num_rows,
+        'asset_policy_summary_policy_topic_entries_topics': [
+            TOPICS[index] for index in asset_ids % len(TOPICS)
+        ],
+        'asset_policy_summary_approval_status':
+            np.array(
+                ['APPROVED_LIMITED', 'DISAPPROVED', 'AREA_OF_INTEREST_ONLY'])
+            [asset_ids % 3],
+    }
+    for column in level_columns:
+        data[column] = rng.integers(1, 10000, num_rows)
+    return GaarfReport.from_pandas(pd.DataFrame(data))
+
+
+def sort_report(report_df: pd.DataFrame) -> pd.DataFrame:
+    """Sort a combined report by its group by columns, to compare it."""
+    return report_df.astype(object).sort_values(
+        google_ads.GROUP_BY_ASSET_POLICY_COLUMNS, ignore_index=True)
+
+
+def measure(function: Callable, *args, repeat: int = 3) -> tuple:
+    """Return the output, the best time in seconds and the peak memory in MB.
+
+    The memory is traced on a separate run, as tracing slows the function.
+    It's the peak of the Python allocations plus the peak of the Arrow
+    allocations, which tracemalloc doesn't see.
+    """
+    seconds = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = function(*args)
+        seconds = min(seconds, time.perf_counter() - start)
+    default_pool = pa.default_memory_pool()
+    arrow_pool = pa.proxy_memory_pool(default_pool)
+    pa.set_memory_pool(arrow_pool)
+    tracemalloc.start()
+    try:
+        function(*args)
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        pa.set_memory_pool(default_pool)
+    peak_memory = (peak_bytes + arrow_pool.max_memory()) / 1024**2
+    return output, seconds, peak_memory
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    rows_per_report = args.rows // 3
+    reports = [
+        generate_asset_report(rows_per_report, ['campaign_id', 'ad_group_id'],
+                              rng),
+        generate_asset_report(rows_per_report, ['campaign_id'], rng),
+        generate_asset_report(args.rows - 2 * rows_per_report, [], rng),
+    ]
+
+    legacy_report, legacy_seconds, legacy_memory = measure(
+        legacy_combine_assets_reports, reports)
+    report, seconds, memory = measure(google_ads.combine_assets_reports,
+                                      reports)
+
+    # The groups are in the order of their first row, not sorted
+    assert_frame_equal(sort_report(report),
+                       sort_report(legacy_report.to_pandas()),
+                       check_dtype=False)
+    print(f'Combined {args.rows:,} asset rows into {len(report):,}')
+    print(f'Previous implementation: {legacy_seconds:.2f}s, '
+          f'peak {legacy_memory:.0f}MB')
+    print(f'Current implementation:  {seconds:.2f}s, peak {memory:.0f}MB')
+    print(f'Speedup: {legacy_seconds / seconds:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
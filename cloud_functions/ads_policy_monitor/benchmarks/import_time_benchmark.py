@@ -0,0 +1,101 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmark for the import time of the Cloud Function entry point.
+
+Profiles `import main` with `python -X importtime` and fails if it takes longer
+than the limit, or if it imports one of the heavy dependencies that are meant
+to be loaded lazily.
+
+Run from the cloud function directory:
+
+    python -m benchmarks.import_time_benchmark --max-seconds 1
+"""
+import argparse
+import collections
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+# Only needed once a report runs, must not be imported by main
+LAZY_MODULES = [
+    'gaarf',
+    'google.ads.googleads',
+    'google.cloud.bigquery',
+    'numpy',
+    'pandas',
+]
+
+
+def profile_import(module: str) -> List[Tuple[str, int, int]]:
+    """Import a module in a new interpreter with -X importtime.
+
+    Returns:
+        The name, self & cumulative time in microseconds of each import.
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True,
+        text=True,
+        check=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        imports.append((name.strip(), int(self_us), int(cumulative_us)))
+    return imports
+
+
+def get_time_by_package(imports: List[Tuple[str, int, int]]) -> Dict[str, int]:
+    """Add up the self time of the imports by top level package."""
+    time_by_package = collections.Counter()
+    for name, self_us, _ in imports:
+        time_by_package[name.split('.')[0]] += self_us
+    return time_by_package
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--module', default='main')
+    parser.add_argument('--max-seconds', type=float, default=1.0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    # The first import is slower while the files are read from disk
+    runs = [profile_import(args.module) for _ in range(args.repeat)]
+    imports = min(runs, key=lambda run: run[-1][2])
+    seconds = imports[-1][2] / 1e6
+
+    print(f'import {args.module}: {seconds:.2f}s, {len(imports)} modules')
+    for package, self_us in get_time_by_package(imports).most_common(args.top):
+        print(f'  {package:<30} {self_us / 1e3:8.1f}ms')
+
+    imported = {name for name, _, _ in imports}
+    eager_modules = [
+        module for module in LAZY_MODULES
+        if any(name == module or name.startswith(f'{module}.')
+               for name in imported)
+    ]
+    failures = []
+    if eager_modules:
+        failures.append(f'imports {", ".join(eager_modules)} eagerly')
+    if seconds > args.max_seconds:
+        failures.append(f'takes longer than {args.max_seconds:.2f}s')
+    if failures:
+        sys.exit(f'Regression: import {args.module} {" and ".join(failures)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmark for the bytes scanned by the dashboard views.
+
+Compares the dry-run estimates of typical dashboard queries on the views with
+the same queries on the tables they are materialized to. Dry runs are free,
+but need the views and tables to exist in the dataset.
+
+Run from the cloud function directory:
+
+    python -m benchmarks.materialized_views_benchmark \
+        --project my_project --dataset my_dataset
+"""
+import argparse
+
+from google.cloud import bigquery
+
+import bigquery as bq
+
+# Typical dashboard queries, for each of the views
+DASHBOARD_QUERIES = {
+    'LatestAdPolicyData': [
+        'SELECT * FROM `{source}`',
+        'SELECT customer_id, ad_group_ad_policy_summary_approval_status, '
+        'COUNT(*) FROM `{source}` GROUP BY 1, 2',
+        'SELECT topic, COUNT(*) FROM `{source}`, '
+        'UNNEST(ad_policy_topics) AS topic GROUP BY 1',
+    ],
+    'LatestAssetPolicyData': [
+        'SELECT * FROM `{source}`',
+        'SELECT customer_id, asset_policy_summary_approval_status, '
+        'SUM(counts) FROM `{source}` GROUP BY 1, 2',
+        'SELECT topic, SUM(counts) FROM `{source}`, '
+        'UNNEST(asset_policy_topics) AS topic GROUP BY 1',
+    ],
+    'NoApprovedAdsAdGroup': [
+        'SELECT * FROM `{source}`',
+        'SELECT customer_id, COUNT(*) FROM `{source}` GROUP BY 1',
+    ],
+}
+
+
+def get_bytes_processed(client: bigquery.Client, query: str) -> int:
+    """Get the dry-run estimate of the bytes a query scans."""
+    job_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
+    return client.query(query, job_config=job_config).total_bytes_processed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--project', required=True)
+    parser.add_argument('--dataset', required=True)
+    args = parser.parse_args()
+
+    client = bigquery.Client(args.project)
+    total_view_bytes = 0
+    total_table_bytes = 0
+    for view_name, queries in DASHBOARD_QUERIES.items():
+        table_name = bq.MATERIALIZED_VIEWS[view_name]
+        for query in queries:
+            view_bytes = get_bytes_processed(
+                client,
+                query.format(
+                    source=f'{args.project}.{args.dataset}.{view_name}'))
+            table_bytes = get_bytes_processed(
+                client,
+                query.format(
+                    source=f'{args.project}.{args.dataset}.{table_name}'))
+            total_view_bytes += view_bytes
+            total_table_bytes += table_bytes
+            print(f'{query.format(source=view_name)}')
+            print(f'  view: {view_bytes / 1024**2:,.1f}MiB, '
+                  f'table: {table_bytes / 1024**2:,.1f}MiB')
+    print(f'Total view: {total_view_bytes / 1024**2:,.1f}MiB, '
+          f'table: {total_table_bytes / 1024**2:,.1f}MiB')
+
+
+if __name__ == '__main__':
+    main()
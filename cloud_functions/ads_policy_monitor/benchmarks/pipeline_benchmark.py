@@ -0,0 +1,392 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""End to end benchmark of main.run, at several report sizes.
+
+The Google Ads API is replaced by a fake report fetcher that serves synthetic
+reports, and BigQuery by the local Parquet writer of local_output_path, so the
+whole pipeline runs offline. Each size runs in a new process, for its own peak
+memory, and records the time of each stage, the peak RSS and the rows per
+second. The peak RSS includes the synthetic reports held by the fake fetcher.
+The results are compared with a stored baseline, and the benchmark
+exits with an error if a size got slower or uses more memory than the
+tolerance allows.
+
+Run from the cloud function directory:
+
+    python -m benchmarks.pipeline_benchmark --rows 10000 100000 1000000
+
+and store new results as the baseline with --update-baseline.
+"""
+import argparse
+import collections
+import concurrent.futures
+import json
+import logging
+import multiprocessing
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List
+from unittest import mock
+
+from gaarf.report import GaarfReport
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+import bigquery
+import google_ads
+import main as pipeline
+import models
+import rollups
+import synthetic
+import utils
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__),
+                             'pipeline_baseline.json')
+# The metrics compared with the baseline, higher is worse for all of them
+BASELINE_METRICS = ['total_seconds', 'peak_rss_mib']
+
+# config.json ships without rollups, the benchmark runs with these
+ROLLUPS = {
+    'AdPolicyData': [
+        models.RollupConfig(table_name='AdPolicyDataCustomerRollup',
+                            group_by_columns=[
+                                'event_date', 'customer_id',
+                                'customer_descriptive_name',
+                                'ad_group_ad_policy_summary_approval_status'
+                            ],
+                            sum_columns=['impressions', 'clicks']),
+        models.RollupConfig(table_name='AdPolicyDataCampaignRollup',
+                            group_by_columns=[
+                                'event_date', 'customer_id', 'campaign_id',
+                                'campaign_name',
+                                'ad_group_ad_policy_summary_approval_status'
+                            ],
+                            sum_columns=['impressions', 'clicks']),
+        models.RollupConfig(table_name='AdPolicyDataTopicRollup',
+                            group_by_columns=[
+                                'event_date', 'customer_id', 'policy_topic',
+                                'ad_group_ad_policy_summary_approval_status'
+                            ],
+                            sum_columns=['impressions', 'clicks']),
+    ],
+    'AssetPolicyData': [
+        models.RollupConfig(table_name='AssetPolicyDataCustomerRollup',
+                            group_by_columns=[
+                                'event_date', 'customer_id',
+                                'customer_descriptive_name', 'asset_level',
+                                'asset_policy_summary_approval_status'
+                            ]),
+        models.RollupConfig(table_name='AssetPolicyDataTopicRollup',
+                            group_by_columns=[
+                                'event_date', 'customer_id', 'policy_topic',
+                                'asset_policy_summary_approval_status'
+                            ]),
+    ],
+}
+
+ASSET_LEVEL_RESOURCES = {
+    'Ad Group': 'ad_group_asset',
+    'Campaign': 'campaign_asset',
+    'Account': 'customer_asset',
+}
+
+
+class FakeReportFetcher:
+    """A stand-in for AdsReportFetcher that serves synthetic reports.
+
+    The rows of each GAQL resource are kept per account as GAARF results, so
+    a fetch only has to gather the rows of the accounts it asks for.
+    """
+
+    def __init__(self, reports: Dict[str, pd.DataFrame]):
+        self.column_names = {}
+        self.results = {}
+        for resource, report_df in reports.items():
+            self.column_names[resource] = list(report_df.columns)
+            rows = report_df.to_numpy(dtype=object).tolist()
+            results = collections.defaultdict(list)
+            for customer_id, row in zip(report_df['customer_id'], rows):
+                results[customer_id].append(row)
+            self.results[resource] = results
+
+    def fetch(self, query: str, customer_ids, **kwargs) -> GaarfReport:
+        del kwargs  # Unused
+        resource = re.search(r'FROM\s+(\w+)', query).group(1)
+        if not isinstance(customer_ids, list):
+            customer_ids = [customer_ids]
+        if resource == 'customer':
+            # The Ocid query, see gaarf.builtin_queries.get_ocid_mapping
+            return GaarfReport(results=[[
+                int(customer_id),
+                f'https://ads.google.com/aw/overview?ocid={customer_id}'
+            ] for customer_id in customer_ids],
+                               column_names=['account_id', 'url'])
+        results = self.results[resource]
+        return GaarfReport(results=[
+            row for customer_id in customer_ids
+            for row in results.get(int(customer_id), [])
+        ],
+                           column_names=self.column_names[resource])
+
+
+def generate_reports(num_rows: int, seed: int) -> Dict[str, pd.DataFrame]:
+    """Generate the rows returned by the GAQL queries of the reports.
+
+    The policy topics are lists, as returned by GAARF. The asset rows are
+    split into the queries of their level.
+    """
+    rng = np.random.default_rng(seed)
+    num_customers = max(1, num_rows // synthetic.ROWS_PER_CUSTOMER)
+    ad_df = synthetic.generate_ad_policy_data(num_rows, num_customers, rng,
+                                              utils.get_current_date())
+    ad_df = _with_topic_lists(
+        ad_df, 'ad_group_ad_policy_summary_policy_topic_entries')
+
+    asset_df = synthetic.generate_asset_policy_data(num_rows,
+                                                    num_customers, rng,
+                                                    utils.get_current_date())
+    asset_df = _with_topic_lists(
+        asset_df, google_ads.ASSET_POLICY_TOPICS_COLUMN).rename(columns={
+            'example_campaign_id': 'campaign_id',
+            'example_ad_group_id': 'ad_group_id',
+        })
+    reports = {'ad_group_ad': ad_df}
+    for level, resource in ASSET_LEVEL_RESOURCES.items():
+        level_df = asset_df[asset_df['asset_level'] == level].drop(
+            columns=['asset_level', 'counts'])
+        if level != 'Ad Group':
+            level_df = level_df.drop(columns='ad_group_id')
+        if level == 'Account':
+            level_df = level_df.drop(columns='campaign_id')
+        reports[resource] = level_df
+    return reports
+
+
+class StageTimer:
+    """Adds up the time & output rows of the functions of each stage.
+
+    Reports run concurrently, so the time of a stage is the sum over all of
+    its calls, and can be more than the wall time of the run.
+    """
+
+    def __init__(self):
+        self.seconds = collections.Counter()
+        self.rows = collections.Counter()
+        self._lock = threading.Lock()
+        self._patches = []
+
+    def wrap(self, owner, name: str, stage: str) -> None:
+        function = getattr(owner, name)
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            output = function(*args, **kwargs)
+            with self._lock:
+                self.seconds[stage] += time.perf_counter() - start
+                if isinstance(output, (pd.DataFrame, pa.Table, GaarfReport)):
+                    self.rows[stage] += len(output)
+                elif isinstance(output, dict):
+                    self.rows[stage] += sum(
+                        len(value)
+                        for value in output.values()
+                        if isinstance(value, pd.DataFrame))
+            return output
+
+        patch = mock.patch.object(owner, name, timed)
+        patch.start()
+        self._patches.append(patch)
+
+    def count_rows(self, owner, name: str, stage: str,
+                   rows: Callable[..., int]) -> None:
+        """Add the rows of the calls of a function to a stage, without timing.
+
+        For the functions called by the timed function of a stage, when its
+        output doesn't have the rows. rows gets the output of each call,
+        followed by its arguments.
+        """
+        function = getattr(owner, name)
+
+        def counted(*args, **kwargs):
+            output = function(*args, **kwargs)
+            with self._lock:
+                self.rows[stage] += rows(output, *args, **kwargs)
+            return output
+
+        patch = mock.patch.object(owner, name, counted)
+        patch.start()
+        self._patches.append(patch)
+
+    def stop(self) -> None:
+        for patch in self._patches:
+            patch.stop()
+
+
+def run_benchmark(num_rows: int, seed: int,
+                  customer_ids_per_shard: int) -> Dict[str, float]:
+    """Run the pipeline on reports of num_rows rows in this process.
+
+    Returns:
+        The metrics of the run.
+    """
+    logging.disable(logging.INFO)
+    fetcher = FakeReportFetcher(generate_reports(num_rows, seed))
+    customer_ids = sorted(fetcher.results['ad_group_ad'])
+
+    timer = StageTimer()
+    timer.wrap(google_ads, 'fetch_sharded', 'fetch')
+    timer.wrap(google_ads, 'report_to_dataframe', 'convert')
+    timer.wrap(google_ads, 'report_to_table', 'convert')
+    timer.wrap(google_ads, 'concat_assets_reports', 'combine')
+    timer.wrap(google_ads, 'extract_time_series', 'time_series')
+    timer.wrap(rollups, 'compute_rollups', 'rollups')
+    # The commit returns the load seconds, the rows are those of the writes
+    timer.wrap(bigquery.WriteBatch, 'commit', 'write')
+    timer.count_rows(bigquery.WriteBatch, '_stage', 'write',
+                     lambda _, batch, report_df, *args: len(report_df))
+    timer.count_rows(bigquery.WriteBatch, 'stage_stream', 'write',
+                     lambda num_rows, *args: num_rows)
+    report_configs = {
+        table_name:
+            report_config.model_copy(
+                update={'rollups': ROLLUPS.get(table_name)})
+        for table_name, report_config in utils.load_report_configs().items()
+    }
+    with tempfile.TemporaryDirectory() as directory, \
+            mock.patch.object(utils, 'load_report_configs',
+                              return_value=report_configs), \
+            mock.patch.object(google_ads, 'get_ads_client'), \
+            mock.patch.object(google_ads, 'AdsReportFetcher',
+                              return_value=fetcher):
+        payload = models.Payload(project_id='benchmark',
+                                 bq_output_dataset='benchmark',
+                                 region='local',
+                                 google_ads_login_customer_id=1,
+                                 customer_ids=customer_ids,
+                                 max_concurrent_reports=3,
+                                 customer_ids_per_shard=customer_ids_per_shard,
+                                 local_output_path=directory)
+        start = time.perf_counter()
+        pipeline.run(payload)
+        total_seconds = time.perf_counter() - start
+    timer.stop()
+
+    metrics = {
+        'rows': num_rows,
+        'total_seconds': total_seconds,
+        'peak_rss_mib': utils.get_peak_memory_mib(),
+        # The ad & asset reports
+        'rows_per_second': 2 * num_rows / total_seconds,
+    }
+    for stage, seconds in timer.seconds.items():
+        metrics[f'{stage}_seconds'] = seconds
+        metrics[f'{stage}_rows'] = timer.rows[stage]
+    return metrics
+
+
+def run_in_new_process(function: Callable, *args) -> Dict[str, float]:
+    """Run a function in a new process, so its peak memory is its own."""
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(function, *args).result()
+
+
+def find_regressions(results: Dict[str, Dict[str, float]],
+                     baseline: Dict[str, Dict[str, float]],
+                     tolerance: float) -> List[str]:
+    """Compare the results with the baseline of the same sizes.
+
+    Returns:
+        A description of each metric that is worse than the baseline by more
+        than the tolerance.
+    """
+    regressions = []
+    for size, metrics in results.items():
+        if size not in baseline:
+            continue
+        for metric in BASELINE_METRICS:
+            limit = baseline[size][metric] * (1 + tolerance)
+            if metrics[metric] > limit:
+                regressions.append(
+                    f'{size} rows: {metric} {metrics[metric]:.2f}'
+                    f' > {limit:.2f}')
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows',
+                        type=int,
+                        nargs='+',
+                        default=[10000, 100000, 1000000])
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--customer-ids-per-shard', type=int, default=None)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--tolerance', type=float, default=0.3)
+    parser.add_argument('--update-baseline', action='store_true')
+    args = parser.parse_args()
+
+    results = {}
+    for num_rows in args.rows:
+        metrics = run_in_new_process(run_benchmark, num_rows, args.seed,
+                                     args.customer_ids_per_shard)
+        results[str(num_rows)] = metrics
+        stages = ', '.join(
+            f'{name[:-len("_seconds")]} {seconds:.2f}s'
+            for name, seconds in metrics.items()
+            if name.endswith('_seconds') and name != 'total_seconds')
+        print(f'{num_rows:,} rows: {metrics["total_seconds"]:.2f}s, '
+              f'{metrics["rows_per_second"]:,.0f} rows/s, '
+              f'peak {metrics["peak_rss_mib"]:.0f}MiB ({stages})')
+
+    if args.update_baseline:
+        baseline = {
+            size: {
+                name: round(value, 3) for name, value in metrics.items()
+            } for size, metrics in results.items()
+        }
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f'Updated the baseline {args.baseline}')
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f'No baseline at {args.baseline}, run with --update-baseline')
+        return
+    with open(args.baseline, 'r') as f:
+        baseline = json.load(f)
+    regressions = find_regressions(results, baseline, args.tolerance)
+    if regressions:
+        sys.exit('Regressions against the baseline:\n' + '\n'.join(regressions))
+    print(f'No regressions against the baseline, within {args.tolerance:.0%}')
+
+
+def _with_topic_lists(report_df: pd.DataFrame, column: str) -> pd.DataFrame:
+    return report_df.assign(
+        **{
+            column: [
+                list(google_ads.split_policy_topics(topic))
+                for topic in report_df[column]
+            ]
+        })
+
+
+if __name__ == '__main__':
+    main()
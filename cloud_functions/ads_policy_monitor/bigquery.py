@@ -12,37 +12,1218 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """Utilities for working with the BigQuery."""
+from collections import abc
+import concurrent.futures
+import datetime
+import glob
+import io
+import json
 import logging
+import os
+import shutil
 import sys
-from gaarf.report import GaarfReport
+import threading
+import time
+import uuid
+from typing import Callable, Collection, Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
 from gaarf.io.writers.bigquery_writer import BigQueryWriter
+from google.api_core import exceptions
+from google.cloud import bigquery
+from google.cloud.bigquery import format_options
+import pandas as pd
+import pyarrow as pa
+from pyarrow import compute
+from pyarrow import parquet
 import models
+import telemetry
+import utils
 
 logging.basicConfig(stream=sys.stdout)
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# BigQuery column types for the pandas dtype kinds, anything else is a STRING
+BIGQUERY_TYPES = {'b': 'BOOL', 'i': 'INT64', 'u': 'INT64', 'f': 'FLOAT64'}
 
-def write_gaarf_report_to_bigquery(payload: models.Payload,
-                                   gaarf_report: GaarfReport,
-                                   report_config: models.ReportConfig,
-                                   table_name: str,
-                                   bq_writer: BigQueryWriter = None) -> None:
-    """Output a GAARF report to BigQuery.
+# Clients are reused until the time to live, the credentials don't change
+BIGQUERY_CLIENT_TTL_SECONDS = 3600
+
+client_pool = utils.ClientPool(BIGQUERY_CLIENT_TTL_SECONDS)
+
+# The schemas of the tables, a link to bigquery/schema at the root of the repo
+SCHEMA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema')
+SCHEMA_FILENAMES = {
+    'Ocid': 'ocid_schema.json',
+    'AdPolicyData': 'ad_policy_data_schema.json',
+    'AdPolicyDataTimeSeries': 'ad_policy_time_series_schema.json',
+    'AdPolicyDataChanges': 'ad_policy_data_changes_schema.json',
+    'AssetPolicyData': 'asset_policy_data_schema.json',
+    'AssetPolicyDataTimeSeries': 'asset_policy_time_series_schema.json',
+    'AssetPolicyDataChanges': 'asset_policy_data_changes_schema.json',
+}
+
+# Arrow types for the BigQuery column types
+ARROW_TYPES = {
+    'STRING': pa.string(),
+    'INTEGER': pa.int64(),
+    'INT64': pa.int64(),
+    'FLOAT': pa.float64(),
+    'FLOAT64': pa.float64(),
+    'BOOLEAN': pa.bool_(),
+    'BOOL': pa.bool_(),
+}
+
+# Replaces the partition of the run date, so reruns don't duplicate the rows
+WRITE_TRUNCATE_PARTITION = 'WRITE_TRUNCATE_PARTITION'
+# The date of the rows, for tables that are not partitioned by a column
+PARTITION_DATE_COLUMN = 'event_date'
+# The account of the rows of the reports, see copy_snapshot
+CUSTOMER_ID_COLUMN = 'customer_id'
+
+# The views queried by the dashboards, and the tables they are materialized to
+MATERIALIZED_VIEWS = {
+    'LatestAdPolicyData': 'LatestAdPolicyDataMaterialized',
+    'LatestAssetPolicyData': 'LatestAssetPolicyDataMaterialized',
+    'NoApprovedAdsAdGroup': 'NoApprovedAdsAdGroupMaterialized',
+}
+
+# Dashboards filter on the account, approval status & topics, so the policy
+# tables are clustered on them. Arrays can't be clustered on, so the topic
+# strings are used.
+AD_POLICY_CLUSTERING_FIELDS = [
+    'customer_id',
+    'ad_group_ad_policy_summary_approval_status',
+    'ad_group_ad_policy_summary_policy_topic_entries',
+]
+ASSET_POLICY_CLUSTERING_FIELDS = [
+    'customer_id',
+    'asset_policy_summary_approval_status',
+    'asset_policy_summary_policy_topic_entries_topics',
+]
+CLUSTERING_FIELDS = {
+    'AdPolicyData': AD_POLICY_CLUSTERING_FIELDS,
+    'AdPolicyDataChanges': AD_POLICY_CLUSTERING_FIELDS,
+    'AssetPolicyData': ASSET_POLICY_CLUSTERING_FIELDS,
+    'AssetPolicyDataChanges': ASSET_POLICY_CLUSTERING_FIELDS,
+    'LatestAdPolicyDataMaterialized': AD_POLICY_CLUSTERING_FIELDS,
+    'LatestAssetPolicyDataMaterialized': ASSET_POLICY_CLUSTERING_FIELDS,
+    'NoApprovedAdsAdGroupMaterialized': ['customer_id'],
+}
+# The tables partitioned by ingestion day, as in terraform/main.tf. The rollup
+# tables of the reports are partitioned too, see get_partitioned_tables.
+PARTITIONED_TABLES = [
+    'AdPolicyData',
+    'AdPolicyDataChanges',
+    'AssetPolicyData',
+    'AssetPolicyDataChanges',
+]
+MILLISECONDS_PER_DAY = 86400000
+# Staging tables are dropped once committed, the ones left behind by failed
+# runs & workers given up on expire well after the timeout of the function
+STAGING_EXPIRATION_HOURS = 24
+_STAGING_TABLE_OPTIONS = (
+    'OPTIONS (expiration_timestamp = TIMESTAMP_ADD(CURRENT_TIMESTAMP(), '
+    f'INTERVAL {STAGING_EXPIRATION_HOURS} HOUR))')
+
+# Appends to the same local table are numbered, so they can't run in parallel
+_local_write_lock = threading.Lock()
+
+
+class StagedWrite(NamedTuple):
+    """A write loaded to a staging table, to be copied to its destination."""
+    destination: str
+    staging_table: str
+    write_disposition: str
+    partition_date: str
+
+
+class DataFrameBigQueryWriter(BigQueryWriter):
+    """A GAARF BigQueryWriter that writes dataframes.
+
+    BigQueryWriter.write converts the GaarfReport to a dataframe on every
+    write, this loads the dataframe the report was already converted to. The
+    writers share the BigQuery client of their project & region.
+
+    Attributes:
+        partition_expiration_days: the partition expiration of the tables
+            created by the writer, see set_table_layout.
+        table_expiration_hours: the expiration of the tables created by
+            write_dataframe, e.g. for staging tables, or None to keep them.
+    """
+
+    def __init__(self,
+                 *args,
+                 partition_expiration_days: Optional[int] = None,
+                 table_expiration_hours: Optional[int] = None,
+                 **kwargs):
+        super().__init__(*args, **kwargs)
+        self.partition_expiration_days = partition_expiration_days
+        self.table_expiration_hours = table_expiration_hours
+
+    def _init_client(self) -> None:
+        if not self.client:
+            self.client = client_pool.get((self.project, self.location),
+                                          self._create_client)
+
+    def _create_client(self) -> bigquery.Client:
+        with telemetry.stage('create_bigquery_client'):
+            return bigquery.Client(self.project, location=self.location)
+
+    def _create_or_get_table(
+            self, table_name: str,
+            schema: List[bigquery.SchemaField]) -> bigquery.Table:
+        self._init_client()
+        try:
+            return self.client.get_table(table_name)
+        except exceptions.NotFound:
+            table = bigquery.Table(table_name, schema=schema)
+            if self.table_expiration_hours:
+                table.expires = (
+                    datetime.datetime.now(datetime.timezone.utc) +
+                    datetime.timedelta(hours=self.table_expiration_hours))
+            return self.client.create_table(table, exists_ok=True)
+
+    def write_dataframe(self,
+                        report_df: pd.DataFrame,
+                        destination: str,
+                        schema_name: Optional[str] = None) -> str:
+        """Load a dataframe to the destination table.
+
+        The load job is waited on, so its errors are raised here and the next
+        write to the table starts after it.
+
+        Args:
+            report_df: the dataframe to write.
+            destination: name of the table to write to.
+            schema_name: unused, CSV loads take the schema of the dtypes.
+
+        Returns:
+            The table the data was written to.
+        """
+        report_df = format_arrays(report_df, self.array_separator)
+        schema = get_bigquery_schema(report_df)
+        table = self._create_or_get_table(f'{self.dataset_id}.{destination}',
+                                          schema)
+        job_config = bigquery.LoadJobConfig(
+            write_disposition=self.write_disposition,
+            schema=schema,
+            source_format='CSV',
+        )
+        logger.info('Writing %d rows of data to %s', len(report_df),
+                    destination)
+        try:
+            self.client.load_table_from_dataframe(
+                dataframe=report_df, destination=table,
+                job_config=job_config).result()
+        except Exception as e:
+            raise ValueError(
+                f'Unable to save data to BigQuery! {str(e)}') from e
+        return f'[BigQuery] - at {self.dataset_id}.{destination}'
+
+    def commit_staged(self, staged_writes: List[StagedWrite]) -> None:
+        """Copy staging tables to their destinations in one transaction.
+
+        The write disposition of the first write to a destination applies, the
+        other writes to it are appended.
+
+        Args:
+            staged_writes: the staging tables & their destinations.
+        """
+        self._init_client()
+        statements = ['BEGIN TRANSACTION;']
+        tables = {}
+        for staged_write in staged_writes:
+            staging_table = f'{self.dataset_id}.{staged_write.staging_table}'
+            destination = f'{self.dataset_id}.{staged_write.destination}'
+            schema = self.client.get_table(staging_table).schema
+            if destination in tables:
+                # The other writes to the destination are added to the first
+                table = tables[destination]
+            else:
+                table = bigquery.Table(destination, schema=schema)
+                set_table_layout(table, self.partition_expiration_days)
+                # Tables can't be created in a transaction
+                table = self.client.create_table(table, exists_ok=True)
+                tables[destination] = table
+                if staged_write.write_disposition == 'WRITE_TRUNCATE':
+                    statements.append(
+                        f'DELETE FROM `{destination}` WHERE TRUE;')
+                elif staged_write.write_disposition == WRITE_TRUNCATE_PARTITION:
+                    partition_filter = get_partition_filter(
+                        table, staged_write.partition_date)
+                    statements.append(
+                        f'DELETE FROM `{destination}` WHERE {partition_filter};'
+                    )
+            columns = ', '.join(f'`{field.name}`' for field in schema)
+            if not columns:
+                continue
+            if (table.time_partitioning is not None and
+                    table.time_partitioning.field is None):
+                # Into the partition of the run date, rather than of the UTC
+                # date of the commit, so the run replaces its own partition
+                statements.append(
+                    f'INSERT INTO `{destination}` (_PARTITIONTIME, {columns}) '
+                    f"SELECT TIMESTAMP('{staged_write.partition_date}'), "
+                    f'{columns} FROM `{staging_table}`;')
+            else:
+                statements.append(f'INSERT INTO `{destination}` ({columns}) '
+                                  f'SELECT {columns} FROM `{staging_table}`;')
+        statements.append('COMMIT TRANSACTION;')
+        try:
+            self.client.query('\n'.join(statements)).result()
+        except Exception as e:
+            raise ValueError(
+                f'Unable to save data to BigQuery! {str(e)}') from e
+
+    def aggregate_staged(self, staged_writes: List[StagedWrite],
+                         staging_table: str, sum_columns: List[str]) -> None:
+        """Add up staging tables of counts into a new staging table.
+
+        Args:
+            staged_writes: the staging tables to add up, with the same columns.
+            staging_table: name of the staging table to create.
+            sum_columns: the columns to add up, grouped by all the others.
+        """
+        self._init_client()
+        schema = self.client.get_table(
+            f'{self.dataset_id}.{staged_writes[0].staging_table}').schema
+        columns = [field.name for field in schema]
+        group_by = ', '.join(
+            f'`{column}`' for column in columns if column not in sum_columns)
+        select = ', '.join(f'SUM(`{column}`) AS `{column}`' if column in
+                           sum_columns else f'`{column}`' for column in columns)
+        union = ' UNION ALL '.join(
+            f'SELECT {", ".join(f"`{column}`" for column in columns)} '
+            f'FROM `{self.dataset_id}.{staged_write.staging_table}`'
+            for staged_write in staged_writes)
+        self.client.query(
+            f'CREATE TABLE `{self.dataset_id}.{staging_table}` '
+            f'{_STAGING_TABLE_OPTIONS} AS SELECT {select} FROM ({union}) GROUP BY {group_by}'
+        ).result()
+
+    def copy_snapshot(self, source: str, staging_table: str, snapshot_date: str,
+                      customer_ids: List[int], event_date: str) -> None:
+        """Copy the rows of accounts on a date into a new staging table.
+
+        The rows are copied by BigQuery, with their event date set to
+        event_date, so they are written again without being downloaded.
+
+        Args:
+            source: name of the table to copy the rows of.
+            staging_table: name of the staging table to create.
+            snapshot_date: the event date of the rows to copy.
+            customer_ids: the accounts to copy the rows of.
+            event_date: the event date of the copies.
+        """
+        self._init_client()
+        job_config = bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ScalarQueryParameter('snapshot_date', 'STRING',
+                                          snapshot_date),
+            bigquery.ScalarQueryParameter('event_date', 'STRING', event_date),
+            bigquery.ArrayQueryParameter('customer_ids', 'INT64', customer_ids),
+        ])
+        self.client.query(
+            f'CREATE TABLE `{self.dataset_id}.{staging_table}` '
+            f'{_STAGING_TABLE_OPTIONS} AS SELECT * REPLACE (@event_date AS {PARTITION_DATE_COLUMN}) '
+            f'FROM `{self.dataset_id}.{source}` '
+            f'WHERE {self._get_snapshot_filter(source, snapshot_date)} '
+            f'AND {CUSTOMER_ID_COLUMN} IN UNNEST(@customer_ids)',
+            job_config=job_config).result()
+
+    def count_snapshot(self, source: str, snapshot_date: str,
+                       customer_ids: List[int],
+                       group_by: List[str]) -> pd.DataFrame:
+        """Count the rows of accounts on a date, by the group by columns.
+
+        Args:
+            source: name of the table to count the rows of.
+            snapshot_date: the event date of the rows to count.
+            customer_ids: the accounts to count the rows of.
+            group_by: the columns to count the rows by.
+
+        Returns:
+            A dataframe of the group by columns and the counts.
+        """
+        self._init_client()
+        job_config = bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ScalarQueryParameter('snapshot_date', 'STRING',
+                                          snapshot_date),
+            bigquery.ArrayQueryParameter('customer_ids', 'INT64', customer_ids),
+        ])
+        columns = ', '.join(f'`{column}`' for column in group_by)
+        rows = self.client.query(
+            f'SELECT {columns}, COUNT(*) AS counts '
+            f'FROM `{self.dataset_id}.{source}` '
+            f'WHERE {self._get_snapshot_filter(source, snapshot_date)} '
+            f'AND {CUSTOMER_ID_COLUMN} IN UNNEST(@customer_ids) '
+            f'GROUP BY {columns}',
+            job_config=job_config).result()
+        return pd.DataFrame.from_records([row.values() for row in rows],
+                                         columns=[*group_by, 'counts'])
+
+    def _get_snapshot_filter(self, source: str, snapshot_date: str) -> str:
+        # The event_date column isn't the partitioning column of partitioned
+        # tables, so their partitions are filtered as well, to not scan the
+        # whole table
+        date_filter = f'{PARTITION_DATE_COLUMN} = @snapshot_date'
+        table = self.client.get_table(f'{self.dataset_id}.{source}')
+        if table.time_partitioning is None:
+            return date_filter
+        partition_filter = get_partition_filter(table, snapshot_date)
+        return f'{partition_filter} AND {date_filter}'
+
+    def drop_staged(self, staged_writes: List[StagedWrite]) -> None:
+        """Delete the staging tables."""
+        self._init_client()
+        for staged_write in staged_writes:
+            self.client.delete_table(
+                f'{self.dataset_id}.{staged_write.staging_table}',
+                not_found_ok=True)
+
+
+class ParquetBigQueryWriter(DataFrameBigQueryWriter):
+    """A writer that loads dataframes to BigQuery as Parquet.
+
+    The dataframe is converted to Arrow with the explicit schema of the table,
+    and staged in memory as a single Parquet file for one load job. Parquet is
+    typed & compressed, so the load is smaller and skips parsing CSV.
+    """
+
+    def write_dataframe(self,
+                        report_df: pd.DataFrame,
+                        destination: str,
+                        schema_name: Optional[str] = None) -> str:
+        """Load a dataframe to the destination table.
+
+        Args:
+            report_df: the dataframe to write.
+            destination: name of the table to write to.
+            schema_name: the table to take the schema of, if not the
+                destination, e.g. for staging tables.
+
+        Returns:
+            The table the data was written to.
+        """
+        schema = get_table_schema(schema_name or destination, report_df)
+        arrow_table = to_arrow_table(report_df, schema, self.array_separator)
+        table = self._create_or_get_table(f'{self.dataset_id}.{destination}',
+                                          schema)
+        job_config = bigquery.LoadJobConfig(
+            write_disposition=self.write_disposition,
+            schema=schema,
+            source_format='PARQUET',
+        )
+        # Load the Arrow lists as REPEATED columns, not as records of items
+        parquet_options = format_options.ParquetOptions()
+        parquet_options.enable_list_inference = True
+        job_config.parquet_options = parquet_options
+        parquet_file = io.BytesIO()
+        parquet.write_table(arrow_table, parquet_file)
+        parquet_file.seek(0)
+        logger.info('Writing %d rows of data to %s as %d bytes of Parquet',
+                    len(report_df), destination,
+                    parquet_file.getbuffer().nbytes)
+        try:
+            self.client.load_table_from_file(parquet_file,
+                                             destination=table,
+                                             job_config=job_config).result()
+        except Exception as e:
+            raise ValueError(
+                f'Unable to save data to BigQuery! {str(e)}') from e
+        return f'[BigQuery] - at {self.dataset_id}.{destination}'
+
+
+class LocalParquetWriter:
+    """A stand-in for the BigQuery writers, to run offline.
+
+    Each table is a folder of Parquet files in the output directory, one file
+    per write: WRITE_TRUNCATE replaces the files of the table and WRITE_APPEND
+    adds one.
+    """
+
+    def __init__(self,
+                 directory: str,
+                 write_disposition: str = 'WRITE_TRUNCATE',
+                 array_separator: str = '|'):
+        self.directory = directory
+        self.write_disposition = write_disposition
+        self.array_separator = array_separator
+
+    def write_dataframe(self,
+                        report_df: pd.DataFrame,
+                        destination: str,
+                        schema_name: Optional[str] = None) -> str:
+        """Write a dataframe to the folder of the destination table.
+
+        Args:
+            report_df: the dataframe to write.
+            destination: name of the table to write to.
+            schema_name: the table to take the schema of, if not the
+                destination, e.g. for staging tables.
+
+        Returns:
+            The file the data was written to.
+        """
+        schema = get_table_schema(schema_name or destination, report_df)
+        arrow_table = to_arrow_table(report_df, schema, self.array_separator)
+        table_dir = os.path.join(self.directory, destination)
+        with _local_write_lock:
+            os.makedirs(table_dir, exist_ok=True)
+            if self.write_disposition == 'WRITE_TRUNCATE':
+                self._delete_rows(table_dir)
+            elif self.write_disposition == WRITE_TRUNCATE_PARTITION:
+                self._delete_rows(table_dir, utils.get_current_date())
+            path = self._get_next_part_path(table_dir)
+            parquet.write_table(arrow_table, path)
+        logger.info('Wrote %d rows of data to %s', len(report_df), path)
+        return f'[Local] - at {path}'
+
+    def commit_staged(self, staged_writes: List[StagedWrite]) -> None:
+        """Move the files of staging tables to their destinations.
+
+        Args:
+            staged_writes: the staging tables & their destinations.
+        """
+        destinations = set()
+        with _local_write_lock:
+            for staged_write in staged_writes:
+                table_dir = os.path.join(self.directory,
+                                         staged_write.destination)
+                os.makedirs(table_dir, exist_ok=True)
+                # The other writes to the destination are appended
+                if staged_write.destination not in destinations:
+                    destinations.add(staged_write.destination)
+                    if staged_write.write_disposition == 'WRITE_TRUNCATE':
+                        self._delete_rows(table_dir)
+                    elif (staged_write.write_disposition ==
+                          WRITE_TRUNCATE_PARTITION):
+                        self._delete_rows(table_dir,
+                                          staged_write.partition_date)
+                staged_paths = sorted(
+                    glob.glob(
+                        os.path.join(self.directory, staged_write.staging_table,
+                                     '*.parquet')))
+                for staged_path in staged_paths:
+                    os.replace(staged_path, self._get_next_part_path(table_dir))
+
+    def aggregate_staged(self, staged_writes: List[StagedWrite],
+                         staging_table: str, sum_columns: List[str]) -> None:
+        """Add up staging tables of counts into a new staging table.
+
+        Args:
+            staged_writes: the staging tables to add up, with the same columns.
+            staging_table: name of the staging table to create.
+            sum_columns: the columns to add up, grouped by all the others.
+        """
+        staged_df = pd.concat([
+            read_local_table(self.directory, staged_write.staging_table)
+            for staged_write in staged_writes
+        ],
+                              ignore_index=True)
+        group_by = [
+            column for column in staged_df.columns if column not in sum_columns
+        ]
+        aggregated_df = staged_df.groupby(
+            group_by, dropna=False, observed=True,
+            sort=False)[sum_columns].sum().reset_index()[staged_df.columns]
+        LocalParquetWriter(self.directory).write_dataframe(
+            aggregated_df,
+            destination=staging_table,
+            schema_name=staged_writes[0].destination)
+
+    def copy_snapshot(self, source: str, staging_table: str, snapshot_date: str,
+                      customer_ids: List[int], event_date: str) -> None:
+        """Copy the rows of accounts on a date into a new staging table.
+
+        Args:
+            source: name of the table to copy the rows of.
+            staging_table: name of the staging table to create.
+            snapshot_date: the event date of the rows to copy.
+            customer_ids: the accounts to copy the rows of.
+            event_date: the event date of the copies.
+        """
+        snapshot_df = self._read_snapshot(source, snapshot_date, customer_ids)
+        if snapshot_df is None:
+            return
+        LocalParquetWriter(self.directory).write_dataframe(
+            snapshot_df.assign(**{PARTITION_DATE_COLUMN: event_date}),
+            destination=staging_table,
+            schema_name=source)
+
+    def count_snapshot(self, source: str, snapshot_date: str,
+                       customer_ids: List[int],
+                       group_by: List[str]) -> pd.DataFrame:
+        """Count the rows of accounts on a date, by the group by columns.
+
+        Args:
+            source: name of the table to count the rows of.
+            snapshot_date: the event date of the rows to count.
+            customer_ids: the accounts to count the rows of.
+            group_by: the columns to count the rows by.
+
+        Returns:
+            A dataframe of the group by columns and the counts.
+        """
+        snapshot_df = self._read_snapshot(source, snapshot_date, customer_ids)
+        if snapshot_df is None:
+            return pd.DataFrame(columns=[*group_by, 'counts'])
+        return snapshot_df.groupby(
+            group_by, dropna=False,
+            observed=True).size().reset_index(name='counts')
+
+    def drop_staged(self, staged_writes: List[StagedWrite]) -> None:
+        """Delete the folders of the staging tables."""
+        for staged_write in staged_writes:
+            shutil.rmtree(os.path.join(self.directory,
+                                       staged_write.staging_table),
+                          ignore_errors=True)
+
+    def _delete_rows(self,
+                     table_dir: str,
+                     partition_date: Optional[str] = None) -> None:
+        """Delete all the rows of a table, or those of a partition date."""
+        for part_path in glob.glob(os.path.join(table_dir, '*.parquet')):
+            if partition_date is None:
+                os.remove(part_path)
+                continue
+            part = parquet.read_table(part_path)
+            if PARTITION_DATE_COLUMN not in part.column_names:
+                continue
+            other_dates = compute.fill_null(
+                compute.not_equal(part[PARTITION_DATE_COLUMN], partition_date),
+                True)
+            if not compute.any(other_dates).as_py():
+                os.remove(part_path)
+            elif not compute.all(other_dates).as_py():
+                parquet.write_table(part.filter(other_dates), part_path)
+
+    def _read_snapshot(self, source: str, snapshot_date: str,
+                       customer_ids: List[int]) -> Optional[pd.DataFrame]:
+        """Read the rows of accounts on a date, or None without a table."""
+        if not glob.glob(os.path.join(self.directory, source, '*.parquet')):
+            return None
+        source_df = read_local_table(self.directory, source)
+        return source_df[(source_df[PARTITION_DATE_COLUMN] == snapshot_date) &
+                         source_df[CUSTOMER_ID_COLUMN].isin(customer_ids)]
+
+    @staticmethod
+    def _get_next_part_path(table_dir: str) -> str:
+        part_numbers = [
+            int(os.path.basename(part_path)[len('part-'):-len('.parquet')]) for
+            part_path in glob.glob(os.path.join(table_dir, 'part-*.parquet'))
+        ]
+        next_part_number = max(part_numbers, default=-1) + 1
+        return os.path.join(table_dir, f'part-{next_part_number:05d}.parquet')
+
+
+def read_local_table(directory: str, table_name: str) -> pd.DataFrame:
+    """Read a table written by the LocalParquetWriter."""
+    part_paths = sorted(
+        glob.glob(os.path.join(directory, table_name, '*.parquet')))
+    return parquet.read_table(part_paths).to_pandas()
+
+
+def get_writer(payload: models.Payload,
+               write_disposition: str,
+               staging: bool = False
+              ) -> Union[DataFrameBigQueryWriter, LocalParquetWriter]:
+    """Get the writer for the output configured in the payload.
 
     Args:
         payload: the configuration used in this execution.
-        gaarf_report: the report to output.
+        write_disposition: the BigQuery write disposition to write with.
+        staging: whether the writer loads staging tables, which expire after
+            STAGING_EXPIRATION_HOURS.
+
+    Returns:
+        A local writer if the payload has a local_output_path, otherwise a
+        BigQuery writer for the bq_load_format. The policy topics as arrays
+        are always loaded as Parquet.
+    """
+    if payload.local_output_path:
+        return LocalParquetWriter(payload.local_output_path,
+                                  write_disposition=write_disposition)
+    # CSV can't hold the REPEATED columns of the policy topics
+    if (payload.bq_load_format == 'PARQUET' or payload.policy_topics_as_arrays):
+        writer_class = ParquetBigQueryWriter
+    else:
+        writer_class = DataFrameBigQueryWriter
+    return writer_class(
+        project=payload.project_id,
+        dataset=payload.bq_output_dataset,
+        location=payload.region,
+        write_disposition=write_disposition,
+        partition_expiration_days=payload.partition_expiration_days,
+        table_expiration_hours=STAGING_EXPIRATION_HOURS if staging else None)
+
+
+class WriteBatch:
+    """The writes of a run, loaded concurrently and committed together.
+
+    Each write is loaded to its own staging table, with up to
+    payload.max_concurrent_writes load jobs at a time. Once all of them are
+    loaded, they are copied to their tables in one transaction, so the tables
+    of a run date are either fully written or untouched.
+    """
+
+    def __init__(self, payload: models.Payload):
+        self.payload = payload
+        self.run_id = uuid.uuid4().hex[:12]
+        self.run_date = utils.get_current_date()
+        self.load_seconds: Dict[str, float] = {}
+        self._writes: List[Tuple[pd.DataFrame, str, str]] = []
+        self._copies: List[Tuple[str, str, str, List[int]]] = []
+        self._staged_writes: List[StagedWrite] = []
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def add(self,
+            report_df: pd.DataFrame,
+            report_config: models.ReportConfig,
+            table_name: str,
+            write_disposition: Optional[str] = None) -> None:
+        """Add a dataframe to write to a table on commit.
+
+        Args:
+            report_df: the report to output.
+            report_config: the config of the report, for the write
+                disposition.
+            table_name: name of the table to write to.
+            write_disposition: overrides the write disposition of the report.
+        """
+        self._writes.append((report_df, table_name, write_disposition or
+                             report_config.write_disposition))
+
+    def add_snapshot_copy(self, report_config: models.ReportConfig,
+                          table_name: str, snapshot_date: str,
+                          customer_ids: List[int]) -> None:
+        """Add a copy of the rows of accounts on an earlier date to a table.
+
+        The rows are copied to a staging table on commit, with the run date
+        as their event date, see copy_snapshot of the writers.
+
+        Args:
+            report_config: the config of the report, for the write
+                disposition.
+            table_name: name of the table to copy the rows of, and to write to.
+            snapshot_date: the event date of the rows to copy.
+            customer_ids: the accounts to copy the rows of.
+        """
+        self._copies.append((table_name, report_config.write_disposition,
+                             snapshot_date, customer_ids))
+
+    def stage_stream(self, report_dfs: Iterable[pd.DataFrame],
+                     report_config: models.ReportConfig,
+                     table_name: str) -> int:
+        """Load a stream of dataframes to a staging table straight away.
+
+        Only the copy to the table waits for the commit, so the streamed
+        report doesn't have to be held in memory.
+
+        Args:
+            report_dfs: the batches of the report to output.
+            report_config: the config of the report, for the write
+                disposition.
+            table_name: name of the table to write to.
+
+        Returns:
+            The number of rows loaded.
+        """
+        staged_write = self._add_staged_write(table_name,
+                                              report_config.write_disposition)
+        start = time.perf_counter()
+        with telemetry.stage('write', table=table_name,
+                             streamed=True) as record:
+            num_rows = write_dataframes_to_bigquery(self.payload,
+                                                    report_dfs,
+                                                    report_config,
+                                                    staged_write.staging_table,
+                                                    bq_writer=get_writer(
+                                                        self.payload,
+                                                        'WRITE_TRUNCATE',
+                                                        staging=True),
+                                                    schema_name=table_name)
+            record.rows = num_rows
+        self._add_load_seconds(table_name, time.perf_counter() - start)
+        return num_rows
+
+    def on_commit(self, callback: Callable[[], None]) -> None:
+        """Add a function to call once the writes are committed."""
+        self._callbacks.append(callback)
+
+    def extend(self, write_batch: 'WriteBatch') -> None:
+        """Add the writes of another batch to this one."""
+        self._writes.extend(write_batch._writes)  # pylint: disable=protected-access
+        self._copies.extend(write_batch._copies)  # pylint: disable=protected-access
+        self._staged_writes.extend(write_batch._staged_writes)  # pylint: disable=protected-access
+        self._callbacks.extend(write_batch._callbacks)  # pylint: disable=protected-access
+        for table_name, seconds in write_batch.load_seconds.items():
+            self._add_load_seconds(table_name, seconds)
+
+    def commit(self) -> Dict[str, float]:
+        """Load the writes to staging tables, and copy them to their tables.
+
+        Returns:
+            The seconds the load jobs of each table took.
+        """
+        bq_writer = get_writer(self.payload, 'WRITE_TRUNCATE')
+        try:
+            self._load_staging_tables()
+            start = time.perf_counter()
+            if self._staged_writes:
+                with telemetry.stage('commit', tables=len(self._staged_writes)):
+                    bq_writer.commit_staged(self._staged_writes)
+            commit_seconds = time.perf_counter() - start
+        finally:
+            bq_writer.drop_staged(self._staged_writes)
+
+        for callback in self._callbacks:
+            callback()
+        for table_name, seconds in sorted(self.load_seconds.items()):
+            logger.info('Loaded %s in %.2fs', table_name, seconds)
+        logger.info('Committed %d tables in %.2fs', len(self._staged_writes),
+                    commit_seconds)
+        return self.load_seconds
+
+    def stage(self) -> List[StagedWrite]:
+        """Load the writes to staging tables, without committing them.
+
+        The staging tables are dropped if any of the loads fails.
+
+        Returns:
+            The staged writes, to commit with the commit_staged of a writer.
+        """
+        try:
+            self._load_staging_tables()
+        except Exception:
+            get_writer(self.payload,
+                       'WRITE_TRUNCATE').drop_staged(self._staged_writes)
+            raise
+        return list(self._staged_writes)
+
+    def _load_staging_tables(self) -> None:
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.payload.max_concurrent_writes) as executor:
+            futures = [
+                telemetry.submit(executor, self._stage, *write)
+                for write in self._writes
+            ] + [
+                telemetry.submit(executor, self._stage_copy, *copy)
+                for copy in self._copies
+            ]
+            for future in futures:
+                future.result()
+
+    def _stage(self, report_df: pd.DataFrame, table_name: str,
+               write_disposition: str) -> None:
+        staged_write = self._add_staged_write(table_name, write_disposition)
+        start = time.perf_counter()
+        with telemetry.stage('write', table=table_name) as record:
+            record.set_output(report_df)
+            get_writer(self.payload, 'WRITE_TRUNCATE',
+                       staging=True).write_dataframe(
+                           report_df,
+                           destination=staged_write.staging_table,
+                           schema_name=table_name)
+        self._add_load_seconds(table_name, time.perf_counter() - start)
+
+    def _stage_copy(self, table_name: str, write_disposition: str,
+                    snapshot_date: str, customer_ids: List[int]) -> None:
+        staged_write = self._add_staged_write(table_name, write_disposition)
+        start = time.perf_counter()
+        with telemetry.stage('copy',
+                             table=table_name,
+                             snapshot_date=snapshot_date,
+                             customer_ids=len(customer_ids)):
+            get_writer(self.payload, 'WRITE_TRUNCATE').copy_snapshot(
+                table_name, staged_write.staging_table, snapshot_date,
+                customer_ids, self.run_date)
+        self._add_load_seconds(table_name, time.perf_counter() - start)
+
+    def _add_staged_write(self, table_name: str,
+                          write_disposition: str) -> StagedWrite:
+        # Added before loading, so a failed load is dropped too
+        with self._lock:
+            staged_write = StagedWrite(
+                destination=table_name,
+                staging_table=(f'{table_name}_staging_{self.run_id}_'
+                               f'{len(self._staged_writes)}'),
+                write_disposition=write_disposition,
+                partition_date=self.run_date)
+            self._staged_writes.append(staged_write)
+        return staged_write
+
+    def _add_load_seconds(self, table_name: str, seconds: float) -> None:
+        with self._lock:
+            self.load_seconds[table_name] = (
+                self.load_seconds.get(table_name, 0) + seconds)
+
+
+def materialize_views(payload: models.Payload,
+                      bq_writer: DataFrameBigQueryWriter = None) -> None:
+    """Materialize the dashboard views to tables once the run is written.
+
+    The views join the Ocids and split the policy topics on every query, and
+    the dashboards query them many times per page load. The tables do that
+    once per run instead, and are clustered on the columns of CLUSTERING_FIELDS.
+
+    Args:
+        payload: the configuration used in this execution.
+        bq_writer: for dependency injection, provide a BQ writer class.
+    """
+    if bq_writer is None:
+        bq_writer = DataFrameBigQueryWriter(project=payload.project_id,
+                                            dataset=payload.bq_output_dataset,
+                                            location=payload.region)
+    bq_writer._init_client()  # pylint: disable=protected-access
+    dataset_id = bq_writer.dataset_id
+    script = '\n'.join(
+        f'CREATE OR REPLACE TABLE `{dataset_id}.{table_name}` '
+        f'CLUSTER BY {", ".join(CLUSTERING_FIELDS[table_name])} AS '
+        f'SELECT * FROM `{dataset_id}.{view_name}`;'
+        for view_name, table_name in MATERIALIZED_VIEWS.items())
+    start = time.perf_counter()
+    bq_writer.client.query(script).result()
+    logger.info('Materialized %d views in %.2fs', len(MATERIALIZED_VIEWS),
+                time.perf_counter() - start)
+
+
+def update_table_layouts(
+        payload: models.Payload,
+        bq_writer: DataFrameBigQueryWriter = None) -> List[str]:
+    """Migrate the existing policy tables to their partitioning & clustering.
+
+    The partition expiration and clustering of a table are updated in place.
+    BigQuery only clusters the data written after the clustering changes, the
+    existing rows are only clustered by recluster_tables. Tables that don't
+    exist yet are created with their layout by the first write.
+
+    Args:
+        payload: the configuration used in this execution.
+        bq_writer: for dependency injection, provide a BQ writer class.
+
+    Returns:
+        The names of the tables that were updated.
+    """
+    if bq_writer is None:
+        bq_writer = DataFrameBigQueryWriter(project=payload.project_id,
+                                            dataset=payload.bq_output_dataset,
+                                            location=payload.region)
+    bq_writer._init_client()  # pylint: disable=protected-access
+    updated_tables = []
+    for table_name in get_partitioned_tables():
+        table_id = f'{bq_writer.dataset_id}.{table_name}'
+        try:
+            table = bq_writer.client.get_table(table_id)
+        except exceptions.NotFound:
+            continue
+        changed_fields = set_table_layout(table,
+                                          payload.partition_expiration_days)
+        if not changed_fields:
+            continue
+        bq_writer.client.update_table(table, changed_fields)
+        logger.info('Updated the %s of %s', ' & '.join(changed_fields),
+                    table_name)
+        updated_tables.append(table_name)
+    return updated_tables
+
+
+def recluster_tables(payload: models.Payload,
+                     bq_writer: DataFrameBigQueryWriter = None) -> List[str]:
+    """Rewrite the rows of the clustered policy tables to cluster them.
+
+    The rows written before a table was clustered stay unclustered, so this
+    rewrites the whole history of the tables once, in a single script. It's
+    a one-off step after the clustering is added, not part of the daily run.
+
+    Args:
+        payload: the configuration used in this execution.
+        bq_writer: for dependency injection, provide a BQ writer class.
+
+    Returns:
+        The names of the tables that were rewritten.
+    """
+    if bq_writer is None:
+        bq_writer = DataFrameBigQueryWriter(project=payload.project_id,
+                                            dataset=payload.bq_output_dataset,
+                                            location=payload.region)
+    bq_writer._init_client()  # pylint: disable=protected-access
+    reclustered_tables = []
+    statements = []
+    for table_name in PARTITIONED_TABLES:
+        table_id = f'{bq_writer.dataset_id}.{table_name}'
+        try:
+            table = bq_writer.client.get_table(table_id)
+        except exceptions.NotFound:
+            continue
+        if not table.clustering_fields or not table.num_rows:
+            continue
+        column = table.clustering_fields[0]
+        statements.append(f'UPDATE `{table_id}` '
+                          f'SET `{column}` = `{column}` WHERE TRUE;')
+        reclustered_tables.append(table_name)
+    if statements:
+        start = time.perf_counter()
+        bq_writer.client.query('\n'.join(statements)).result()
+        logger.info('Reclustered %d tables in %.2fs', len(statements),
+                    time.perf_counter() - start)
+    return reclustered_tables
+
+
+def get_partitioned_tables() -> List[str]:
+    """Get the tables partitioned by ingestion day.
+
+    The rows of a run are inserted into the partition of its date, so the
+    partitions of the rollup tables are those of their event_date, and expire
+    with the partitions of the policy tables.
+    """
+    rollup_tables = {
+        rollup.table_name
+        for report_config in utils.load_report_configs().values()
+        for rollup in report_config.rollups or []
+    }
+    return [*PARTITIONED_TABLES, *sorted(rollup_tables)]
+
+
+def set_table_layout(
+        table: bigquery.Table,
+        partition_expiration_days: Optional[int] = None) -> List[str]:
+    """Set the partitioning & clustering of a policy table.
+
+    New tables of get_partitioned_tables are partitioned by ingestion day. An
+    existing table can't be partitioned in place, so only the expiration of
+    its partitions is updated. Tables are clustered on the columns of
+    CLUSTERING_FIELDS that are in their schema.
+
+    Args:
+        table: the table to update, created if it has no creation time.
+        partition_expiration_days: the days to keep the partitions for, or
+            None to leave the expiration as it is.
+
+    Returns:
+        The properties of the table that changed, to update the table with.
+    """
+    changed_fields = []
+    if table.table_id in get_partitioned_tables():
+        expiration_ms = (partition_expiration_days * MILLISECONDS_PER_DAY
+                         if partition_expiration_days else None)
+        partitioning = table.time_partitioning
+        if partitioning is None and table.created is None:
+            table.time_partitioning = bigquery.TimePartitioning(
+                type_=bigquery.TimePartitioningType.DAY,
+                expiration_ms=expiration_ms)
+            changed_fields.append('time_partitioning')
+        elif partitioning is None:
+            logger.warning(
+                '%s is not partitioned, it has to be recreated to '
+                'be partitioned', table.table_id)
+        elif expiration_ms and partitioning.expiration_ms != expiration_ms:
+            partitioning.expiration_ms = expiration_ms
+            table.time_partitioning = partitioning
+            changed_fields.append('time_partitioning')
+
+    columns = {field.name for field in table.schema}
+    clustering_fields = [
+        field for field in CLUSTERING_FIELDS.get(table.table_id, [])
+        if field in columns
+    ]
+    if clustering_fields and table.clustering_fields != clustering_fields:
+        table.clustering_fields = clustering_fields
+        changed_fields.append('clustering_fields')
+    return changed_fields
+
+
+def write_dataframes_to_bigquery(payload: models.Payload,
+                                 report_dfs: Iterable[pd.DataFrame],
+                                 report_config: models.ReportConfig,
+                                 table_name: str,
+                                 bq_writer: DataFrameBigQueryWriter = None,
+                                 schema_name: Optional[str] = None) -> int:
+    """Output a stream of report dataframes to BigQuery, one load per batch.
+
+    Only the first batch uses the write disposition of the report, the next
+    batches are appended to it. Each load is waited on before the next batch,
+    so no append can run before the first load truncates the table, and the
+    memory high-water mark covers the loads.
+
+    Args:
+        payload: the configuration used in this execution.
+        report_dfs: the batches of the report to output.
         report_config: the config of the report to run.
         table_name: name of the table to write to.
         bq_writer: for dependency injection, provide a BQ writer class.
+        schema_name: the table to take the schema of, if not table_name.
+
+    Returns:
+        The number of rows written.
     """
-    logger.info('Writing report to BigQuery: %s', table_name)
+    logger.info('Streaming report to BigQuery: %s', table_name)
     if bq_writer is None:
-        bq_writer = BigQueryWriter(
-            project=payload.project_id,
-            dataset=payload.bq_output_dataset,
-            location=payload.region,
-            write_disposition=report_config.write_disposition)
+        bq_writer = get_writer(payload, report_config.write_disposition)
+
+    num_rows = 0
+    num_batches = 0
+    memory_high_water_mark = utils.get_current_memory_mib()
+    for report_df in report_dfs:
+        bq_writer.write_dataframe(report_df,
+                                  destination=table_name,
+                                  schema_name=schema_name)
+        bq_writer.write_disposition = 'WRITE_APPEND'
+        num_rows += len(report_df)
+        num_batches += 1
+        memory_high_water_mark = max(memory_high_water_mark,
+                                     utils.get_current_memory_mib())
+    logger.info(
+        'Wrote %d rows to %s in %d batches, memory high-water mark %.0f MiB',
+        num_rows, table_name, num_batches, memory_high_water_mark)
+    return num_rows
+
+
+def format_arrays(
+    report_df: pd.DataFrame, separator: str,
+    exclude: Collection[str] = ()) -> pd.DataFrame:
+    """Join the array columns into strings, as GAARF does before writing.
+
+    The missing values of the object & string columns are replaced by None,
+    as GAARF's replace({np.nan: None}) does, so they are written as NULLs
+    rather than as NaN floats.
+
+    Args:
+        report_df: the dataframe to format.
+        separator: the separator to join the elements of the arrays with.
+        exclude: columns to keep as arrays.
+
+    Returns:
+        The dataframe with the arrays joined.
+    """
+    formatted_columns = {}
+    for column, dtype in report_df.dtypes.items():
+        if dtype != object and not pd.api.types.is_string_dtype(dtype):
+            continue
+        values = report_df[column].dropna()
+        if (column not in exclude and not values.empty and
+                _is_array(values.iloc[0])):
+            formatted_columns[column] = pd.Series(
+                [_join_array(value, separator) for value in report_df[column]],
+                index=report_df.index,
+                dtype=object)
+        elif len(values) < len(report_df):
+            formatted_columns[column] = report_df[column].astype(object).where(
+                report_df[column].notna(), None)
+    if not formatted_columns:
+        return report_df
+    return report_df.assign(**formatted_columns)
+
+
+def get_bigquery_schema(report_df: pd.DataFrame) -> List[bigquery.SchemaField]:
+    """Get the BigQuery schema from the dtypes of a dataframe."""
+    return [
+        bigquery.SchemaField(name=column,
+                             field_type=BIGQUERY_TYPES.get(
+                                 dtype.kind, 'STRING'),
+                             mode='NULLABLE')
+        for column, dtype in report_df.dtypes.items()
+    ]
+
+
+def get_partition_filter(table: bigquery.Table, partition_date: str) -> str:
+    """Get the SQL filter for the partition of a date in a table.
+
+    Args:
+        table: the table to filter.
+        partition_date: the date of the partition, as YYYY-MM-DD.
+
+    Returns:
+        A filter on the partitioning column of the table. Tables partitioned
+        by ingestion time are filtered on the partition of the date, which
+        commit_staged inserts the rows of a run to. Tables that are not
+        partitioned are filtered on the event_date column.
+    """
+    partitioning = table.time_partitioning
+    if partitioning is None:
+        return f"{PARTITION_DATE_COLUMN} = '{partition_date}'"
+    if partitioning.field is None:
+        return f"_PARTITIONDATE = '{partition_date}'"
+    return f"DATE({partitioning.field}) = '{partition_date}'"
+
+
+def get_table_schema(table_name: str,
+                     report_df: pd.DataFrame) -> List[bigquery.SchemaField]:
+    """Get the schema of a table from its schema file.
+
+    Tables without a schema file, like the state of the incremental reports,
+    get the schema of the dtypes of the dataframe.
+    """
+    if table_name not in SCHEMA_FILENAMES:
+        return get_bigquery_schema(format_arrays(report_df, '|'))
+    return utils.file_registry.get(
+        os.path.join(SCHEMA_DIR, SCHEMA_FILENAMES[table_name]), _parse_schema)
+
+
+def to_arrow_table(report_df: pd.DataFrame, schema: List[bigquery.SchemaField],
+                   separator: str) -> pa.Table:
+    """Convert a dataframe to an Arrow table with the types of the schema.
+
+    Columns missing from the dataframe are null, or empty arrays if REPEATED,
+    and columns that are not in the schema are dropped.
+
+    Args:
+        report_df: the dataframe to convert.
+        schema: the BigQuery schema of the table.
+        separator: the separator to join the arrays of STRING columns with.
+
+    Returns:
+        The Arrow table, with the columns in the order of the schema.
+    """
+    repeated_columns = [
+        field.name for field in schema if field.mode == 'REPEATED'
+    ]
+    report_df = format_arrays(report_df, separator, exclude=repeated_columns)
+    extra_columns = set(report_df.columns) - {field.name for field in schema}
+    if extra_columns:
+        logger.warning('Dropping columns that are not in the schema: %s',
+                       sorted(extra_columns))
+
+    arrays = []
+    fields = []
+    for field in schema:
+        arrow_type = ARROW_TYPES[field.field_type]
+        if field.mode == 'REPEATED':
+            arrow_type = pa.list_(arrow_type)
+        if field.name not in report_df:
+            arrays.append(_empty_array(field, arrow_type, len(report_df)))
+        else:
+            column = report_df[field.name]
+            if field.mode == 'REPEATED':
+                # BigQuery arrays can't be NULL
+                column = [value if _is_array(value) else [] for value in column]
+            if arrow_type == pa.string() and column.dtype.kind in 'biuf':
+                column = column.astype('str')
+            arrays.append(pa.array(column, type=arrow_type, from_pandas=True))
+        fields.append(
+            pa.field(field.name, arrow_type, nullable=field.mode != 'REQUIRED'))
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+
+def _empty_array(field: bigquery.SchemaField, arrow_type: pa.DataType,
+                 length: int) -> pa.Array:
+    if field.mode == 'REPEATED':
+        return pa.array([[]] * length, type=arrow_type)
+    return pa.nulls(length, arrow_type)
+
+
+def _parse_schema(text: str) -> List[bigquery.SchemaField]:
+    return [
+        bigquery.SchemaField.from_api_repr(field) for field in json.loads(text)
+    ]
+
+
+def _join_array(value, separator: str):
+    if _is_array(value):
+        return separator.join(str(element) for element in value)
+    return None if pd.isna(value) else value
+
 
-    bq_writer.write(gaarf_report, destination=table_name)
+def _is_array(value) -> bool:
+    return (isinstance(value, abc.Sequence) and
+            not isinstance(value, (str, bytes)))
@@ -12,24 +12,612 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """Unit tests for bigquery.py"""
+import os
+import tempfile
 import unittest
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
+
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
 import bigquery
+import models
 
 
 class BigQueryTestCase(unittest.TestCase):
 
-    def test_write_gaarf_report_to_bigquery(self):
-        mock_payload = MagicMock()
+    def test_write_dataframes_to_bigquery(self):
         mock_bq_writer = MagicMock()
-        mock_gaarf_report = MagicMock()
         mock_report_config = MagicMock()
-        table_name = 'table_name'
-        bigquery.write_gaarf_report_to_bigquery(mock_payload, mock_gaarf_report,
-                                                mock_report_config, table_name,
-                                                mock_bq_writer)
-        mock_bq_writer.write.assert_called_with(mock_gaarf_report,
-                                                destination=table_name)
+        mock_report_config.write_disposition = 'WRITE_TRUNCATE'
+        dispositions = []
+        mock_bq_writer.write_disposition = 'WRITE_TRUNCATE'
+        mock_bq_writer.write_dataframe.side_effect = (
+            lambda report_df, destination, schema_name: dispositions.append(
+                mock_bq_writer.write_disposition))
+        report_dfs = [
+            pd.DataFrame({'customer_id': [1, 2]}),
+            pd.DataFrame({'customer_id': [3]}),
+        ]
+
+        num_rows = bigquery.write_dataframes_to_bigquery(
+            MagicMock(), iter(report_dfs), mock_report_config, 'table_name',
+            mock_bq_writer)
+
+        self.assertEqual(num_rows, 3)
+        self.assertEqual(dispositions, ['WRITE_TRUNCATE', 'WRITE_APPEND'])
+
+    def test_write_dataframes_to_bigquery_waits_for_each_load(self):
+        mock_report_config = MagicMock()
+        mock_report_config.write_disposition = 'WRITE_TRUNCATE'
+        bq_writer = bigquery.DataFrameBigQueryWriter(
+            project='my_project',
+            dataset='my_dataset',
+            write_disposition='WRITE_TRUNCATE')
+        bq_writer.client = MagicMock()
+        events = []
+
+        def load_table_from_dataframe(dataframe, destination, job_config):
+            events.append(f'load {job_config.write_disposition}')
+            load_job = MagicMock()
+            load_job.result.side_effect = lambda: events.append('done')
+            return load_job
+
+        bq_writer.client.load_table_from_dataframe.side_effect = (
+            load_table_from_dataframe)
+        report_dfs = [
+            pd.DataFrame({'customer_id': [1, 2]}),
+            pd.DataFrame({'customer_id': [3]}),
+        ]
+
+        bigquery.write_dataframes_to_bigquery(MagicMock(), iter(report_dfs),
+                                              mock_report_config, 'table_name',
+                                              bq_writer)
+
+        self.assertEqual(
+            events,
+            ['load WRITE_TRUNCATE', 'done', 'load WRITE_APPEND', 'done'])
+
+    def test_format_arrays(self):
+        report_df = pd.DataFrame({
+            'customer_id': [1, 2],
+            'topics': [['TRADEMARKS', 'TOBACCO'], []],
+            'name': ['a', 'b'],
+        })
+
+        results = bigquery.format_arrays(report_df, '|')
+
+        self.assertEqual(results['topics'].tolist(), ['TRADEMARKS|TOBACCO', ''])
+        self.assertEqual(results['name'].tolist(), ['a', 'b'])
+
+    def test_format_arrays_replaces_missing_values_by_none(self):
+        report_df = pd.DataFrame({
+            'customer_id': [1, 2],
+            'topics': [['TRADEMARKS'], float('nan')],
+            'name': ['a', float('nan')],
+        })
+
+        results = bigquery.format_arrays(report_df, '|')
+
+        self.assertEqual(results['topics'].tolist(), ['TRADEMARKS', None])
+        self.assertEqual(results['name'].tolist(), ['a', None])
+        self.assertEqual(results['customer_id'].tolist(), [1, 2])
+
+    def test_get_bigquery_schema(self):
+        report_df = pd.DataFrame({
+            'customer_id': [1],
+            'cost': [1.5],
+            'name': ['a'],
+            'status': pd.Categorical(['ENABLED']),
+        })
+
+        schema = bigquery.get_bigquery_schema(report_df)
+
+        self.assertEqual([(field.name, field.field_type) for field in schema],
+                         [('customer_id', 'INT64'), ('cost', 'FLOAT64'),
+                          ('name', 'STRING'), ('status', 'STRING')])
+
+    def test_data_frame_writer_loads_dataframe(self):
+        bq_writer = bigquery.DataFrameBigQueryWriter(project='my_project',
+                                                     dataset='my_dataset')
+        bq_writer.client = MagicMock()
+        report_df = pd.DataFrame({'customer_id': [1]})
+
+        bq_writer.write_dataframe(report_df, destination='Ocid')
+
+        load_kwargs = bq_writer.client.load_table_from_dataframe.call_args.kwargs
+        assert_frame_equal(load_kwargs['dataframe'], report_df)
+        self.assertEqual(load_kwargs['job_config'].source_format, 'CSV')
+        load_job = bq_writer.client.load_table_from_dataframe.return_value
+        load_job.result.assert_called_once()
+
+    @patch('bigquery.bigquery.Client')
+    def test_data_frame_writers_share_client(self, mock_client_class):
+        bigquery.client_pool.clear()
+        writers = [
+            bigquery.DataFrameBigQueryWriter(project='my_project',
+                                             dataset=dataset,
+                                             location='europe-west2')
+            for dataset in ['my_dataset', 'my_other_dataset']
+        ]
+
+        for bq_writer in writers:
+            bq_writer._init_client()
+
+        mock_client_class.assert_called_once_with('my_project',
+                                                  location='europe-west2')
+        self.assertIs(writers[0].client, writers[1].client)
+
+    def test_to_arrow_table_uses_schema_file(self):
+        report_df = pd.DataFrame({
+            'event_date': ['2024-01-01', '2024-01-01'],
+            'ad_group_ad_policy_summary_approval_status':
+                pd.Categorical(['DISAPPROVED', None]),
+            'counts': [3.0, None],
+            'extra': [1, 2],
+        })
+        schema = bigquery.get_table_schema('AdPolicyDataTimeSeries', report_df)
+
+        arrow_table = bigquery.to_arrow_table(report_df, schema, '|')
+
+        self.assertEqual(arrow_table.column_names, [
+            'event_date', 'ad_group_ad_policy_summary_approval_status', 'counts'
+        ])
+        self.assertEqual(str(arrow_table.schema.field('counts').type), 'int64')
+        self.assertEqual(arrow_table.to_pydict()['counts'], [3, None])
+        self.assertEqual(
+            arrow_table.to_pydict()
+            ['ad_group_ad_policy_summary_approval_status'],
+            ['DISAPPROVED', None])
+
+    def test_to_arrow_table_joins_string_arrays(self):
+        schema = [
+            bigquery.bigquery.SchemaField('topics', 'STRING'),
+            bigquery.bigquery.SchemaField('ids', 'STRING', mode='REPEATED'),
+            bigquery.bigquery.SchemaField('customer_id', 'INTEGER'),
+        ]
+        report_df = pd.DataFrame({
+            'topics': [['A', 'B'], []],
+            'ids': [['1', '2'], []],
+        })
+
+        arrow_table = bigquery.to_arrow_table(report_df, schema, '|')
+
+        self.assertEqual(
+            arrow_table.to_pydict(), {
+                'topics': ['A|B', ''],
+                'ids': [['1', '2'], []],
+                'customer_id': [None, None],
+            })
+
+    def test_to_arrow_table_fills_empty_arrays(self):
+        schema = [
+            bigquery.bigquery.SchemaField('ad_group_ad_ad_id', 'INTEGER'),
+            bigquery.bigquery.SchemaField('ad_policy_topics',
+                                          'STRING',
+                                          mode='REPEATED'),
+            bigquery.bigquery.SchemaField('asset_policy_topics',
+                                          'STRING',
+                                          mode='REPEATED'),
+        ]
+        report_df = pd.DataFrame({
+            'ad_group_ad_ad_id': [1, 2],
+            'ad_policy_topics': [('A', 'B'), None],
+        })
+
+        arrow_table = bigquery.to_arrow_table(report_df, schema, '|')
+
+        self.assertEqual(
+            arrow_table.to_pydict(), {
+                'ad_group_ad_ad_id': [1, 2],
+                'ad_policy_topics': [['A', 'B'], []],
+                'asset_policy_topics': [[], []],
+            })
+
+    def test_local_parquet_writer(self):
+        with tempfile.TemporaryDirectory() as directory:
+            bq_writer = bigquery.LocalParquetWriter(directory)
+            bq_writer.write_dataframe(pd.DataFrame({'account_id': [1]}),
+                                      destination='Ocid')
+            bq_writer.write_dataframe(pd.DataFrame({'account_id': [2]}),
+                                      destination='Ocid')
+            bq_writer.write_disposition = 'WRITE_APPEND'
+            bq_writer.write_dataframe(pd.DataFrame({'account_id': [3]}),
+                                      destination='Ocid')
+
+            ocid_df = bigquery.read_local_table(directory, 'Ocid')
+
+        self.assertEqual(ocid_df.to_dict('list'), {
+            'account_id': [2, 3],
+            'ocid': [None, None],
+        })
+
+    def test_parquet_writer_loads_parquet(self):
+        bq_writer = bigquery.ParquetBigQueryWriter(project='my_project',
+                                                   dataset='my_dataset')
+        bq_writer.client = MagicMock()
+        report_df = pd.DataFrame({'account_id': [1], 'ocid': ['123']})
+
+        bq_writer.write_dataframe(report_df, destination='Ocid')
+
+        load_table_from_file = bq_writer.client.load_table_from_file
+        load_call = load_table_from_file.call_args
+        self.assertEqual(load_call.kwargs['job_config'].source_format,
+                         'PARQUET')
+        self.assertTrue(load_call.kwargs['job_config'].parquet_options.
+                        enable_list_inference)
+        self.assertEqual(
+            bigquery.parquet.read_table(load_call.args[0]).to_pydict(), {
+                'account_id': [1],
+                'ocid': ['123']
+            })
+        load_table_from_file.return_value.result.assert_called_once()
+
+    def test_get_writer(self):
+        payload = models.Payload(project_id='my_project',
+                                 bq_output_dataset='my_dataset',
+                                 region='europe-west2',
+                                 google_ads_login_customer_id=123,
+                                 customer_ids=[1])
+
+        self.assertIsInstance(bigquery.get_writer(payload, 'WRITE_APPEND'),
+                              bigquery.DataFrameBigQueryWriter)
+        payload.policy_topics_as_arrays = True
+        self.assertIsInstance(bigquery.get_writer(payload, 'WRITE_APPEND'),
+                              bigquery.ParquetBigQueryWriter)
+        payload.policy_topics_as_arrays = False
+        payload.bq_load_format = 'PARQUET'
+        self.assertIsInstance(bigquery.get_writer(payload, 'WRITE_APPEND'),
+                              bigquery.ParquetBigQueryWriter)
+        payload.local_output_path = '/tmp/output'
+        self.assertIsInstance(bigquery.get_writer(payload, 'WRITE_APPEND'),
+                              bigquery.LocalParquetWriter)
+
+    def test_write_batch_commits_all_writes(self):
+        report_config = models.ReportConfig(table_name='Ocid',
+                                            write_disposition='WRITE_APPEND')
+        with tempfile.TemporaryDirectory() as directory:
+            payload = models.Payload(project_id='my_project',
+                                     bq_output_dataset='my_dataset',
+                                     region='europe-west2',
+                                     google_ads_login_customer_id=123,
+                                     customer_ids=[1],
+                                     local_output_path=directory)
+            write_batch = bigquery.WriteBatch(payload)
+            write_batch.add(pd.DataFrame({'account_id': [1]}), report_config,
+                            'Ocid')
+            write_batch.stage_stream(
+                iter([
+                    pd.DataFrame({'account_id': [2]}),
+                    pd.DataFrame({'account_id': [3]}),
+                ]), report_config, 'Ocid')
+            committed = []
+            write_batch.on_commit(lambda: committed.append(True))
+
+            load_seconds = write_batch.commit()
+
+            self.assertEqual(os.listdir(directory), ['Ocid'])
+            ocid_df = bigquery.read_local_table(directory, 'Ocid')
+        self.assertEqual(sorted(ocid_df['account_id']), [1, 2, 3])
+        self.assertEqual(list(load_seconds), ['Ocid'])
+        self.assertEqual(committed, [True])
+
+    def test_write_batch_commits_nothing_on_failure(self):
+        report_config = models.ReportConfig(table_name='Ocid',
+                                            write_disposition='WRITE_APPEND')
+        with tempfile.TemporaryDirectory() as directory:
+            payload = models.Payload(project_id='my_project',
+                                     bq_output_dataset='my_dataset',
+                                     region='europe-west2',
+                                     google_ads_login_customer_id=123,
+                                     customer_ids=[1],
+                                     local_output_path=directory)
+            write_batch = bigquery.WriteBatch(payload)
+            write_batch.add(pd.DataFrame({'account_id': [1]}), report_config,
+                            'Ocid')
+            write_batch.add(pd.DataFrame({'account_id': ['not a number']}),
+                            report_config, 'Ocid')
+
+            with self.assertRaises(Exception):
+                write_batch.commit()
+
+            self.assertEqual(os.listdir(directory), [])
+
+    def test_commit_staged_in_one_transaction(self):
+        bq_writer = bigquery.DataFrameBigQueryWriter(project='my_project',
+                                                     dataset='my_dataset')
+        bq_writer.client = MagicMock()
+        bq_writer.client.get_table.return_value.schema = [
+            bigquery.bigquery.SchemaField('account_id', 'INTEGER')
+        ]
+        bq_writer.client.create_table.return_value.time_partitioning = None
+
+        bq_writer.commit_staged([
+            bigquery.StagedWrite('Ocid', 'Ocid_staging', 'WRITE_TRUNCATE',
+                                 '2024-01-01'),
+            bigquery.StagedWrite('AdPolicyData', 'AdPolicyData_staging',
+                                 'WRITE_APPEND', '2024-01-01'),
+            bigquery.StagedWrite('AdPolicyDataTimeSeries',
+                                 'AdPolicyDataTimeSeries_staging',
+                                 'WRITE_TRUNCATE_PARTITION', '2024-01-01'),
+        ])
+
+        bq_writer.client.query.assert_called_once_with(
+            'BEGIN TRANSACTION;\n'
+            'DELETE FROM `my_project.my_dataset.Ocid` WHERE TRUE;\n'
+            'INSERT INTO `my_project.my_dataset.Ocid` (`account_id`) '
+            'SELECT `account_id` FROM `my_project.my_dataset.Ocid_staging`;\n'
+            'INSERT INTO `my_project.my_dataset.AdPolicyData` (`account_id`) '
+            'SELECT `account_id` '
+            'FROM `my_project.my_dataset.AdPolicyData_staging`;\n'
+            'DELETE FROM `my_project.my_dataset.AdPolicyDataTimeSeries` '
+            "WHERE event_date = '2024-01-01';\n"
+            'INSERT INTO `my_project.my_dataset.AdPolicyDataTimeSeries` '
+            '(`account_id`) SELECT `account_id` '
+            'FROM `my_project.my_dataset.AdPolicyDataTimeSeries_staging`;\n'
+            'COMMIT TRANSACTION;')
+
+    def test_copy_snapshot_filters_partitions(self):
+        bq_writer = bigquery.DataFrameBigQueryWriter(project='my_project',
+                                                     dataset='my_dataset')
+        bq_writer.client = MagicMock()
+        bq_writer.client.get_table.return_value.time_partitioning = (
+            bigquery.bigquery.TimePartitioning())
+
+        bq_writer.copy_snapshot('AdPolicyData', 'AdPolicyData_staging',
+                                '2024-01-01', [1, 2], '2024-01-05')
+
+        bq_writer.client.get_table.assert_called_once_with(
+            'my_project.my_dataset.AdPolicyData')
+        self.assertEqual(
+            bq_writer.client.query.call_args.args[0],
+            'CREATE TABLE `my_project.my_dataset.AdPolicyData_staging` '
+            'OPTIONS (expiration_timestamp = TIMESTAMP_ADD(CURRENT_TIMESTAMP(), '
+            'INTERVAL 24 HOUR)) AS '
+            'SELECT * REPLACE (@event_date AS event_date) '
+            'FROM `my_project.my_dataset.AdPolicyData` '
+            "WHERE _PARTITIONDATE = '2024-01-01' "
+            'AND event_date = @snapshot_date '
+            'AND customer_id IN UNNEST(@customer_ids)')
+
+    def test_staging_writer_creates_expiring_tables(self):
+        payload = models.Payload(project_id='my_project',
+                                 bq_output_dataset='my_dataset',
+                                 region='europe-west2',
+                                 google_ads_login_customer_id=123,
+                                 customer_ids=[1],
+                                 bq_load_format='PARQUET')
+        bq_writer = bigquery.get_writer(payload, 'WRITE_TRUNCATE', staging=True)
+        bq_writer.client = MagicMock()
+        bq_writer.client.get_table.side_effect = (
+            bigquery.exceptions.NotFound('AdPolicyData_staging_0'))
+
+        bq_writer.write_dataframe(pd.DataFrame({'customer_id': [1]}),
+                                  destination='AdPolicyData_staging_0',
+                                  schema_name='AdPolicyData')
+
+        table = bq_writer.client.create_table.call_args.args[0]
+        self.assertEqual(bq_writer.table_expiration_hours,
+                         bigquery.STAGING_EXPIRATION_HOURS)
+        self.assertIsNotNone(table.expires)
+        self.assertIsNone(
+            bigquery.get_writer(payload,
+                                'WRITE_TRUNCATE').table_expiration_hours)
+
+    def test_count_snapshot_of_unpartitioned_table(self):
+        bq_writer = bigquery.DataFrameBigQueryWriter(project='my_project',
+                                                     dataset='my_dataset')
+        bq_writer.client = MagicMock()
+        bq_writer.client.get_table.return_value.time_partitioning = None
+
+        bq_writer.count_snapshot('AdPolicyData', '2024-01-01', [1, 2],
+                                 ['policy_approval_status'])
+
+        self.assertEqual(
+            bq_writer.client.query.call_args.args[0],
+            'SELECT `policy_approval_status`, COUNT(*) AS counts '
+            'FROM `my_project.my_dataset.AdPolicyData` '
+            'WHERE event_date = @snapshot_date '
+            'AND customer_id IN UNNEST(@customer_ids) '
+            'GROUP BY `policy_approval_status`')
+
+    def test_commit_staged_into_partition_of_run_date(self):
+        bq_writer = bigquery.DataFrameBigQueryWriter(project='my_project',
+                                                     dataset='my_dataset')
+        bq_writer.client = MagicMock()
+        bq_writer.client.get_table.return_value.schema = [
+            bigquery.bigquery.SchemaField('account_id', 'INTEGER')
+        ]
+        bq_writer.client.create_table.return_value.time_partitioning = (
+            bigquery.bigquery.TimePartitioning())
+
+        bq_writer.commit_staged([
+            bigquery.StagedWrite('AdPolicyData', 'AdPolicyData_staging',
+                                 'WRITE_TRUNCATE_PARTITION', '2024-01-01'),
+        ])
+
+        bq_writer.client.query.assert_called_once_with(
+            'BEGIN TRANSACTION;\n'
+            'DELETE FROM `my_project.my_dataset.AdPolicyData` '
+            "WHERE _PARTITIONDATE = '2024-01-01';\n"
+            'INSERT INTO `my_project.my_dataset.AdPolicyData` '
+            "(_PARTITIONTIME, `account_id`) SELECT TIMESTAMP('2024-01-01'), "
+            '`account_id` FROM `my_project.my_dataset.AdPolicyData_staging`;\n'
+            'COMMIT TRANSACTION;')
+
+    def test_get_partition_filter(self):
+        table = bigquery.bigquery.Table('my_project.my_dataset.AdPolicyData')
+        self.assertEqual(bigquery.get_partition_filter(table, '2024-01-01'),
+                         "event_date = '2024-01-01'")
+        table.time_partitioning = bigquery.bigquery.TimePartitioning()
+        self.assertEqual(bigquery.get_partition_filter(table, '2024-01-01'),
+                         "_PARTITIONDATE = '2024-01-01'")
+        table.time_partitioning = bigquery.bigquery.TimePartitioning(
+            field='event_timestamp')
+        self.assertEqual(bigquery.get_partition_filter(table, '2024-01-01'),
+                         "DATE(event_timestamp) = '2024-01-01'")
+
+    @patch('bigquery.utils.get_current_date', return_value='2024-01-02')
+    def test_write_batch_replaces_partition_on_rerun(self, _):
+        report_config = models.ReportConfig(
+            table_name='AdPolicyDataTimeSeries',
+            write_disposition='WRITE_TRUNCATE_PARTITION')
+        with tempfile.TemporaryDirectory() as directory:
+            payload = models.Payload(project_id='my_project',
+                                     bq_output_dataset='my_dataset',
+                                     region='europe-west2',
+                                     google_ads_login_customer_id=123,
+                                     customer_ids=[1],
+                                     local_output_path=directory)
+            bigquery.LocalParquetWriter(directory).write_dataframe(
+                pd.DataFrame({
+                    'event_date': ['2024-01-01', '2024-01-02'],
+                    'counts': [1, 2],
+                }), 'AdPolicyDataTimeSeries')
+            for _ in range(2):
+                write_batch = bigquery.WriteBatch(payload)
+                write_batch.add(
+                    pd.DataFrame({
+                        'event_date': ['2024-01-02'],
+                        'counts': [3],
+                    }), report_config, 'AdPolicyDataTimeSeries')
+                write_batch.commit()
+
+            time_series_df = bigquery.read_local_table(
+                directory, 'AdPolicyDataTimeSeries')
+
+        self.assertEqual(
+            time_series_df[['event_date', 'counts']].values.tolist(),
+            [['2024-01-01', 1], ['2024-01-02', 3]])
+
+    def test_materialize_views(self):
+        bq_writer = bigquery.DataFrameBigQueryWriter(project='my_project',
+                                                     dataset='my_dataset')
+        bq_writer.client = MagicMock()
+
+        bigquery.materialize_views(MagicMock(), bq_writer)
+
+        script = bq_writer.client.query.call_args.args[0]
+        self.assertIn(
+            'CREATE OR REPLACE TABLE '
+            '`my_project.my_dataset.LatestAdPolicyDataMaterialized` '
+            'CLUSTER BY customer_id, ad_group_ad_policy_summary_approval_status, '
+            'ad_group_ad_policy_summary_policy_topic_entries AS '
+            'SELECT * FROM `my_project.my_dataset.LatestAdPolicyData`;', script)
+        self.assertEqual(script.count('CREATE OR REPLACE TABLE'), 3)
+        bq_writer.client.query.return_value.result.assert_called_once()
+
+    def test_set_table_layout_of_new_table(self):
+        table = bigquery.bigquery.Table(
+            'my_project.my_dataset.AdPolicyData',
+            schema=[
+                bigquery.bigquery.SchemaField('customer_id', 'INTEGER'),
+                bigquery.bigquery.SchemaField(
+                    'ad_group_ad_policy_summary_approval_status', 'STRING'),
+            ])
+
+        changed_fields = bigquery.set_table_layout(table, 30)
+
+        self.assertEqual(changed_fields,
+                         ['time_partitioning', 'clustering_fields'])
+        self.assertEqual(table.time_partitioning.type_, 'DAY')
+        self.assertEqual(table.time_partitioning.expiration_ms, 30 * 86400000)
+        self.assertEqual(
+            table.clustering_fields,
+            ['customer_id', 'ad_group_ad_policy_summary_approval_status'])
+
+    def test_set_table_layout_of_other_table(self):
+        table = bigquery.bigquery.Table(
+            'my_project.my_dataset.Ocid',
+            schema=[bigquery.bigquery.SchemaField('account_id', 'INTEGER')])
+
+        self.assertEqual(bigquery.set_table_layout(table, 30), [])
+        self.assertIsNone(table.time_partitioning)
+
+    @patch('bigquery.utils.load_report_configs')
+    def test_set_table_layout_of_rollup_table(self, mock_load_report_configs):
+        mock_load_report_configs.return_value = {
+            'AdPolicyData':
+                models.ReportConfig(
+                    table_name='AdPolicyData',
+                    write_disposition='WRITE_APPEND',
+                    rollups=[
+                        models.RollupConfig(
+                            table_name='AdPolicyDataCustomerRollup',
+                            group_by_columns=['event_date', 'customer_id'])
+                    ])
+        }
+        table = bigquery.bigquery.Table(
+            'my_project.my_dataset.AdPolicyDataCustomerRollup',
+            schema=[bigquery.bigquery.SchemaField('customer_id', 'INTEGER')])
+
+        self.assertEqual(bigquery.set_table_layout(table, 30),
+                         ['time_partitioning'])
+        self.assertEqual(table.time_partitioning.expiration_ms, 30 * 86400000)
+
+    def test_update_table_layouts(self):
+        bq_writer = bigquery.DataFrameBigQueryWriter(project='my_project',
+                                                     dataset='my_dataset')
+        bq_writer.client = MagicMock()
+        payload = models.Payload(project_id='my_project',
+                                 bq_output_dataset='my_dataset',
+                                 region='europe-west2',
+                                 google_ads_login_customer_id=123,
+                                 customer_ids=[1],
+                                 partition_expiration_days=3)
+        tables = {}
+        for table_name in bigquery.PARTITIONED_TABLES:
+            table = bigquery.bigquery.Table.from_api_repr({
+                'tableReference': {
+                    'projectId': 'my_project',
+                    'datasetId': 'my_dataset',
+                    'tableId': table_name,
+                },
+                'creationTime': '1700000000000',
+                'numRows': '10',
+                'timePartitioning': {
+                    'type': 'DAY',
+                    'expirationMs': '259200000',
+                },
+                'schema': {
+                    'fields': [{
+                        'name': 'customer_id',
+                        'type': 'INTEGER'
+                    }]
+                },
+            })
+            tables[f'my_project.my_dataset.{table_name}'] = table
+        tables['my_project.my_dataset.AssetPolicyData'].clustering_fields = [
+            'customer_id'
+        ]
+        del tables['my_project.my_dataset.AssetPolicyDataChanges']
+
+        def get_table(table_id):
+            if table_id not in tables:
+                raise bigquery.exceptions.NotFound(table_id)
+            return tables[table_id]
+
+        bq_writer.client.get_table.side_effect = get_table
+
+        updated_tables = bigquery.update_table_layouts(payload, bq_writer)
+
+        self.assertEqual(updated_tables,
+                         ['AdPolicyData', 'AdPolicyDataChanges'])
+        self.assertEqual(bq_writer.client.update_table.call_count, 2)
+        bq_writer.client.query.assert_not_called()
+
+        reclustered_tables = bigquery.recluster_tables(payload, bq_writer)
+
+        self.assertEqual(
+            reclustered_tables,
+            ['AdPolicyData', 'AdPolicyDataChanges', 'AssetPolicyData'])
+        bq_writer.client.query.assert_called_once_with(
+            'UPDATE `my_project.my_dataset.AdPolicyData` '
+            'SET `customer_id` = `customer_id` WHERE TRUE;\n'
+            'UPDATE `my_project.my_dataset.AdPolicyDataChanges` '
+            'SET `customer_id` = `customer_id` WHERE TRUE;\n'
+            'UPDATE `my_project.my_dataset.AssetPolicyData` '
+            'SET `customer_id` = `customer_id` WHERE TRUE;')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,328 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Reuse of the last snapshot of the accounts that didn't change.
+
+With payload.skip_unchanged_accounts, a report is only fetched for the accounts
+that changed since its last snapshot. The changes are found with a query of
+the change_status resource of each account, limited to a single row, which is
+much cheaper than the full scan of the report queries. The rows of the other
+accounts are copied from the last snapshot by BigQuery, with the run date as
+their event date, and their time series counts are added to those of the
+fetched accounts.
+
+The snapshot date & last fetch date of each account are kept in the state
+store of the incremental snapshots. Changes that are not made to the accounts,
+like a new review of the policies, don't show in change_status, so accounts are
+fetched again once their last fetch is payload.max_snapshot_age_days old,
+which trades the freshness of their disapprovals for cost.
+"""
+import datetime
+import logging
+import sys
+import threading
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+import pandas as pd
+
+import bigquery
+import google_ads
+import incremental
+import models
+import telemetry
+
+logging.basicConfig(stream=sys.stdout)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+CUSTOMER_ID_COLUMN = 'customer_id'
+SNAPSHOT_DATE_COLUMN = 'snapshot_date'
+FETCHED_DATE_COLUMN = 'fetched_date'
+
+# change_status only has the changes of the last 90 days
+MAX_CHANGE_LOOKBACK_DAYS = 89
+
+# A single change is enough to fetch an account. The change times are in the
+# time zone of the account, see get_change_range. The API rejects a range
+# without an end with CHANGE_DATE_RANGE_INFINITE.
+CHANGES_QUERY = """
+SELECT
+  customer.id AS customer_id,
+  change_status.last_change_date_time AS last_change_date_time
+FROM
+  change_status
+WHERE
+  change_status.last_change_date_time >= '{since}'
+  AND change_status.last_change_date_time <= '{until} 23:59:59'
+LIMIT 1
+"""
+
+
+class AccountPlan(NamedTuple):
+    """The accounts of a report to fetch, and those to copy."""
+    fetch_customer_ids: List[int]
+    reuse_customer_ids: List[int]
+    snapshot_date: Optional[str]
+
+
+class ChangeDetector:
+    """Finds the accounts with changes in a date range, shared by the reports.
+
+    Each account is only queried once per range, so the reports of a run that
+    share a snapshot date share the queries.
+    """
+
+    def __init__(self,
+                 payload: models.Payload,
+                 report_fetcher: google_ads.AdsReportFetcher = None):
+        self.payload = payload
+        self.report_fetcher = report_fetcher
+        self._changed: Dict[Tuple[str, str], Dict[int, bool]] = {}
+        self._lock = threading.Lock()
+
+    def get_changed_customer_ids(self, customer_ids: List[int], since: str,
+                                 until: str) -> Set[int]:
+        """Get the accounts with changes in a date range.
+
+        Args:
+            customer_ids: the accounts to check.
+            since: the date to look for changes from, as YYYY-MM-DD.
+            until: the last date to look for changes on, as YYYY-MM-DD.
+
+        Returns:
+            The accounts of customer_ids that changed.
+        """
+        # Held during the query, so concurrent reports wait for its results
+        with self._lock:
+            changed = self._changed.setdefault((since, until), {})
+            unknown_ids = [
+                customer_id for customer_id in customer_ids
+                if customer_id not in changed
+            ]
+            if unknown_ids:
+                changed_ids = self._query_changes(unknown_ids, since, until)
+                for customer_id in unknown_ids:
+                    changed[customer_id] = customer_id in changed_ids
+            return {
+                customer_id for customer_id in customer_ids
+                if changed[customer_id]
+            }
+
+    def _query_changes(self, customer_ids: List[int], since: str,
+                       until: str) -> Set[int]:
+        if self.report_fetcher is None:
+            self.report_fetcher = google_ads.AdsReportFetcher(
+                google_ads.get_ads_client(self.payload))
+        with telemetry.stage('detect_changes',
+                             customer_ids=len(customer_ids),
+                             since=since,
+                             until=until) as record:
+            report = google_ads.fetch_sharded(
+                CHANGES_QUERY.format(since=since,
+                                     until=until), self.report_fetcher,
+                customer_ids, self.payload.customer_ids_per_shard,
+                self.payload.max_fetch_workers)
+            column = report.column_names.index(CUSTOMER_ID_COLUMN)
+            changed_ids = {int(row[column]) for row in report.results}
+            record.rows = len(changed_ids)
+        logger.info('Found changes in %d of %d accounts since %s',
+                    len(changed_ids), len(customer_ids), since)
+        return changed_ids
+
+
+def can_reuse_snapshots(payload: models.Payload,
+                        report_config: models.ReportConfig) -> bool:
+    """Whether the unchanged accounts of a report can be copied.
+
+    Built-in reports are not per account, incremental reports compare the
+    whole report, and the rollups are copied by account so they need to be
+    grouped by it.
+    """
+    return bool(payload.skip_unchanged_accounts and
+                not payload.use_synthetic_data and
+                not report_config.is_builtin and
+                not incremental.is_incremental(payload, report_config) and
+                all(CUSTOMER_ID_COLUMN in rollup.group_by_columns
+                    for rollup in report_config.rollups or []))
+
+
+def get_state_name(report_config: models.ReportConfig) -> str:
+    """Get the name the account state of a report is stored under."""
+    return f'{report_config.table_name}AccountState'
+
+
+def reuse_unchanged_accounts(
+    payload: models.Payload,
+    report_config: models.ReportConfig,
+    change_detector: ChangeDetector,
+    write_batch: bigquery.WriteBatch,
+    state_store: incremental.StateStore = None
+) -> Tuple[AccountPlan, Optional[pd.DataFrame]]:
+    """Copy the last snapshot of the unchanged accounts of a report.
+
+    The rows of the report & rollup tables are copied by the write batch, and
+    the state is saved once they are committed.
+
+    Args:
+        payload: the configuration used in this execution.
+        report_config: the config of the report, see can_reuse_snapshots.
+        change_detector: the change detector of the run.
+        write_batch: the writes of the report.
+        state_store: for dependency injection, provide a state store.
+
+    Returns:
+        The plan of the accounts, and the time series counts of the copied
+        accounts, or None if there are none.
+    """
+    if state_store is None:
+        state_store = incremental.get_state_store(payload)
+    state_name = get_state_name(report_config)
+    state_df = state_store.load(state_name)
+    plan = plan_accounts(payload.customer_ids, state_df, change_detector,
+                         write_batch.run_date, payload.max_snapshot_age_days)
+    logger.info('Fetching %d accounts of %s, copying %d from %s',
+                len(plan.fetch_customer_ids), report_config.table_name,
+                len(plan.reuse_customer_ids), plan.snapshot_date)
+
+    time_series_df = None
+    if plan.reuse_customer_ids:
+        for table_name in [
+                report_config.table_name,
+                *(rollup.table_name for rollup in report_config.rollups or [])
+        ]:
+            write_batch.add_snapshot_copy(report_config, table_name,
+                                          plan.snapshot_date,
+                                          plan.reuse_customer_ids)
+        if report_config.time_series_table_name:
+            time_series_df = count_time_series(payload, report_config, plan,
+                                               write_batch.run_date)
+
+    new_state_df = update_state(state_df, plan, write_batch.run_date)
+    write_batch.on_commit(lambda: state_store.save(state_name, new_state_df))
+    return plan, time_series_df
+
+
+def plan_accounts(customer_ids: List[int], state_df: Optional[pd.DataFrame],
+                  change_detector: ChangeDetector, run_date: str,
+                  max_snapshot_age_days: int) -> AccountPlan:
+    """Split the accounts of a report into those to fetch and to copy.
+
+    An account is copied if it's in the last snapshot of the report, was
+    fetched less than max_snapshot_age_days ago and has no changes since.
+
+    Args:
+        customer_ids: the accounts of the run.
+        state_df: the account state of the report, or None on the first run.
+        change_detector: finds the accounts with changes.
+        run_date: the date of the run, as YYYY-MM-DD.
+        max_snapshot_age_days: the days after which accounts are fetched
+            again, even without changes.
+
+    Returns:
+        The plan of the accounts.
+    """
+    if state_df is None or state_df.empty:
+        return AccountPlan(list(customer_ids), [], None)
+    snapshot_date = str(state_df[SNAPSHOT_DATE_COLUMN].max())
+    change_range = get_change_range(snapshot_date, run_date)
+    if change_range is None:
+        return AccountPlan(list(customer_ids), [], None)
+
+    oldest_fetch = _add_days(run_date, -max_snapshot_age_days)
+    state = state_df.astype({
+        SNAPSHOT_DATE_COLUMN: str,
+        FETCHED_DATE_COLUMN: str
+    }).set_index(CUSTOMER_ID_COLUMN)
+    candidate_ids = [
+        customer_id for customer_id in customer_ids
+        if customer_id in state.index and
+        state.at[customer_id, SNAPSHOT_DATE_COLUMN] == snapshot_date and
+        state.at[customer_id, FETCHED_DATE_COLUMN] > oldest_fetch
+    ]
+    changed_ids = (change_detector.get_changed_customer_ids(
+        candidate_ids, *change_range) if candidate_ids else set())
+    reuse_ids = set(candidate_ids) - changed_ids
+    return AccountPlan(
+        [
+            customer_id for customer_id in customer_ids
+            if customer_id not in reuse_ids
+        ],
+        [
+            customer_id for customer_id in customer_ids
+            if customer_id in reuse_ids
+        ],
+        snapshot_date,
+    )
+
+
+def get_change_range(snapshot_date: str,
+                     run_date: str) -> Optional[Tuple[str, str]]:
+    """Get the dates to look for changes between, for a snapshot.
+
+    The change times are in the time zone of each account, so the day before
+    the snapshot and the day after the run are included to not miss changes
+    behind or ahead of UTC.
+
+    Returns:
+        The first & last dates, or None if the first is older than the
+        changes kept by the API.
+    """
+    since = _add_days(snapshot_date, -1)
+    if since < _add_days(run_date, -MAX_CHANGE_LOOKBACK_DAYS):
+        return None
+    return since, _add_days(run_date, 1)
+
+
+def count_time_series(payload: models.Payload,
+                      report_config: models.ReportConfig, plan: AccountPlan,
+                      run_date: str) -> pd.DataFrame:
+    """Count the time series of the copied accounts from their snapshot."""
+    bq_writer = bigquery.get_writer(payload, 'WRITE_TRUNCATE')
+    time_series_df = bq_writer.count_snapshot(
+        report_config.table_name, plan.snapshot_date, plan.reuse_customer_ids,
+        [report_config.time_series_variable_column])
+    time_series_df.insert(0, google_ads.TIME_SERIES_DATE_COLUMN, run_date)
+    return time_series_df
+
+
+def update_state(state_df: Optional[pd.DataFrame], plan: AccountPlan,
+                 run_date: str) -> pd.DataFrame:
+    """Get the account state of a report once the plan is committed.
+
+    All the accounts of the plan are in the snapshot of the run date, the
+    fetched ones are also fetched on it. Other accounts are kept as they are.
+    """
+    if state_df is None:
+        state_df = pd.DataFrame(columns=[
+            CUSTOMER_ID_COLUMN, SNAPSHOT_DATE_COLUMN, FETCHED_DATE_COLUMN
+        ])
+    reused_df = state_df[state_df[CUSTOMER_ID_COLUMN].isin(
+        plan.reuse_customer_ids)].assign(**{SNAPSHOT_DATE_COLUMN: run_date})
+    fetched_df = pd.DataFrame({
+        CUSTOMER_ID_COLUMN: pd.Series(plan.fetch_customer_ids, dtype='int64'),
+        SNAPSHOT_DATE_COLUMN: run_date,
+        FETCHED_DATE_COLUMN: run_date,
+    })
+    planned_ids = [*plan.fetch_customer_ids, *plan.reuse_customer_ids]
+    other_df = state_df[~state_df[CUSTOMER_ID_COLUMN].isin(planned_ids)]
+    return pd.concat([other_df, reused_df, fetched_df],
+                     ignore_index=True).astype({
+                         CUSTOMER_ID_COLUMN: 'int64',
+                         SNAPSHOT_DATE_COLUMN: str,
+                         FETCHED_DATE_COLUMN: str,
+                     })
+
+
+def _add_days(date: str, days: int) -> str:
+    return (datetime.date.fromisoformat(date) +
+            datetime.timedelta(days=days)).isoformat()
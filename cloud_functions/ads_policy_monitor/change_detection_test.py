@@ -0,0 +1,117 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for change_detection.py"""
+import unittest
+from unittest.mock import MagicMock
+
+from gaarf.report import GaarfReport
+import pandas as pd
+
+import change_detection
+import models
+
+STATE_DF = pd.DataFrame({
+    'customer_id': [1, 2, 3, 4, 5],
+    'snapshot_date': [
+        '2024-01-09', '2024-01-09', '2024-01-09', '2024-01-09', '2024-01-05'
+    ],
+    'fetched_date': [
+        '2024-01-09', '2024-01-05', '2024-01-01', '2024-01-09', '2024-01-05'
+    ],
+})
+
+
+class ChangeDetectionTestCase(unittest.TestCase):
+
+    def test_plan_accounts(self):
+        change_detector = MagicMock()
+        change_detector.get_changed_customer_ids.return_value = {4}
+
+        plan = change_detection.plan_accounts([1, 2, 3, 4, 5, 6], STATE_DF,
+                                              change_detector, '2024-01-10', 7)
+
+        # 3 was fetched too long ago, 4 changed, 5 missed the last snapshot
+        # and 6 is new
+        self.assertEqual(plan.fetch_customer_ids, [3, 4, 5, 6])
+        self.assertEqual(plan.reuse_customer_ids, [1, 2])
+        self.assertEqual(plan.snapshot_date, '2024-01-09')
+        change_detector.get_changed_customer_ids.assert_called_once_with(
+            [1, 2, 4], '2024-01-08', '2024-01-11')
+
+    def test_plan_accounts_fetches_old_snapshots(self):
+        change_detector = MagicMock()
+
+        plan = change_detection.plan_accounts([1, 2], STATE_DF, change_detector,
+                                              '2024-06-01', 365)
+
+        self.assertEqual(plan.fetch_customer_ids, [1, 2])
+        self.assertEqual(plan.reuse_customer_ids, [])
+        change_detector.get_changed_customer_ids.assert_not_called()
+
+    def test_update_state(self):
+        plan = change_detection.AccountPlan([3, 6], [1, 2], '2024-01-09')
+
+        state_df = change_detection.update_state(STATE_DF, plan, '2024-01-10')
+
+        self.assertEqual(
+            state_df.sort_values('customer_id').to_dict('list'), {
+                'customer_id': [1, 2, 3, 4, 5, 6],
+                'snapshot_date': [
+                    '2024-01-10', '2024-01-10', '2024-01-10', '2024-01-09',
+                    '2024-01-05', '2024-01-10'
+                ],
+                'fetched_date': [
+                    '2024-01-09', '2024-01-05', '2024-01-10', '2024-01-09',
+                    '2024-01-05', '2024-01-10'
+                ],
+            })
+
+    def test_change_detector_queries_each_account_once(self):
+        report_fetcher = MagicMock()
+        report_fetcher.fetch.return_value = GaarfReport(
+            results=[[2, '2024-01-09 10:00:00']],
+            column_names=['customer_id', 'last_change_date_time'])
+        payload = models.Payload(project_id='my_project',
+                                 bq_output_dataset='my_dataset',
+                                 region='europe-west2',
+                                 google_ads_login_customer_id=123,
+                                 customer_ids=[1, 2, 3])
+        change_detector = change_detection.ChangeDetector(
+            payload, report_fetcher)
+
+        self.assertEqual(
+            change_detector.get_changed_customer_ids([1, 2], '2024-01-08',
+                                                     '2024-01-11'), {2})
+        self.assertEqual(
+            change_detector.get_changed_customer_ids([1, 2, 3], '2024-01-08',
+                                                     '2024-01-11'), {2})
+
+        self.assertEqual(report_fetcher.fetch.call_count, 2)
+        self.assertEqual(report_fetcher.fetch.call_args.args[1], [3])
+        query = report_fetcher.fetch.call_args.args[0]
+        self.assertIn(
+            "change_status.last_change_date_time >= '2024-01-08'\n"
+            "  AND change_status.last_change_date_time <= "
+            "'2024-01-11 23:59:59'", query)
+
+    def test_get_change_range(self):
+        self.assertEqual(
+            change_detection.get_change_range('2024-01-09', '2024-01-10'),
+            ('2024-01-08', '2024-01-11'))
+        self.assertIsNone(
+            change_detection.get_change_range('2024-01-09', '2024-06-01'))
+
+
+if __name__ == '__main__':
+    unittest.main()
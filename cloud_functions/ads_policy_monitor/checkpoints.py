@@ -0,0 +1,353 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Checkpoints of the completed units of a run, to resume failed runs.
+
+A unit is a report, or a shard of customer IDs of one of its queries, on a run
+date. The results of each shard are saved as soon as it is fetched, and a
+report is marked as done once its writes are committed. A rerun on the same
+date skips the reports that are done and only fetches the shards that are
+missing, so a run that timed out or hit the quota doesn't start from scratch.
+"""
+import abc
+import base64
+import gzip
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Set
+
+from gaarf.report import GaarfReport
+from google.api_core import exceptions
+from google.cloud import bigquery as bq
+
+import bigquery
+import models
+import utils
+
+logging.basicConfig(stream=sys.stdout)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+CHECKPOINTS_TABLE_NAME = 'RunCheckpoints'
+DONE_UNIT = 'done'
+
+# The units saved to BigQuery are loaded in batches, once the last load is
+# this old, so a run stays far below the 1,500 daily load jobs of the table
+CHECKPOINT_FLUSH_SECONDS = 60
+# ... or once their base64 encoded data reaches this size
+CHECKPOINT_FLUSH_BYTES = 64 * 1024**2
+# The checkpoints are only read by the reruns of a run date, so the partitions
+# of the table expire after a few days
+CHECKPOINT_EXPIRATION_DAYS = 3
+
+
+class CheckpointStore(abc.ABC):
+    """Keeps the data of the completed units, by the name of the unit."""
+
+    @abc.abstractmethod
+    def load(self, unit: str) -> Optional[bytes]:
+        """Load the data of a unit, or None if the unit isn't completed."""
+
+    @abc.abstractmethod
+    def save(self, unit: str, data: bytes) -> None:
+        """Record a unit as completed, with its data."""
+
+    @abc.abstractmethod
+    def delete(self, units: List[str]) -> None:
+        """Delete the units, the missing ones are skipped."""
+
+    def flush(self) -> None:
+        """Persist the saved units, for the stores that save them in batches."""
+
+    def preload(self, prefix: str) -> None:
+        """Read the units under a prefix at once, for the stores that query."""
+
+
+class LocalCheckpointStore(CheckpointStore):
+    """A checkpoint store of files in a local directory."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def load(self, unit: str) -> Optional[bytes]:
+        path = self._get_path(unit)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def save(self, unit: str, data: bytes) -> None:
+        path = self._get_path(unit)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first, so a unit is never half saved
+        with open(f'{path}.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(f'{path}.tmp', path)
+
+    def delete(self, units: List[str]) -> None:
+        for unit in units:
+            if os.path.exists(self._get_path(unit)):
+                os.remove(self._get_path(unit))
+
+    def _get_path(self, unit: str) -> str:
+        return os.path.join(self.directory, *unit.split('/'))
+
+
+class BigQueryCheckpointStore(CheckpointStore):
+    """A checkpoint store of rows in a table of the output dataset.
+
+    The data is base64 encoded in a STRING column, so each unit is limited to
+    the 100 MB of a BigQuery row. A table only allows 1,500 load jobs a day,
+    so the saved units are buffered and loaded in batches, at most every
+    CHECKPOINT_FLUSH_SECONDS, or once they reach CHECKPOINT_FLUSH_BYTES. The
+    units saved since the last load are lost if the instance is stopped before
+    a flush. The units of a report are read with a single query, see preload,
+    and the partitions of the table expire after CHECKPOINT_EXPIRATION_DAYS.
+    """
+
+    def __init__(self,
+                 payload: models.Payload,
+                 bq_writer: bigquery.DataFrameBigQueryWriter = None,
+                 clock: Callable[[], float] = time.monotonic):
+        if bq_writer is None:
+            bq_writer = bigquery.DataFrameBigQueryWriter(
+                project=payload.project_id,
+                dataset=payload.bq_output_dataset,
+                location=payload.region,
+                write_disposition='WRITE_APPEND')
+        self.bq_writer = bq_writer
+        self.table = f'{bq_writer.dataset_id}.{CHECKPOINTS_TABLE_NAME}'
+        self._clock = clock
+        # The base64 encoded data of the units that aren't loaded yet
+        self._pending: Dict[str, str] = {}
+        self._pending_bytes = 0
+        self._flushed_at = clock()
+        # The base64 encoded data of the preloaded units, by their prefixes,
+        # and the units saved to the table since
+        self._loaded: Dict[str, str] = {}
+        self._loaded_prefixes: List[str] = []
+        self._flushed_units: Set[str] = set()
+        self._lock = threading.Lock()
+        # Held during a preload, so concurrent shards wait for its results
+        self._preload_lock = threading.Lock()
+
+    def preload(self, prefix: str) -> None:
+        """Read all the units under a prefix in a single query.
+
+        The units under the prefix are then loaded from memory, instead of a
+        query each.
+        """
+        with self._preload_lock:
+            with self._lock:
+                if self._is_preloaded(prefix):
+                    return
+            rows = self._query(
+                f'SELECT unit, data FROM `{self.table}` '
+                'WHERE STARTS_WITH(unit, @prefix)',
+                [bq.ScalarQueryParameter('prefix', 'STRING', prefix)])
+            with self._lock:
+                for row in rows:
+                    self._loaded.setdefault(row['unit'], row['data'])
+                self._loaded_prefixes.append(prefix)
+        logger.info('Preloaded %d checkpoints of %s', len(rows), prefix)
+
+    def load(self, unit: str) -> Optional[bytes]:
+        with self._lock:
+            if unit in self._pending:
+                return base64.b64decode(self._pending[unit])
+            if unit in self._loaded:
+                return base64.b64decode(self._loaded[unit])
+            if self._is_preloaded(unit) and unit not in self._flushed_units:
+                return None
+        rows = self._query(
+            f'SELECT data FROM `{self.table}` WHERE unit = @unit LIMIT 1',
+            [bq.ScalarQueryParameter('unit', 'STRING', unit)])
+        if not rows:
+            return None
+        return base64.b64decode(rows[0]['data'])
+
+    def save(self, unit: str, data: bytes) -> None:
+        encoded_data = base64.b64encode(data).decode('ascii')
+        with self._lock:
+            self._pending[unit] = encoded_data
+            self._pending_bytes += len(encoded_data)
+            is_due = (self._pending_bytes >= CHECKPOINT_FLUSH_BYTES or
+                      self._clock() - self._flushed_at
+                      >= CHECKPOINT_FLUSH_SECONDS)
+        if is_due:
+            self.flush()
+
+    def flush(self) -> None:
+        """Load the units saved since the last flush, in a single load job."""
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+            self._pending_bytes = 0
+            self._flushed_at = self._clock()
+        if not pending:
+            return
+        self.bq_writer._init_client()  # pylint: disable=protected-access
+        job_config = bq.LoadJobConfig(
+            schema=[
+                bq.SchemaField('unit', 'STRING'),
+                bq.SchemaField('data', 'STRING'),
+            ],
+            write_disposition='WRITE_APPEND',
+            time_partitioning=bq.TimePartitioning(
+                type_=bq.TimePartitioningType.DAY,
+                expiration_ms=CHECKPOINT_EXPIRATION_DAYS *
+                bigquery.MILLISECONDS_PER_DAY),
+        )
+        try:
+            self.bq_writer.client.load_table_from_json(
+                [{
+                    'unit': unit,
+                    'data': data
+                } for unit, data in pending.items()],
+                self.table,
+                job_config=job_config).result()
+        except Exception:
+            # Keep the units for the next flush, unless they were saved again
+            with self._lock:
+                for unit, data in pending.items():
+                    if unit not in self._pending:
+                        self._pending[unit] = data
+                        self._pending_bytes += len(data)
+            raise
+        with self._lock:
+            self._flushed_units.update(pending)
+        logger.info('Saved %d checkpoints to %s', len(pending), self.table)
+
+    def delete(self, units: List[str]) -> None:
+        if not units:
+            return
+        with self._lock:
+            for unit in units:
+                data = self._pending.pop(unit, None)
+                if data is not None:
+                    self._pending_bytes -= len(data)
+                self._loaded.pop(unit, None)
+                self._flushed_units.discard(unit)
+        self._query(f'DELETE FROM `{self.table}` WHERE unit IN UNNEST(@units)',
+                    [bq.ArrayQueryParameter('units', 'STRING', units)])
+
+    def _is_preloaded(self, unit: str) -> bool:
+        return any(unit.startswith(prefix) for prefix in self._loaded_prefixes)
+
+    def _query(self, query: str, query_parameters: list) -> list:
+        """Run a query of the table, with no rows if it doesn't exist yet."""
+        self.bq_writer._init_client()  # pylint: disable=protected-access
+        job_config = bq.QueryJobConfig(query_parameters=query_parameters)
+        try:
+            return list(
+                self.bq_writer.client.query(query,
+                                            job_config=job_config).result())
+        except exceptions.NotFound:
+            return []
+
+
+def get_checkpoint_store(payload: models.Payload) -> CheckpointStore:
+    """Get the checkpoint store configured in the payload."""
+    if payload.checkpoint_path:
+        return LocalCheckpointStore(payload.checkpoint_path)
+    return BigQueryCheckpointStore(payload)
+
+
+class ReportCheckpoint:
+    """The checkpoints of a report on a run date.
+
+    The shards are identified by a hash of the query, which includes the date,
+    and of their customer IDs, so a change of the query or of the shards
+    fetches them again.
+    """
+
+    def __init__(self,
+                 store: CheckpointStore,
+                 report_name: str,
+                 run_date: Optional[str] = None):
+        self.store = store
+        self.prefix = f'{run_date or utils.get_current_date()}/{report_name}'
+        self._shard_units: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def is_done(self) -> bool:
+        """Whether the report was committed by an earlier run of the date."""
+        self.store.preload(f'{self.prefix}/')
+        return self.store.load(f'{self.prefix}/{DONE_UNIT}') is not None
+
+    def mark_done(self) -> None:
+        """Mark the report as committed, and drop the data of its shards."""
+        self.store.save(f'{self.prefix}/{DONE_UNIT}', b'')
+        self.store.flush()
+        self.store.delete(sorted(self._shard_units))
+
+    def flush(self) -> None:
+        """Persist the shards saved so far, e.g. before the report fails."""
+        self.store.flush()
+
+    def load_shard(self, query: str,
+                   customer_ids: List[int]) -> Optional[GaarfReport]:
+        """Load the report of a shard fetched by an earlier run, if any."""
+        unit = self._get_shard_unit(query, customer_ids)
+        self._add_shard_unit(unit)
+        self.store.preload(f'{self.prefix}/')
+        data = self.store.load(unit)
+        if data is None:
+            return None
+        logger.info('Resuming %d customer IDs of %s from a checkpoint',
+                    len(customer_ids), self.prefix)
+        return deserialize_report(data)
+
+    def save_shard(self, query: str, customer_ids: List[int],
+                   gaarf_report: GaarfReport) -> None:
+        """Save the report of a shard, once it's fetched."""
+        unit = self._get_shard_unit(query, customer_ids)
+        self._add_shard_unit(unit)
+        self.store.save(unit, serialize_report(gaarf_report))
+
+    def _add_shard_unit(self, unit: str) -> None:
+        # Shards are fetched concurrently
+        with self._lock:
+            self._shard_units.add(unit)
+
+    def _get_shard_unit(self, query: str, customer_ids: List[int]) -> str:
+        key = hashlib.sha256(
+            json.dumps([
+                query, [int(customer_id) for customer_id in customer_ids]
+            ]).encode()).hexdigest()[:16]
+        return f'{self.prefix}/shards/{key}'
+
+
+def serialize_report(gaarf_report: GaarfReport) -> bytes:
+    """Serialize the results of a GAARF report to gzipped JSON."""
+    return gzip.compress(
+        json.dumps(
+            {
+                'column_names': list(gaarf_report.column_names),
+                'results': gaarf_report.results,
+                'results_placeholder': gaarf_report.results_placeholder,
+            },
+            default=str).encode())
+
+
+def deserialize_report(data: bytes) -> GaarfReport:
+    """Deserialize a GAARF report saved with serialize_report."""
+    report = json.loads(gzip.decompress(data))
+    return GaarfReport(results=report['results'],
+                       column_names=report['column_names'],
+                       results_placeholder=report['results_placeholder'])
@@ -0,0 +1,127 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for checkpoints.py"""
+import base64
+import tempfile
+import unittest
+from unittest import mock
+
+from gaarf.report import GaarfReport
+
+import checkpoints
+
+
+class CheckpointsTestCase(unittest.TestCase):
+
+    def test_local_checkpoint_store(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = checkpoints.LocalCheckpointStore(directory)
+            self.assertIsNone(store.load('2024-01-01/Ocid/done'))
+
+            store.save('2024-01-01/Ocid/done', b'data')
+            self.assertEqual(store.load('2024-01-01/Ocid/done'), b'data')
+
+            store.delete(['2024-01-01/Ocid/done', '2024-01-01/Ocid/missing'])
+            self.assertIsNone(store.load('2024-01-01/Ocid/done'))
+
+    def test_bigquery_checkpoint_store_batches_saves(self):
+        bq_writer = mock.MagicMock(dataset_id='dataset')
+        now = [0.0]
+        store = checkpoints.BigQueryCheckpointStore(None,
+                                                    bq_writer,
+                                                    clock=lambda: now[0])
+        load_table = bq_writer.client.load_table_from_json
+
+        store.save('2024-01-01/Ocid/a', b'a')
+        store.save('2024-01-01/Ocid/b', b'b')
+        store.save('2024-01-01/Ocid/c', b'c')
+        store.delete(['2024-01-01/Ocid/c'])
+        load_table.assert_not_called()
+        self.assertEqual(store.load('2024-01-01/Ocid/a'), b'a')
+        bq_writer.client.query.assert_called_once()
+
+        now[0] = checkpoints.CHECKPOINT_FLUSH_SECONDS
+        store.save('2024-01-01/Ocid/d', b'd')
+        load_table.assert_called_once()
+        rows, table = load_table.call_args.args
+        self.assertEqual(table, 'dataset.RunCheckpoints')
+        self.assertEqual(
+            [row['unit'] for row in rows],
+            ['2024-01-01/Ocid/a', '2024-01-01/Ocid/b', '2024-01-01/Ocid/d'])
+
+        store.flush()
+        load_table.assert_called_once()
+
+    def test_bigquery_checkpoint_store_preloads_units(self):
+        bq_writer = mock.MagicMock(dataset_id='dataset')
+        bq_writer.client.query.return_value.result.return_value = [{
+            'unit': '2024-01-01/Ocid/shards/a',
+            'data': base64.b64encode(b'a').decode('ascii'),
+        }]
+        store = checkpoints.BigQueryCheckpointStore(None, bq_writer)
+
+        store.preload('2024-01-01/Ocid/')
+        store.preload('2024-01-01/Ocid/')
+        self.assertEqual(store.load('2024-01-01/Ocid/shards/a'), b'a')
+        self.assertIsNone(store.load('2024-01-01/Ocid/shards/b'))
+        self.assertIsNone(store.load('2024-01-01/Ocid/done'))
+        bq_writer.client.query.assert_called_once()
+        self.assertIn('STARTS_WITH(unit, @prefix)',
+                      bq_writer.client.query.call_args.args[0])
+
+        store.save('2024-01-01/Ocid/shards/b', b'b')
+        store.flush()
+        store.delete(['2024-01-01/Ocid/shards/a'])
+        self.assertIsNone(store.load('2024-01-01/Ocid/shards/a'))
+        # Saved to the table since the preload, so queried again
+        bq_writer.client.query.reset_mock()
+        store.load('2024-01-01/Ocid/shards/b')
+        bq_writer.client.query.assert_called_once()
+
+    def test_report_checkpoint_shards(self):
+        report = GaarfReport(results=[[1, ['TRADEMARKS']], [2, []]],
+                             column_names=['customer_id', 'topics'])
+        with tempfile.TemporaryDirectory() as directory:
+            store = checkpoints.LocalCheckpointStore(directory)
+            checkpoint = checkpoints.ReportCheckpoint(store, 'AdPolicyData',
+                                                      '2024-01-01')
+            checkpoint.save_shard('query', [1, 2], report)
+
+            rerun_checkpoint = checkpoints.ReportCheckpoint(
+                store, 'AdPolicyData', '2024-01-01')
+            self.assertIsNone(rerun_checkpoint.load_shard('query', [3]))
+            self.assertIsNone(rerun_checkpoint.load_shard(
+                'other query', [1, 2]))
+            loaded_report = rerun_checkpoint.load_shard('query', [1, 2])
+            self.assertEqual(loaded_report.results, report.results)
+            self.assertEqual(loaded_report.column_names, report.column_names)
+
+            self.assertFalse(rerun_checkpoint.is_done())
+            rerun_checkpoint.mark_done()
+            self.assertTrue(rerun_checkpoint.is_done())
+            self.assertIsNone(rerun_checkpoint.load_shard('query', [1, 2]))
+
+    def test_report_checkpoint_is_per_date(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = checkpoints.LocalCheckpointStore(directory)
+            checkpoints.ReportCheckpoint(store, 'Ocid',
+                                         '2024-01-01').mark_done()
+
+            self.assertFalse(
+                checkpoints.ReportCheckpoint(store, 'Ocid',
+                                             '2024-01-02').is_done())
+
+
+if __name__ == '__main__':
+    unittest.main()
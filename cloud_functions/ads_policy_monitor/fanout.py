@@ -0,0 +1,421 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Fan-out of a run to worker invocations of the function.
+
+With payload.fan_out_customer_ids, the run is a coordinator: it splits the
+reports to run by accounts into work items, of one report and up to
+fan_out_customer_ids accounts each, and sends them to a work queue. Each work
+item is run by a worker, which loads the writes of its report to staging
+tables and returns them without committing. Once all the workers are done, the
+coordinator adds up the time series & rollups of the workers, which count rows
+of every work item, and commits all the staging tables in one transaction, as
+a single invocation does.
+
+The coordinator waits on its workers, so the whole fanned out run is capped by
+the timeout of the coordinator's invocation, FUNCTION_TIMEOUT_SECONDS. The
+workers invoked over HTTP are given up on COMMIT_SECONDS before it, counted
+from the start of the fan-out, so the reports of the finished work items can
+still be committed. The staging tables of the workers given up on expire, see
+bigquery.STAGING_EXPIRATION_HOURS.
+
+The workers are invoked with an ID token of the service account of the
+function, and only run work items sent with one, see verify_coordinator.
+"""
+import abc
+import collections
+import concurrent.futures
+import functools
+import logging
+import sys
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+import uuid
+
+import google.auth
+from google.auth.transport import requests as auth_requests
+from google.oauth2 import id_token
+import requests
+
+import bigquery
+import google_ads
+import models
+import rollups
+import telemetry
+
+logging.basicConfig(stream=sys.stdout)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# The coordinator, and so its workers, run for up to the timeout of the
+# function, see timeout_seconds in terraform/main.tf
+FUNCTION_TIMEOUT_SECONDS = 3600
+# The time the coordinator keeps to add up & commit the writes of the workers
+COMMIT_SECONDS = 300
+
+RunWorker = Callable[[models.Payload], List[bigquery.StagedWrite]]
+
+
+class WorkQueue(abc.ABC):
+    """Runs the work items of a coordinator on workers.
+
+    Attributes:
+        deadline: the time.monotonic() by which to give up on the work items,
+            or None to wait for them.
+    """
+
+    deadline: Optional[float] = None
+
+    @abc.abstractmethod
+    def submit(
+        self, payload: models.Payload
+    ) -> 'concurrent.futures.Future[List[bigquery.StagedWrite]]':
+        """Send a work item to a worker.
+
+        Args:
+            payload: the payload of the work item.
+
+        Returns:
+            A future of the staged writes of the work item.
+        """
+
+    @abc.abstractmethod
+    def close(self, wait: bool = True) -> None:
+        """Release the queue.
+
+        Args:
+            wait: whether to wait for the work items to finish, otherwise the
+                ones that haven't started are cancelled.
+        """
+
+
+class LocalWorkQueue(WorkQueue):
+    """A work queue that runs the workers on threads of this process.
+
+    Stands in for the worker invocations when running locally & in tests.
+    """
+
+    def __init__(self, run_worker: RunWorker, max_workers: int):
+        self.run_worker = run_worker
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers)
+
+    def submit(
+        self, payload: models.Payload
+    ) -> 'concurrent.futures.Future[List[bigquery.StagedWrite]]':
+        return telemetry.submit(self._executor, self.run_worker, payload)
+
+    def close(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+
+
+class HttpWorkQueue(WorkQueue):
+    """A work queue that invokes the function over HTTP for each work item.
+
+    The requests are authenticated with an ID token of the service account of
+    the function, which needs to be allowed to invoke it. A work item that
+    isn't done by the deadline fails, see run_coordinator, while its worker
+    keeps running until its own timeout. Its staging tables are left in the
+    dataset until they expire.
+    """
+
+    def __init__(self, worker_url: str, max_workers: int, deadline: float):
+        """Initialize the queue.
+
+        Args:
+            worker_url: the URL of the function to invoke.
+            max_workers: the number of workers to invoke at a time.
+            deadline: the time.monotonic() by which to give up on the work
+                items.
+        """
+        self.worker_url = worker_url
+        self.deadline = deadline
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers)
+
+    def submit(
+        self, payload: models.Payload
+    ) -> 'concurrent.futures.Future[List[bigquery.StagedWrite]]':
+        return telemetry.submit(self._executor, self._invoke, payload)
+
+    def close(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+
+    def _invoke(self, payload: models.Payload) -> List[bigquery.StagedWrite]:
+        timeout = self.deadline - time.monotonic()
+        if timeout <= 0:
+            raise TimeoutError(
+                f'No time left to run work item {payload.work_item_id} before '
+                'the coordinator times out.')
+        token = id_token.fetch_id_token(auth_requests.Request(),
+                                        self.worker_url)
+        # A timeout of each read of the response, the deadline of the whole
+        # work item is enforced by run_coordinator
+        response = requests.post(
+            self.worker_url,
+            data=payload.model_dump_json(exclude_none=True),
+            headers={
+                'Authorization': f'Bearer {token}',
+                'Content-Type': 'application/json',
+            },
+            timeout=timeout)
+        response.raise_for_status()
+        return [
+            bigquery.StagedWrite(**staged_write)
+            for staged_write in response.json()['staged_writes']
+        ]
+
+
+def verify_coordinator(authorization: Optional[str], worker_url: str) -> None:
+    """Check that a work item was sent by a coordinator of this function.
+
+    The workers return the staging tables of their reports, so they only run
+    work items sent with an ID token of the service account of the function,
+    as HttpWorkQueue sends them.
+
+    Args:
+        authorization: the Authorization header of the request.
+        worker_url: the URL the work item was sent to, the audience of the
+            token.
+
+    Raises:
+        PermissionError: if the request has no valid ID token of the service
+            account of the function.
+    """
+    scheme, _, token = (authorization or '').partition(' ')
+    if scheme.lower() != 'bearer' or not token or not worker_url:
+        raise PermissionError(
+            'Work items need the worker_url they were sent to, and the ID '
+            'token of a coordinator.')
+    try:
+        claims = id_token.verify_oauth2_token(token,
+                                              auth_requests.Request(),
+                                              audience=worker_url)
+    except ValueError as e:
+        raise PermissionError(f'Invalid ID token: {e}') from e
+    service_account_email = get_service_account_email()
+    if (not claims.get('email_verified') or not service_account_email or
+            claims.get('email') != service_account_email):
+        raise PermissionError(
+            f'Work items can only be sent by {service_account_email}, not by '
+            f'{claims.get("email")}.')
+
+
+@functools.lru_cache(maxsize=None)
+def get_service_account_email() -> Optional[str]:
+    """Get the email of the service account the function runs as."""
+    credentials, _ = google.auth.default()
+    if getattr(credentials, 'service_account_email', None) == 'default':
+        # Read from the metadata server on refresh
+        credentials.refresh(auth_requests.Request())
+    return getattr(credentials, 'service_account_email', None)
+
+
+def get_work_queue(payload: models.Payload,
+                   run_worker: RunWorker,
+                   deadline: float = None) -> WorkQueue:
+    """Get the work queue configured in the payload.
+
+    Args:
+        payload: the configuration used in this execution.
+        run_worker: runs a work item, for the local work queue.
+        deadline: the time.monotonic() by which the workers invoked over HTTP
+            are given up on, by default COMMIT_SECONDS before the function
+            times out.
+    """
+    if payload.worker_url:
+        if deadline is None:
+            deadline = (time.monotonic() + FUNCTION_TIMEOUT_SECONDS -
+                        COMMIT_SECONDS)
+        return HttpWorkQueue(payload.worker_url, payload.max_concurrent_workers,
+                             deadline)
+    return LocalWorkQueue(run_worker, payload.max_concurrent_workers)
+
+
+def plan_work_items(payload: models.Payload,
+                    reports_to_run: Iterable[str]) -> List[models.Payload]:
+    """Split the reports to run by accounts into the payloads of work items.
+
+    The steps that apply to the whole run, like the table layouts and the
+    materialized views, are left to the coordinator.
+    """
+    job_id = uuid.uuid4().hex[:12]
+    # The workers run at the same time, each with its own rate limiter
+    max_requests_per_second = None
+    if payload.max_requests_per_second:
+        max_requests_per_second = (payload.max_requests_per_second /
+                                   payload.max_concurrent_workers)
+    work_items = []
+    for report in reports_to_run:
+        shards = google_ads.split_into_shards(payload.customer_ids,
+                                              payload.fan_out_customer_ids)
+        for index, customer_ids in enumerate(shards):
+            work_items.append(
+                payload.model_copy(
+                    update={
+                        'reports_to_run': [report],
+                        'customer_ids': customer_ids,
+                        'fan_out_customer_ids': None,
+                        'discover_customer_ids': False,
+                        'work_item_id': f'{job_id}/{report}/{index}',
+                        'manage_table_layouts': False,
+                        'recluster_tables': False,
+                        'materialize_views': False,
+                        # The workers don't commit, so can't mark reports done
+                        # or save the accounts they fetched
+                        'resumable_runs': False,
+                        'skip_unchanged_accounts': False,
+                        'max_requests_per_second': max_requests_per_second,
+                    }))
+    return work_items
+
+
+def get_sum_columns(
+        report_configs: Dict[str, models.ReportConfig]) -> Dict[str, List[str]]:
+    """Get the columns to add up across workers, by table.
+
+    The time series & rollups count the rows of each worker, the other tables
+    have the rows of each worker.
+    """
+    sum_columns = {}
+    for report_config in report_configs.values():
+        if report_config.time_series_table_name:
+            sum_columns[report_config.time_series_table_name] = [
+                rollups.COUNT_COLUMN
+            ]
+        for rollup in report_config.rollups or []:
+            sum_columns[rollup.table_name] = [
+                *rollup.sum_columns, rollups.COUNT_COLUMN
+            ]
+    return sum_columns
+
+
+def run_coordinator(payload: models.Payload,
+                    report_configs: Dict[str, models.ReportConfig],
+                    reports_to_run: Iterable[str],
+                    run_worker: RunWorker) -> List[str]:
+    """Run the reports on workers, and commit their writes together.
+
+    A report is only written if all of its work items succeeded by the
+    deadline of the work queue, the work items that haven't finished by then
+    fail without being waited on.
+
+    Args:
+        payload: the configuration used in this execution.
+        report_configs: the configs of all the reports.
+        reports_to_run: the names of the reports to run.
+        run_worker: runs a work item, for the local work queue.
+
+    Returns:
+        The names of the reports that failed.
+
+    Raises:
+        ValueError: if incremental snapshots are enabled, as their changes
+            are found by comparing whole reports.
+    """
+    if payload.incremental_snapshots:
+        raise ValueError(
+            'Incremental snapshots compare whole reports, they can not be '
+            'split across workers with fan_out_customer_ids.')
+    work_items = plan_work_items(payload, reports_to_run)
+    logger.info('Running %d work items of up to %d accounts', len(work_items),
+                payload.fan_out_customer_ids)
+
+    staged_writes = collections.defaultdict(list)
+    failed_reports = set()
+    work_queue = get_work_queue(payload, run_worker)
+    futures = {}
+    try:
+        futures = {
+            work_queue.submit(work_item): work_item for work_item in work_items
+        }
+        timeout = None
+        if work_queue.deadline is not None:
+            timeout = max(work_queue.deadline - time.monotonic(), 0)
+        for future in concurrent.futures.as_completed(futures, timeout=timeout):
+            work_item = futures.pop(future)
+            report = work_item.reports_to_run[0]
+            try:
+                staged_writes[report].extend(future.result())
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('Work item %s failed.', work_item.work_item_id)
+                failed_reports.add(report)
+    except concurrent.futures.TimeoutError:
+        for work_item in futures.values():
+            logger.error('Work item %s did not finish by the deadline.',
+                         work_item.work_item_id)
+            failed_reports.add(work_item.reports_to_run[0])
+    finally:
+        # The work items left are given up on, not waited for
+        work_queue.close(wait=not futures)
+
+    bq_writer = bigquery.get_writer(payload, 'WRITE_TRUNCATE')
+    worker_writes = [
+        staged_write for writes in staged_writes.values()
+        for staged_write in writes
+    ]
+    writes = []
+    try:
+        writes = aggregate_staged_counts(bq_writer, [
+            staged_write for report, writes in staged_writes.items()
+            if report not in failed_reports for staged_write in writes
+        ], get_sum_columns(report_configs))
+        if writes:
+            with telemetry.stage('commit', tables=len(writes)):
+                bq_writer.commit_staged(writes)
+    finally:
+        bq_writer.drop_staged(
+            [*worker_writes, *(set(writes) - set(worker_writes))])
+    return sorted(failed_reports)
+
+
+def aggregate_staged_counts(
+        bq_writer: bigquery.DataFrameBigQueryWriter,
+        staged_writes: List[bigquery.StagedWrite],
+        sum_columns: Dict[str, List[str]]) -> List[bigquery.StagedWrite]:
+    """Add up the staged counts of the workers into one table per destination.
+
+    Args:
+        bq_writer: the writer of the staging tables.
+        staged_writes: the staged writes of all the workers.
+        sum_columns: the columns to add up, by destination, see
+            get_sum_columns.
+
+    Returns:
+        The staged writes, with the writes to the same destination of
+        sum_columns replaced by a single write of their total.
+    """
+    writes_by_destination = collections.defaultdict(list)
+    for staged_write in staged_writes:
+        writes_by_destination[staged_write.destination].append(staged_write)
+
+    aggregated_writes = []
+    total_writes = []
+    try:
+        for destination, writes in writes_by_destination.items():
+            if destination not in sum_columns or len(writes) == 1:
+                aggregated_writes.extend(writes)
+                continue
+            total_write = writes[0]._replace(
+                staging_table=f'{writes[0].staging_table}_total')
+            total_writes.append(total_write)
+            with telemetry.stage('aggregate',
+                                 table=destination,
+                                 staged_tables=len(writes)):
+                bq_writer.aggregate_staged(writes, total_write.staging_table,
+                                           sum_columns[destination])
+            aggregated_writes.append(total_write)
+    except Exception:
+        bq_writer.drop_staged(total_writes)
+        raise
+    return aggregated_writes
@@ -0,0 +1,173 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for fanout.py"""
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+import bigquery
+import fanout
+import models
+
+PAYLOAD = models.Payload(project_id='my_project',
+                         bq_output_dataset='my_dataset',
+                         region='europe-west2',
+                         google_ads_login_customer_id=123,
+                         customer_ids=[1, 2, 3, 4, 5],
+                         fan_out_customer_ids=2,
+                         materialize_views=True)
+REPORT_CONFIGS = {
+    'AdPolicyData':
+        models.ReportConfig(table_name='AdPolicyData',
+                            write_disposition='WRITE_APPEND',
+                            time_series_table_name='AdPolicyDataTimeSeries'),
+    'Ocid':
+        models.ReportConfig(table_name='Ocid',
+                            write_disposition='WRITE_TRUNCATE'),
+}
+
+
+def staged_write(destination: str, index: int) -> bigquery.StagedWrite:
+    return bigquery.StagedWrite(destination=destination,
+                                staging_table=f'{destination}_staging_{index}',
+                                write_disposition='WRITE_APPEND',
+                                partition_date='2024-01-01')
+
+
+class FanoutTestCase(unittest.TestCase):
+
+    def test_plan_work_items(self):
+        work_items = fanout.plan_work_items(PAYLOAD, ['Ocid', 'AdPolicyData'])
+
+        self.assertEqual(
+            [(item.reports_to_run, item.customer_ids) for item in work_items],
+            [(['Ocid'], [1, 2]), (['Ocid'], [3, 4]), (['Ocid'], [5]),
+             (['AdPolicyData'], [1, 2]), (['AdPolicyData'], [3, 4]),
+             (['AdPolicyData'], [5])])
+        for item in work_items:
+            self.assertIsNone(item.fan_out_customer_ids)
+            self.assertFalse(item.materialize_views)
+            self.assertIsNotNone(item.work_item_id)
+
+    def test_aggregate_staged_counts(self):
+        bq_writer = MagicMock()
+        writes = [
+            staged_write('AdPolicyData', 0),
+            staged_write('AdPolicyDataTimeSeries', 1),
+            staged_write('AdPolicyData', 2),
+            staged_write('AdPolicyDataTimeSeries', 3),
+        ]
+
+        aggregated_writes = fanout.aggregate_staged_counts(
+            bq_writer, writes, fanout.get_sum_columns(REPORT_CONFIGS))
+
+        bq_writer.aggregate_staged.assert_called_once_with(
+            [writes[1], writes[3]], 'AdPolicyDataTimeSeries_staging_1_total',
+            ['counts'])
+        self.assertEqual(aggregated_writes, [
+            writes[0], writes[2], writes[1]._replace(
+                staging_table='AdPolicyDataTimeSeries_staging_1_total')
+        ])
+
+    @patch('fanout.bigquery.get_writer')
+    def test_run_coordinator_drops_failed_reports(self, mock_get_writer):
+
+        def run_worker(payload):
+            if payload.reports_to_run == ['Ocid'] and 5 in payload.customer_ids:
+                raise ValueError('Quota exceeded')
+            return [
+                staged_write(payload.reports_to_run[0], payload.customer_ids[0])
+            ]
+
+        failed_reports = fanout.run_coordinator(PAYLOAD, REPORT_CONFIGS,
+                                                ['Ocid', 'AdPolicyData'],
+                                                run_worker)
+
+        self.assertEqual(failed_reports, ['Ocid'])
+        bq_writer = mock_get_writer.return_value
+        committed_writes = bq_writer.commit_staged.call_args.args[0]
+        self.assertCountEqual(committed_writes, [
+            staged_write('AdPolicyData', 1),
+            staged_write('AdPolicyData', 3),
+            staged_write('AdPolicyData', 5),
+        ])
+        self.assertEqual(len(bq_writer.drop_staged.call_args.args[0]), 5)
+
+    @patch('fanout.requests.post')
+    @patch('fanout.id_token.fetch_id_token', return_value='token')
+    def test_http_work_queue_gives_up_at_the_deadline(self, _, mock_post):
+        mock_post.return_value.json.return_value = {'staged_writes': []}
+        work_queue = fanout.HttpWorkQueue('https://worker', 1,
+                                          time.monotonic() + 60)
+        self.assertEqual(work_queue.submit(PAYLOAD).result(), [])
+        self.assertLessEqual(mock_post.call_args.kwargs['timeout'], 60)
+
+        work_queue.deadline = time.monotonic()
+        with self.assertRaises(TimeoutError):
+            work_queue.submit(PAYLOAD).result()
+        work_queue.close()
+        mock_post.assert_called_once()
+
+    @patch('fanout.bigquery.get_writer')
+    def test_run_coordinator_gives_up_at_the_deadline(self, mock_get_writer):
+        work_queue = MagicMock()
+        work_queue.deadline = time.monotonic()
+
+        def submit(payload):
+            future = fanout.concurrent.futures.Future()
+            if payload.reports_to_run == ['AdPolicyData']:
+                future.set_result(
+                    [staged_write('AdPolicyData', payload.customer_ids[0])])
+            return future
+
+        work_queue.submit.side_effect = submit
+        with patch('fanout.get_work_queue', return_value=work_queue):
+            failed_reports = fanout.run_coordinator(PAYLOAD, REPORT_CONFIGS,
+                                                    ['Ocid', 'AdPolicyData'],
+                                                    MagicMock())
+
+        self.assertEqual(failed_reports, ['Ocid'])
+        work_queue.close.assert_called_once_with(wait=False)
+        bq_writer = mock_get_writer.return_value
+        self.assertEqual(len(bq_writer.commit_staged.call_args.args[0]), 3)
+
+    @patch('fanout.get_service_account_email',
+           return_value='ads-policy-monitor@my_project.iam.gserviceaccount.com')
+    @patch('fanout.id_token.verify_oauth2_token')
+    def test_verify_coordinator(self, mock_verify_oauth2_token, _):
+        mock_verify_oauth2_token.return_value = {
+            'email': 'ads-policy-monitor@my_project.iam.gserviceaccount.com',
+            'email_verified': True,
+        }
+        fanout.verify_coordinator('Bearer token', 'https://worker')
+        self.assertEqual(mock_verify_oauth2_token.call_args.kwargs['audience'],
+                         'https://worker')
+
+        with self.assertRaises(PermissionError):
+            fanout.verify_coordinator(None, 'https://worker')
+        with self.assertRaises(PermissionError):
+            fanout.verify_coordinator('Bearer token', None)
+        mock_verify_oauth2_token.return_value = {
+            'email': 'someone@example.com',
+            'email_verified': True,
+        }
+        with self.assertRaises(PermissionError):
+            fanout.verify_coordinator('Bearer token', 'https://worker')
+        mock_verify_oauth2_token.side_effect = ValueError('Token expired')
+        with self.assertRaises(PermissionError):
+            fanout.verify_coordinator('Bearer token', 'https://worker')
+
+
+if __name__ == '__main__':
+    unittest.main()
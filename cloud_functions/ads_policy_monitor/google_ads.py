@@ -12,21 +12,35 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """Utilities for working with the Google Ads API."""
+import concurrent.futures
+import contextlib
+import itertools
 import logging
 import os
 import random
 import sys
-from typing import List, Dict
+import threading
+import time
+from typing import List, Dict, Iterator, Optional
 
+from gaarf import parsers
+from gaarf import query_editor
 from gaarf.api_clients import GoogleAdsApiClient
 from gaarf.builtin_queries import BUILTIN_QUERIES
-from gaarf.io import reader
 from gaarf.query_executor import AdsReportFetcher
 from gaarf.report import GaarfReport
+from google.ads.googleads.errors import GoogleAdsException
+from google.api_core import exceptions as api_exceptions
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+from pyarrow import compute
 
+import checkpoints
 import models
+import rate_limit
+import synthetic
+import telemetry
 import utils
 
 logging.basicConfig(stream=sys.stdout)
@@ -42,6 +56,13 @@ GOOGLE_ADS_DEVELOPER_TOKEN = os.environ.get('GOOGLE_ADS_DEVELOPER_TOKEN')
 
 TIME_SERIES_DATE_COLUMN = "event_date"
 
+# Clients are reused until the time to live, the credentials don't change
+ADS_CLIENT_TTL_SECONDS = 3600
+
+# Retries of a customer shard that hit the Google Ads API quota
+MAX_FETCH_RETRIES = 5
+FETCH_RETRY_BASE_DELAY_SECONDS = 2
+
 GROUP_BY_ASSET_POLICY_COLUMNS = [
     TIME_SERIES_DATE_COLUMN,
     "customer_id",
@@ -55,174 +76,803 @@ GROUP_BY_ASSET_POLICY_COLUMNS = [
     "asset_level",
 ]
 
+ASSET_POLICY_TOPICS_COLUMN = "asset_policy_summary_policy_topic_entries_topics"
+
+# The REPEATED columns the policy topics are written to as arrays, with
+# policy_topics_as_arrays, in place of the joined topic strings
+POLICY_TOPICS_ARRAY_COLUMNS = {
+    "ad_group_ad_policy_summary_policy_topic_entries": "ad_policy_topics",
+    ASSET_POLICY_TOPICS_COLUMN: "asset_policy_topics",
+}
+
+# Low cardinality string columns, stored as categories to save memory
+CATEGORICAL_ASSET_POLICY_COLUMNS = [
+    TIME_SERIES_DATE_COLUMN,
+    "customer_descriptive_name",
+    "asset_source",
+    "asset_type",
+    "asset_policy_summary_review_status",
+    ASSET_POLICY_TOPICS_COLUMN,
+    "asset_policy_summary_approval_status",
+    "asset_level",
+]
+
+# The integer columns of the asset group by, the others are strings
+INTEGER_ASSET_POLICY_COLUMNS = ["customer_id", "asset_id"]
+
+# The IDs of the campaign & ad group of the assets, missing at higher levels
+ASSET_LEVEL_ID_COLUMNS = ["campaign_id", "ad_group_id"]
+
+_DICTIONARY_STRING = pa.dictionary(pa.int32(), pa.string())
+_STRING_LIST = pa.list_(pa.string())
+# Joins the topics of the group by key of the asset topics as arrays, the ASCII
+# unit separator isn't in any topic
+_TOPICS_KEY_SEPARATOR = '\x1f'
+# The row of each asset, to take the topic arrays of the groups from
+_ROW_COLUMN = 'row'
+
+TODAY_PLACEHOLDER = '{{ today }}'
+
+# The number of GAARF reports converted to dataframes by this instance
+dataframe_conversions = 0
+_dataframe_conversions_lock = threading.Lock()
+
+ads_client_pool = utils.ClientPool(ADS_CLIENT_TTL_SECONDS)
+
+# Shared by all the fetches of the instance, as they share the quota of the
+# developer token
+rate_limiter = rate_limit.AdaptiveRateLimiter()
+
 
 def get_ads_client(payload: models.Payload) -> GoogleAdsApiClient:
     """Get a Google Ads Client based on the payload.
 
+    The client is taken from the pool for the login customer ID, and only
+    created if there isn't one yet.
+
     Args:
         payload: the configuration used in this execution.
 
     Returns:
         The GAARF implementation of the Google Ads API client
     """
-    logger.info('Getting Google Ads client.')
+    return ads_client_pool.get(
+        payload.google_ads_login_customer_id,
+        lambda: create_ads_client(payload.google_ads_login_customer_id))
+
+
+def create_ads_client(login_customer_id: int) -> GoogleAdsApiClient:
+    """Create a Google Ads Client with the credentials of the environment."""
+    logger.info('Creating Google Ads client for %d.', login_customer_id)
     credentials = {
         'developer_token': GOOGLE_ADS_DEVELOPER_TOKEN,
         'refresh_token': GOOGLE_ADS_REFRESH_TOKEN,
         'client_id': GOOGLE_ADS_CLIENT_ID,
         'client_secret': GOOGLE_ADS_CLIENT_SECRET,
         'use_proto_plus': True,
-        'login_customer_id': payload.google_ads_login_customer_id,
+        'login_customer_id': login_customer_id,
     }
-    return GoogleAdsApiClient(config_dict=credentials,
-                              version=GOOGLE_ADS_API_VERSION)
-
-
-def run_gaarf_report(payload: models.Payload,
-                     report_config: models.ReportConfig,
-                     report_fetcher: AdsReportFetcher = None) -> GaarfReport:
+    with telemetry.stage('create_ads_client',
+                         login_customer_id=login_customer_id):
+        return GoogleAdsApiClient(config_dict=credentials,
+                                  version=GOOGLE_ADS_API_VERSION)
+
+
+def run_gaarf_report(
+        payload: models.Payload,
+        report_config: models.ReportConfig,
+        report_fetcher: AdsReportFetcher = None,
+        checkpoint: Optional[checkpoints.ReportCheckpoint] = None
+) -> pd.DataFrame:
     """Run a report through GAARF.
 
+    The report is converted to a dataframe once, which is then used for both
+    the table and the time series writes. With use_synthetic_data, the report
+    is generated with payload.synthetic_num_rows rows, or read from the
+    synthetic_data files if it's not set.
+
     Args:
         payload: the configuration used in this execution.
         report_config: the config of the report to run.
         report_fetcher: an instance of the AdsReportFetcher for dependency
             injection.
+        checkpoint: the checkpoint of the report, to resume the shards
+            fetched by an earlier run.
 
     Returns:
-        A GAARF report.
-
-    Raises:
-        NotImplementedError if an unexpected report type is provided.
+        A dataframe with the results of the report.
     """
     logger.info('Running report from gaarf for %s:', report_config.table_name)
 
-    if payload.use_synthetic_data:
-        return get_google_ads_synthetic_data(
+    if payload.use_synthetic_data and payload.synthetic_num_rows:
+        report_df = synthetic.generate_report(
+            report_config.table_name,
+            num_rows=payload.synthetic_num_rows,
+            num_customers=payload.synthetic_num_customers,
+            seed=payload.synthetic_seed,
+            event_date=utils.get_current_date())
+    elif payload.use_synthetic_data:
+        report_df = get_google_ads_synthetic_data(
             table_name=report_config.table_name)
-
+    else:
+        report_df = fetch_gaarf_report(payload, report_config, report_fetcher,
+                                       checkpoint)
+    if payload.policy_topics_as_arrays:
+        report_df = policy_topics_to_arrays(report_df)
+    return report_df
+
+
+def fetch_gaarf_report(
+        payload: models.Payload,
+        report_config: models.ReportConfig,
+        report_fetcher: AdsReportFetcher = None,
+        checkpoint: Optional[checkpoints.ReportCheckpoint] = None
+) -> pd.DataFrame:
+    """Fetch a report from the Google Ads API, see run_gaarf_report."""
     if report_fetcher is None:
         client = get_ads_client(payload)
         report_fetcher = AdsReportFetcher(client)
 
     if report_config.is_builtin:
-        return run_builtin_query(query_name=report_config.builtin_query_name,
-                                 report_fetcher=report_fetcher,
-                                 customer_ids=payload.customer_ids)
+        return report_to_dataframe(
+            run_builtin_query(query_name=report_config.builtin_query_name,
+                              report_fetcher=report_fetcher,
+                              customer_ids=payload.customer_ids))
 
     if report_config.is_asset_report:
-        all_reports = []
-        for gaql_filename in report_config.gaql_filenames:
-            path = f'gaql/{gaql_filename}'
-            all_reports.append(
-                run_query_from_file(
-                    query_path=path,
-                    report_fetcher=report_fetcher,
-                    customer_ids=payload.customer_ids,
-                ))
-        return combine_assets_reports(all_reports)
+        return run_asset_queries(payload, report_config, report_fetcher,
+                                 checkpoint)
 
     path = f'gaql/{report_config.gaql_filenames}'
-    return run_query_from_file(
-        query_path=path,
-        report_fetcher=report_fetcher,
-        customer_ids=payload.customer_ids,
-    )
+    return report_to_dataframe(
+        run_query_from_file(
+            query_path=path,
+            report_fetcher=report_fetcher,
+            customer_ids=payload.customer_ids,
+            customer_ids_per_shard=payload.customer_ids_per_shard,
+            max_workers=payload.max_fetch_workers,
+            checkpoint=checkpoint,
+        ))
+
+
+def report_to_dataframe(gaarf_report: GaarfReport) -> pd.DataFrame:
+    """Convert a GAARF report to a dataframe, counting the conversions.
+
+    An empty report is converted with its placeholder row, so the columns
+    still get the types of the Google Ads fields.
+    """
+    global dataframe_conversions
+    with _dataframe_conversions_lock:
+        dataframe_conversions += 1
+    logger.info('Converting GAARF report with %d rows to a dataframe',
+                len(gaarf_report.results))
+    with telemetry.stage('convert') as record:
+        if not gaarf_report.results and gaarf_report.results_placeholder:
+            report_df = pd.DataFrame(data=gaarf_report.results_placeholder,
+                                     columns=gaarf_report.column_names).head(0)
+        else:
+            report_df = gaarf_report.to_pandas()
+        record.set_output(report_df)
+    return report_df
+
+
+def run_asset_queries(
+        payload: models.Payload,
+        report_config: models.ReportConfig,
+        report_fetcher: AdsReportFetcher,
+        checkpoint: Optional[checkpoints.ReportCheckpoint] = None
+) -> pd.DataFrame:
+    """Run the asset queries in parallel and combine them into one report.
 
+    Each query is a full pass over every account, so they are all fetched at
+    the same time with the shared report fetcher. Each report is converted to
+    an Arrow table as soon as its query finishes.
+
+    Args:
+        payload: the configuration used in this execution.
+        report_config: the config of the asset report to run.
+        report_fetcher: the fetcher shared by all the queries.
+        checkpoint: the checkpoint of the report, shared by all the queries.
 
-def combine_assets_reports(gaarf_reports: List[GaarfReport]) -> GaarfReport:
+    Returns:
+        A dataframe with one row per asset and level.
+    """
+    gaql_filenames = report_config.gaql_filenames
+    asset_tables = [None] * len(gaql_filenames)
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(gaql_filenames)) as executor:
+        futures = {
+            telemetry.submit(
+                executor,
+                run_query_from_file,
+                query_path=f'gaql/{gaql_filename}',
+                report_fetcher=report_fetcher,
+                customer_ids=payload.customer_ids,
+                customer_ids_per_shard=payload.customer_ids_per_shard,
+                max_workers=payload.max_fetch_workers,
+                checkpoint=checkpoint,
+            ):
+                index for index, gaql_filename in enumerate(gaql_filenames)
+        }
+        for future in concurrent.futures.as_completed(futures):
+            asset_tables[futures[future]] = prepare_assets_report(
+                future.result(), payload.policy_topics_as_arrays)
+    return concat_assets_reports(asset_tables)
+
+
+def combine_assets_reports(
+        gaarf_reports: List[GaarfReport],
+        policy_topics_as_arrays: bool = False) -> pd.DataFrame:
     """Combine assets reports.
 
     Args:
         gaarf_reports: a list of gaarf reports.
+        policy_topics_as_arrays: whether to keep the topics as arrays, see
+            prepare_assets_report.
+
+    Returns:
+        A dataframe with one row per asset and level.
+    """
+    return concat_assets_reports([
+        prepare_assets_report(report, policy_topics_as_arrays)
+        for report in gaarf_reports
+    ])
+
+
+def prepare_assets_report(
+        gaarf_report: GaarfReport,
+        policy_topics_as_arrays: bool = False) -> Optional[pa.Table]:
+    """Convert an assets report to an Arrow table for the combine step.
+
+    Only the group by columns and the IDs of the asset level are converted,
+    straight from the rows of the report, so the report never goes through a
+    dataframe. The strings are dictionary encoded, for the group by to work
+    on their indices, and the policy topics are joined into strings. With
+    policy_topics_as_arrays, the topics are kept as a list column instead,
+    and only joined into the group by key, as lists can't be grouped by.
+
+    Args:
+        gaarf_report: the report of one of the asset queries.
+        policy_topics_as_arrays: whether to keep the topics as arrays.
+
+    Returns:
+        A table, or None if the report has no results.
+    """
+    column_names = gaarf_report.column_names
+    # If no results in the report, then skip
+    if (not gaarf_report.results or
+            gaarf_report.results[0][column_names.index('customer_id')] == 0):
+        return None
+
+    if ("ad_group_id" in column_names and "campaign_id" in column_names):
+        asset_level = "Ad Group"
+    elif ("campaign_id" in column_names):
+        asset_level = "Campaign"
+    else:
+        asset_level = "Account"
+
+    column_types = {
+        column: (pa.int64() if column in INTEGER_ASSET_POLICY_COLUMNS else
+                 _DICTIONARY_STRING)
+        for column in GROUP_BY_ASSET_POLICY_COLUMNS
+        if column not in (ASSET_POLICY_TOPICS_COLUMN, "asset_level")
+    }
+    for column in ASSET_LEVEL_ID_COLUMNS:
+        if column in column_names:
+            column_types[column] = pa.int64()
+    asset_table = report_to_table(gaarf_report, column_types)
+
+    num_rows = asset_table.num_rows
+    topics = policy_topics_array(gaarf_report.results,
+                                 column_names.index(ASSET_POLICY_TOPICS_COLUMN))
+    level_columns = {
+        ASSET_POLICY_TOPICS_COLUMN:
+            compute.dictionary_encode(
+                join_policy_topics(
+                    topics,
+                    _TOPICS_KEY_SEPARATOR if policy_topics_as_arrays else ' | ')
+            ),
+        "asset_level":
+            pa.DictionaryArray.from_arrays(
+                pa.array(np.zeros(num_rows, dtype='int32')),
+                pa.array([asset_level])),
+    }
+    # Missing level IDs are null, which 'first' skips like NaN
+    for column in ASSET_LEVEL_ID_COLUMNS:
+        if column not in column_names:
+            level_columns[column] = pa.nulls(num_rows, pa.int64())
+    array_columns = []
+    if policy_topics_as_arrays:
+        array_column = POLICY_TOPICS_ARRAY_COLUMNS[ASSET_POLICY_TOPICS_COLUMN]
+        level_columns[array_column] = compute.fill_null(
+            topics, pa.scalar([], _STRING_LIST))
+        array_columns.append(array_column)
+    for column, values in level_columns.items():
+        asset_table = asset_table.append_column(column, values)
+    return asset_table.select([
+        *GROUP_BY_ASSET_POLICY_COLUMNS, *ASSET_LEVEL_ID_COLUMNS, *array_columns
+    ])
+
+
+def report_to_table(gaarf_report: GaarfReport,
+                    column_types: Dict[str, pa.DataType]) -> pa.Table:
+    """Convert columns of a GAARF report to an Arrow table, counting them.
+
+    Each column is read from the rows of the report into an Arrow array of
+    its type, without building a Python object per row.
+
+    Args:
+        gaarf_report: the report to convert.
+        column_types: the Arrow type of each column to convert.
+
+    Returns:
+        A table with the columns in the order of column_types.
+    """
+    global dataframe_conversions
+    with _dataframe_conversions_lock:
+        dataframe_conversions += 1
+    logger.info('Converting GAARF report with %d rows to a table',
+                len(gaarf_report.results))
+    with telemetry.stage('convert') as record:
+        indexes = {
+            column: gaarf_report.column_names.index(column)
+            for column in column_types
+        }
+        report_table = pa.table({
+            column:
+                pa.array([row[indexes[column]]
+                          for row in gaarf_report.results], column_type)
+            for column, column_type in column_types.items()
+        })
+        record.set_output(report_table)
+    return report_table
+
+
+def concat_assets_reports(
+        asset_tables: List[Optional[pa.Table]]) -> pd.DataFrame:
+    """Concatenate the assets reports and aggregate them into one report.
+
+    The tables are concatenated without a copy and grouped once by Arrow, so
+    only the aggregated rows are converted to a dataframe. The groups keep
+    the order of their first row, which is the order of the reports. The
+    topic arrays of policy_topics_as_arrays are taken from the first row of
+    each group, in place of their joined group by key.
+
+    Args:
+        asset_tables: the output of prepare_assets_report for each asset
+            query.
 
     Returns:
-        A GAARF report.
+        A dataframe with one row per asset and level.
     """
     logger.info('Combining Assets reports')
-    combined_assets_report = pd.DataFrame()
-    for report in gaarf_reports:
-        report_df = report.to_pandas()
-
-        # If no results in the report, then skip
-        if report_df.empty or report_df["customer_id"][0] == 0:
-            continue
-
-        if ("ad_group_id" in report_df.keys() and
-                "campaign_id" in report_df.keys()):
-            report_df["asset_level"] = "Ad Group"
-        elif ("campaign_id" in report_df.keys()):
-            report_df["asset_level"] = "Campaign"
-            report_df["ad_group_id"] = None
-        else:
-            report_df["asset_level"] = "Account"
-            report_df["ad_group_id"] = None
-            report_df["campaign_id"] = None
+    asset_tables = [
+        asset_table for asset_table in asset_tables if asset_table is not None
+    ]
+    if not asset_tables:
+        return pd.DataFrame()
+
+    with telemetry.stage('combine', reports=len(asset_tables)) as record:
+        asset_table = pa.concat_tables(asset_tables).unify_dictionaries()
+        aggregations = [
+            ('campaign_id', 'first'),
+            ('ad_group_id', 'first'),
+            ('asset_id', 'count'),
+        ]
+        column_names = [
+            *GROUP_BY_ASSET_POLICY_COLUMNS, 'example_campaign_id',
+            'example_ad_group_id', 'counts'
+        ]
+        array_column = POLICY_TOPICS_ARRAY_COLUMNS[ASSET_POLICY_TOPICS_COLUMN]
+        has_arrays = array_column in asset_table.column_names
+        if has_arrays:
+            # Lists can't be aggregated, the topics of each group are taken
+            # from its first row
+            asset_table = asset_table.append_column(
+                _ROW_COLUMN, pa.array(np.arange(asset_table.num_rows)))
+            aggregations.append((_ROW_COLUMN, 'min'))
+            column_names.append(_ROW_COLUMN)
+        # Ordered aggregations like 'first' need a single thread
+        combined_table = asset_table.group_by(
+            GROUP_BY_ASSET_POLICY_COLUMNS,
+            use_threads=False).aggregate(aggregations)
+        combined_table = combined_table.rename_columns(column_names)
+        if has_arrays:
+            combined_table = combined_table.drop_columns(
+                [ASSET_POLICY_TOPICS_COLUMN, _ROW_COLUMN]).append_column(
+                    array_column,
+                    asset_table[array_column].take(combined_table[_ROW_COLUMN]))
+        combined_df = combined_table.to_pandas()
+        if has_arrays:
+            combined_df[array_column] = combined_table[array_column].to_pylist()
+        combined_df['example_campaign_id'] = combined_df[
+            'example_campaign_id'].fillna(0).astype('int64')
+        combined_df['example_ad_group_id'] = combined_df[
+            'example_ad_group_id'].fillna(0).astype('int64')
+        # The dictionaries are in the order the values were first seen
+        for column in CATEGORICAL_ASSET_POLICY_COLUMNS:
+            if column not in combined_df:
+                continue
+            combined_df[column] = combined_df[column].cat.reorder_categories(
+                sorted(combined_df[column].cat.categories))
+        record.set_output(combined_df)
+
+    return combined_df
+
+
+def policy_topics_array(rows: List[list], index: int) -> pa.Array:
+    """Read the lists of policy topics of a column into an Arrow list array.
+
+    Values that are already strings, like in the synthetic data, are a list
+    of that string, and missing topics are null.
 
-        # Convert policy_topic_entries to str (otherwise group by will fail)
-        report_df[
-            "asset_policy_summary_policy_topic_entries_topics"] = report_df[
-                "asset_policy_summary_policy_topic_entries_topics"].apply(
-                    lambda x: x if isinstance(x, str) else ' | '.join(x))
+    Args:
+        rows: the rows of a report.
+        index: the index of the policy topics column in the rows.
 
-        # Get number of times the asset is used per level, and example IDs it is used at
-        report_df = report_df.groupby(GROUP_BY_ASSET_POLICY_COLUMNS).agg(
-            example_campaign_id=('campaign_id', 'first'),
-            example_ad_group_id=('ad_group_id', 'first'),
-            counts=('asset_id', 'count')).reset_index()
+    Returns:
+        A list array with the topics of each row.
+    """
+    topics = [row[index] for row in rows]
+    # Arrow would read a string as a list of its characters
+    if any(isinstance(topic, str) for topic in topics):
+        topics = [
+            [topic] if isinstance(topic, str) else topic for topic in topics
+        ]
+    return pa.array(topics, _STRING_LIST)
 
-        combined_assets_report = pd.concat([combined_assets_report, report_df])
 
-    if ('example_campaign_id' in combined_assets_report.keys() or
-            'example_ad_group_id' in combined_assets_report.keys()):
-        combined_assets_report['example_campaign_id'] = combined_assets_report[
-            'example_campaign_id'].fillna(0)
-        combined_assets_report['example_ad_group_id'] = combined_assets_report[
-            'example_ad_group_id'].fillna(0)
+def join_policy_topics(topics: pa.Array, separator: str = ' | ') -> pa.Array:
+    """Join the lists of policy topics into strings, by Arrow.
 
-    return GaarfReport.from_pandas(combined_assets_report)
+    Args:
+        topics: the list array of policy_topics_array.
+        separator: the separator of the topics.
 
+    Returns:
+        A string array with the joined topics of each row, empty for the
+        missing topics.
+    """
+    return compute.fill_null(compute.binary_join(topics, separator), '')
 
-def extract_time_series(gaarf_report: GaarfReport,
-                        report_config: models.ReportConfig) -> GaarfReport:
-    """Creates time series report from a gaarf report
+
+def policy_topics_to_arrays(report_df: pd.DataFrame) -> pd.DataFrame:
+    """Move the policy topics of a report to their array columns.
+
+    Each topic column in POLICY_TOPICS_ARRAY_COLUMNS is replaced by a column
+    of lists, which is written as a REPEATED STRING column. The topic string
+    column is dropped, so it's NULL in BigQuery.
 
     Args:
-        gaarf_report: a gaarf report.
+        report_df: the dataframe of a report.
+
+    Returns:
+        The dataframe with the topics as lists.
+    """
+    topic_columns = {
+        column: array_column
+        for column, array_column in POLICY_TOPICS_ARRAY_COLUMNS.items()
+        if column in report_df
+    }
+    if not topic_columns:
+        return report_df
+    return report_df.assign(
+        **{
+            array_column: [
+                list(split_policy_topics(topic)) for topic in report_df[column]
+            ] for column, array_column in topic_columns.items()
+        }).drop(columns=list(topic_columns))
+
+
+def split_policy_topics(topic) -> tuple:
+    """Get the policy topics of a row as a tuple, from a list or a string."""
+    if isinstance(topic, str):
+        return tuple(part.strip() for part in topic.split('|') if part.strip())
+    if isinstance(topic, (list, tuple)):
+        return tuple(topic)
+    return ()
+
+
+def extract_time_series(report_df: pd.DataFrame,
+                        report_config: models.ReportConfig) -> pd.DataFrame:
+    """Creates time series report from a report dataframe
+
+    Args:
+        report_df: the dataframe of the report.
         report_config: the config of the report to run.
 
     Returns:
-        A GAARF report.
+        A dataframe with the counts per date and time series variable.
     """
     logger.info('Creating time series')
-    report_df = gaarf_report.to_pandas()
-    report_df = report_df.groupby([
-        TIME_SERIES_DATE_COLUMN, report_config.time_series_variable_column
-    ]).size().reset_index(name='counts')
+    return report_df.groupby(
+        [TIME_SERIES_DATE_COLUMN, report_config.time_series_variable_column],
+        observed=True).size().reset_index(name='counts')
+
 
-    return GaarfReport.from_pandas(report_df)
+def combine_time_series(time_series_dfs: List[pd.DataFrame],
+                        report_config: models.ReportConfig) -> pd.DataFrame:
+    """Add up the time series extracted from batches of the same report."""
+    return pd.concat(time_series_dfs).groupby(
+        [TIME_SERIES_DATE_COLUMN, report_config.time_series_variable_column],
+        observed=True)['counts'].sum().reset_index()
 
 
 def run_builtin_query(query_name: str, report_fetcher: AdsReportFetcher,
                       customer_ids: List[int]) -> GaarfReport:
     """Run a built-in query from GAARF and return the report."""
     logger.info('Running built-in query: %s', query_name)
-    return BUILTIN_QUERIES[query_name](report_fetcher, customer_ids)
-
-
-def run_query_from_file(query_path: str, report_fetcher: AdsReportFetcher,
-                        customer_ids: List[int]) -> GaarfReport:
+    rate_limiter.acquire(len(customer_ids))
+    with limit_quota_errors():
+        report = BUILTIN_QUERIES[query_name](report_fetcher, customer_ids)
+    rate_limiter.on_success(len(customer_ids))
+    return report
+
+
+def run_query_from_file(
+        query_path: str,
+        report_fetcher: AdsReportFetcher,
+        customer_ids: List[int],
+        customer_ids_per_shard: Optional[int] = None,
+        max_workers: int = 1,
+        checkpoint: Optional[checkpoints.ReportCheckpoint] = None
+) -> GaarfReport:
     """Run a query from a file and return the report."""
     logger.info('Running query for: %s', query_path)
-    reader_client = reader.FileReader()
-    query = reader_client.read(query_path)
-    # replace special today placeholder with the correct date
-    query = query.replace('{{ today }}', f'"{utils.get_current_date()}"')
+    query = read_query(query_path)
+    with telemetry.attributes(query=os.path.basename(query_path)):
+        return fetch_sharded(query, report_fetcher, customer_ids,
+                             customer_ids_per_shard, max_workers, checkpoint)
+
+
+class QueryTemplate:
+    """A GAQL query split on the today placeholder, to fill in the date."""
+
+    def __init__(self, query: str):
+        self.parts = query.split(TODAY_PLACEHOLDER)
+
+    def render(self, date: str) -> str:
+        return f'"{date}"'.join(self.parts)
+
+
+def read_query(query_path: str) -> str:
+    """Read a query from a file, with the today placeholder filled in.
+
+    The file is only read once, then cached in the file registry.
+    """
+    template = utils.file_registry.get(query_path, QueryTemplate)
+    query = template.render(utils.get_current_date())
     logger.info(query)
-    return report_fetcher.fetch(query, customer_ids)
+    return query
+
+
+def is_streamable(report_config: models.ReportConfig) -> bool:
+    """Check if a report can be streamed to BigQuery in batches.
+
+    Built-in and asset reports are post-processed as a whole, so only the
+    reports from a single GAQL file can be streamed.
+    """
+    return not (report_config.is_builtin or report_config.is_asset_report)
+
+
+def stream_gaarf_report(
+        payload: models.Payload,
+        report_config: models.ReportConfig,
+        report_fetcher: AdsReportFetcher = None) -> Iterator[pd.DataFrame]:
+    """Stream a report from a GAQL file as dataframes of a fixed size.
+
+    Args:
+        payload: the configuration used in this execution.
+        report_config: the config of the report to run, see is_streamable.
+        report_fetcher: an instance of the AdsReportFetcher for dependency
+            injection.
+
+    Yields:
+        Dataframes of at most payload.stream_batch_size rows. A single empty
+        dataframe is yielded if the report has no results.
+    """
+    logger.info('Streaming report from gaarf for %s:', report_config.table_name)
+    if report_fetcher is None:
+        report_fetcher = AdsReportFetcher(get_ads_client(payload))
+    query = read_query(f'gaql/{report_config.gaql_filenames}')
+    for report_df in stream_query(query, report_fetcher, payload.customer_ids,
+                                  payload.stream_batch_size):
+        if payload.policy_topics_as_arrays:
+            report_df = policy_topics_to_arrays(report_df)
+        yield report_df
+
+
+def stream_query(query: str, report_fetcher: AdsReportFetcher,
+                 customer_ids: List[int],
+                 batch_size: int) -> Iterator[pd.DataFrame]:
+    """Run a query and yield the parsed rows in dataframes of batch_size rows.
+
+    Pages of the Google Ads API response are parsed as they arrive, so only
+    a single batch of rows is held in memory at a time.
+    """
+    query_specification = query_editor.QuerySpecification(
+        text=query,
+        api_version=report_fetcher.api_client.api_version).generate()
+    column_names = query_specification.column_names
+    parser = parsers.GoogleAdsRowParser(query_specification)
+    rows = []
+    yielded_batch = False
+    for customer_id in customer_ids:
+        rate_limiter.acquire()
+        with limit_quota_errors():
+            response = report_fetcher.api_client.get_response(
+                entity_id=str(customer_id),
+                query_text=query_specification.query_text,
+                query_title=query_specification.query_title)
+            for page in response:
+                for row in page.results:
+                    rows.append(parser.parse_ads_row(row))
+                    if len(rows) == batch_size:
+                        yield pd.DataFrame(data=rows, columns=column_names)
+                        yielded_batch = True
+                        rows = []
+        rate_limiter.on_success()
+    if rows:
+        yield pd.DataFrame(data=rows, columns=column_names)
+    elif not yielded_batch:
+        # Infer the column types from a placeholder row, as GAARF does
+        placeholder = [
+            parser.parse_ads_row(report_fetcher.api_client.google_ads_row)
+        ]
+        yield pd.DataFrame(data=placeholder, columns=column_names).head(0)
+
+
+def fetch_sharded(
+        query: str,
+        report_fetcher: AdsReportFetcher,
+        customer_ids: List[int],
+        customer_ids_per_shard: Optional[int] = None,
+        max_workers: int = 1,
+        checkpoint: Optional[checkpoints.ReportCheckpoint] = None
+) -> GaarfReport:
+    """Fetch a query with the customer IDs split into shards.
+
+    The shards are fetched in parallel on a pool of max_workers threads, and
+    the partial reports are merged in the order of the customer IDs.
+
+    Args:
+        query: the GAQL query to run.
+        report_fetcher: the fetcher used to run the query.
+        customer_ids: the accounts to run the query for.
+        customer_ids_per_shard: the number of accounts per shard, or None to
+            fetch all accounts in a single shard.
+        max_workers: the maximum number of shards fetched at the same time.
+        checkpoint: saves each shard once it's fetched, and loads the shards
+            saved by an earlier run instead of fetching them again.
+
+    Returns:
+        A GAARF report with the results of all the shards.
+    """
+    shards = split_into_shards(customer_ids, customer_ids_per_shard)
+    if len(shards) == 1:
+        return fetch_shard(query, report_fetcher, shards[0], checkpoint)
+
+    logger.info('Fetching %d customer IDs in %d shards with %d workers',
+                len(customer_ids), len(shards), max_workers)
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers) as executor:
+        futures = [
+            telemetry.submit(executor, fetch_shard, query, report_fetcher,
+                             shard, checkpoint) for shard in shards
+        ]
+        reports = [future.result() for future in futures]
+    return merge_reports(reports)
+
+
+def split_into_shards(customer_ids: List[int],
+                      shard_size: Optional[int] = None) -> List[List[int]]:
+    """Split the customer IDs in lists of at most shard_size accounts."""
+    if not shard_size or len(customer_ids) <= shard_size:
+        return [customer_ids]
+    return [
+        customer_ids[i:i + shard_size]
+        for i in range(0, len(customer_ids), shard_size)
+    ]
+
+
+def fetch_shard(
+        query: str,
+        report_fetcher: AdsReportFetcher,
+        customer_ids: List[int],
+        checkpoint: Optional[checkpoints.ReportCheckpoint] = None
+) -> GaarfReport:
+    """Fetch a shard, or load it from the checkpoint if it was fetched."""
+    if checkpoint is None:
+        return fetch_with_retry(query, report_fetcher, customer_ids)
+    report = checkpoint.load_shard(query, customer_ids)
+    if report is None:
+        report = fetch_with_retry(query, report_fetcher, customer_ids)
+        checkpoint.save_shard(query, customer_ids, report)
+    return report
+
+
+def fetch_with_retry(query: str, report_fetcher: AdsReportFetcher,
+                     customer_ids: List[int]) -> GaarfReport:
+    """Fetch a query, retrying with exponential backoff on quota errors.
+
+    Each attempt waits for the tokens of its accounts from the rate limiter,
+    and its quota errors decrease the rate of all the fetches.
 
+    Raises:
+        The last error if the quota is still exhausted after
+        MAX_FETCH_RETRIES retries, or any error that is not a quota error.
+    """
+    for attempt in range(MAX_FETCH_RETRIES + 1):
+        throttled_seconds = rate_limiter.acquire(len(customer_ids))
+        try:
+            with telemetry.stage('fetch',
+                                 customer_ids=len(customer_ids),
+                                 first_customer_id=next(iter(customer_ids),
+                                                        None),
+                                 attempt=attempt,
+                                 throttled_seconds=round(throttled_seconds,
+                                                         3)) as record:
+                report = report_fetcher.fetch(query, customer_ids)
+                record.set_output(report)
+            rate_limiter.on_success(len(customer_ids))
+            return report
+        except Exception as err:  # pylint: disable=broad-except
+            if not is_quota_error(err):
+                raise
+            rate_limiter.on_quota_error()
+            if attempt == MAX_FETCH_RETRIES:
+                raise
+            delay = FETCH_RETRY_BASE_DELAY_SECONDS * 2**attempt
+            delay += random.uniform(0, FETCH_RETRY_BASE_DELAY_SECONDS)
+            logger.warning(
+                'Quota error fetching %d customer IDs, retrying in %.1fs',
+                len(customer_ids), delay)
+            time.sleep(delay)
+
+
+@contextlib.contextmanager
+def limit_quota_errors() -> Iterator[None]:
+    """Report the quota errors of the requests in the context to the limiter.
+
+    For the requests that are not retried by fetch_with_retry.
+    """
+    try:
+        yield
+    except Exception as err:
+        if is_quota_error(err):
+            rate_limiter.on_quota_error()
+        raise
 
-def get_google_ads_synthetic_data(table_name: str) -> GaarfReport:
+
+def is_quota_error(error: BaseException) -> bool:
+    """Check if an error, or an error it was raised from, is a quota error.
+
+    GAARF re-raises Google Ads API errors as GaarfExecutorException, so the
+    chain of exceptions is walked to find the original error.
+    """
+    while error is not None:
+        if isinstance(error, api_exceptions.ResourceExhausted):
+            return True
+        if isinstance(error, GoogleAdsException) and any(
+                ads_error.error_code.quota_error
+                for ads_error in error.failure.errors):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def merge_reports(reports: List[GaarfReport]) -> GaarfReport:
+    """Merge the reports of a query run for different customer IDs."""
+    results = list(
+        itertools.chain.from_iterable(report.results for report in reports))
+    return GaarfReport(
+        results=results,
+        column_names=reports[0].column_names,
+        results_placeholder=[] if results else reports[0].results_placeholder,
+        query_specification=reports[0].query_specification)
+
+
+def get_google_ads_synthetic_data(table_name: str) -> pd.DataFrame:
     """Read in the synthetic data based on the table name of the report."""
     logger.info('Fetching synthetic data for: %s', table_name)
     df = pd.read_csv(f'synthetic_data/{table_name}.csv')
@@ -236,4 +886,4 @@ def get_google_ads_synthetic_data(table_name: str) -> GaarfReport:
                                           num_rows_to_drop,
                                           replace=False)
         df = df.drop(random_indices)
-    return GaarfReport.from_pandas(df)
+    return df
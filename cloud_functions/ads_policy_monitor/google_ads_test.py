@@ -14,9 +14,11 @@
 """Unit tests for google_ads.py"""
 
 import random
+import tempfile
 import unittest
 from unittest.mock import MagicMock, patch
 
+import numpy as np
 import pandas as pd
 from pandas.testing import assert_frame_equal
 
@@ -27,17 +29,31 @@ from test_data_helper import TEST_EXPECTED_ASSET_POLICY_REPORT
 from test_data_helper import TEST_CUSTOMER_ASSET_POLICY_DATA_EMPTY
 from test_data_helper import TEST_EXPECTED_ASSET_POLICY_REPORT_EMPTY_CUSTOMER
 from test_data_helper import TEST_EXPECTED_TIME_SERIES
+from gaarf import api_clients
+from gaarf.exceptions import GaarfExecutorException
 from gaarf.report import GaarfReport
+from google.api_core import exceptions as api_exceptions
 
+import checkpoints
 import google_ads
 import models
 
 
+def expected_assets_report(data: dict) -> pd.DataFrame:
+    """Build the expected combined assets report with its categories."""
+    return pd.DataFrame(data).astype({
+        column: 'category'
+        for column in google_ads.CATEGORICAL_ASSET_POLICY_COLUMNS
+    })
+
+
 class GoogleAdsTestCase(unittest.TestCase):
 
     def setUp(self) -> None:
         self.mock_payload = MagicMock()
         self.mock_payload.use_synthetic_data = False
+        self.mock_payload.policy_topics_as_arrays = False
+        self.mock_payload.synthetic_num_rows = None
         self.mock_report_fetcher = MagicMock()
         self.ocid_report_config = models.ReportConfig(
             table_name='Ocid',
@@ -68,6 +84,21 @@ class GoogleAdsTestCase(unittest.TestCase):
                                     self.mock_report_fetcher)
         mock_get_google_ads_synthetic_data.assert_called_with(table_name='Ocid')
 
+    @patch('google_ads.utils.get_current_date', return_value='2024-01-01')
+    def test_run_gaarf_report_generates_synthetic_data(self, _):
+        self.mock_payload.use_synthetic_data = True
+        self.mock_payload.synthetic_num_rows = 1000
+        self.mock_payload.synthetic_num_customers = 5
+        self.mock_payload.synthetic_seed = 1
+
+        report = google_ads.run_gaarf_report(self.mock_payload,
+                                             self.ad_policy_data_config,
+                                             self.mock_report_fetcher)
+
+        self.assertEqual(len(report), 1000)
+        self.assertEqual(report['customer_id'].nunique(), 5)
+        self.mock_report_fetcher.fetch.assert_not_called()
+
     @patch('google_ads.run_query_from_file')
     def test_run_gaarf_report_with_ad_policy_data(self,
                                                   mock_run_query_from_file):
@@ -76,25 +107,147 @@ class GoogleAdsTestCase(unittest.TestCase):
                                     self.mock_report_fetcher)
         mock_run_query_from_file.assert_called_once()
 
+    @patch('google_ads.run_query_from_file')
+    def test_run_gaarf_report_with_asset_policy_data(self,
+                                                     mock_run_query_from_file):
+        asset_reports = {
+            'gaql/ad_group_asset.sql':
+                GaarfReport.from_pandas(
+                    pd.DataFrame(TEST_AD_GROUP_ASSET_POLICY_DATA)),
+            'gaql/campaign_asset.sql':
+                GaarfReport.from_pandas(
+                    pd.DataFrame(TEST_CAMPAIGN_ASSET_POLICY_DATA)),
+            'gaql/customer_asset.sql':
+                GaarfReport.from_pandas(
+                    pd.DataFrame(TEST_CUSTOMER_ASSET_POLICY_DATA)),
+        }
+        mock_run_query_from_file.side_effect = (
+            lambda query_path, **kwargs: asset_reports[query_path])
+        asset_policy_data_config = models.ReportConfig(
+            table_name='AssetPolicyData',
+            write_disposition='WRITE_APPEND',
+            is_asset_report=True,
+            gaql_filenames=[
+                'ad_group_asset.sql', 'campaign_asset.sql', 'customer_asset.sql'
+            ])
+
+        report = google_ads.run_gaarf_report(self.mock_payload,
+                                             asset_policy_data_config,
+                                             self.mock_report_fetcher)
+
+        self.assertEqual(mock_run_query_from_file.call_count, 3)
+        for call in mock_run_query_from_file.call_args_list:
+            self.assertEqual(call.kwargs['report_fetcher'],
+                             self.mock_report_fetcher)
+        expected_results = expected_assets_report(
+            TEST_EXPECTED_ASSET_POLICY_REPORT)
+        assert_frame_equal(report, expected_results)
+
+    @patch('google_ads.run_query_from_file')
+    def test_run_gaarf_report_with_asset_policy_topics_as_arrays(
+            self, mock_run_query_from_file):
+        asset_reports = {
+            'gaql/ad_group_asset.sql':
+                GaarfReport.from_pandas(
+                    pd.DataFrame(TEST_AD_GROUP_ASSET_POLICY_DATA)),
+            'gaql/campaign_asset.sql':
+                GaarfReport.from_pandas(
+                    pd.DataFrame(TEST_CAMPAIGN_ASSET_POLICY_DATA)),
+            'gaql/customer_asset.sql':
+                GaarfReport.from_pandas(
+                    pd.DataFrame(TEST_CUSTOMER_ASSET_POLICY_DATA)),
+        }
+        mock_run_query_from_file.side_effect = (
+            lambda query_path, **kwargs: asset_reports[query_path])
+        self.mock_payload.policy_topics_as_arrays = True
+        asset_policy_data_config = models.ReportConfig(
+            table_name='AssetPolicyData',
+            write_disposition='WRITE_APPEND',
+            is_asset_report=True,
+            gaql_filenames=[
+                'ad_group_asset.sql', 'campaign_asset.sql', 'customer_asset.sql'
+            ])
+
+        report = google_ads.run_gaarf_report(self.mock_payload,
+                                             asset_policy_data_config,
+                                             self.mock_report_fetcher)
+
+        expected_results = expected_assets_report(
+            TEST_EXPECTED_ASSET_POLICY_REPORT)
+        expected_topics = [
+            topics.split(' | ') for topics in expected_results[
+                google_ads.ASSET_POLICY_TOPICS_COLUMN]
+        ]
+        self.assertNotIn(google_ads.ASSET_POLICY_TOPICS_COLUMN, report)
+        self.assertEqual(report['asset_policy_topics'].tolist(),
+                         expected_topics)
+        assert_frame_equal(
+            report.drop(columns='asset_policy_topics'),
+            expected_results.drop(
+                columns=google_ads.ASSET_POLICY_TOPICS_COLUMN))
+
+    def test_policy_topics_to_arrays(self):
+        report_df = pd.DataFrame({
+            'ad_group_ad_ad_id': [1, 2, 3, 4],
+            'ad_group_ad_policy_summary_policy_topic_entries': [[
+                'TRADEMARKS', 'TOBACCO'
+            ], 'TRADEMARKS|TOBACCO', '', np.nan],
+        })
+
+        results = google_ads.policy_topics_to_arrays(report_df)
+
+        self.assertEqual(list(results.columns),
+                         ['ad_group_ad_ad_id', 'ad_policy_topics'])
+        self.assertEqual(results['ad_policy_topics'].tolist(), [
+            ['TRADEMARKS', 'TOBACCO'],
+            ['TRADEMARKS', 'TOBACCO'],
+            [],
+            [],
+        ])
+
     def test_get_google_ads_synthetic_data_ocid(self):
         report = google_ads.get_google_ads_synthetic_data('Ocid')
-        self.assertTrue(len(report.column_names), 2)
-        self.assertEqual(report.column_names, ['account_id', 'ocid'])
-        self.assertTrue(len(report.results), 3)
+        self.assertEqual(list(report.columns), ['account_id', 'ocid'])
+        self.assertTrue(len(report), 3)
 
     @patch('google_ads.utils')
     def test_get_google_ads_synthetic_data_ad_policy_data(self, mock_utils):
         mock_utils.get_current_date.return_value = '2024-01-01'
         random.seed(1)
         report = google_ads.get_google_ads_synthetic_data('AdPolicyData')
-        self.assertTrue(len(report.column_names), 17)
-        self.assertEqual(report.results[0][0], '2024-01-01')
-        self.assertTrue(len(report.results), 998)
+        self.assertTrue(len(report.columns), 17)
+        self.assertEqual(report.iloc[0, 0], '2024-01-01')
+        self.assertTrue(len(report), 998)
 
     def test_get_google_ads_synthetic_data_missing(self):
         with self.assertRaises(FileNotFoundError):
             google_ads.get_google_ads_synthetic_data('MissingData')
 
+    @patch('google_ads.create_ads_client')
+    def test_get_ads_client_reuses_clients(self, mock_create_ads_client):
+        google_ads.ads_client_pool.clear()
+        payloads = [
+            models.Payload(project_id='my_project',
+                           bq_output_dataset='my_dataset',
+                           region='europe-west2',
+                           google_ads_login_customer_id=login_customer_id,
+                           customer_ids=[1])
+            for login_customer_id in [123, 123, 456]
+        ]
+
+        clients = [google_ads.get_ads_client(payload) for payload in payloads]
+
+        self.assertEqual(mock_create_ads_client.call_count, 2)
+        mock_create_ads_client.assert_called_with(456)
+        self.assertIs(clients[0], clients[1])
+
+    @patch('google_ads.utils.get_current_date', return_value='2024-01-01')
+    def test_read_query(self, _):
+        query = google_ads.read_query('gaql/ad_policy_data.sql')
+
+        self.assertIn('"2024-01-01" AS event_date', query)
+        self.assertNotIn(google_ads.TODAY_PLACEHOLDER, query)
+
     def test_combine_assets_reports(self):
         adgroup_gaarf_report = GaarfReport.from_pandas(
             pd.DataFrame(TEST_AD_GROUP_ASSET_POLICY_DATA))
@@ -107,9 +260,9 @@ class GoogleAdsTestCase(unittest.TestCase):
             adgroup_gaarf_report, campaign_gaarf_report, customer_gaarf_report
         ])
 
-        results = report.to_pandas()
-        expected_results = pd.DataFrame(TEST_EXPECTED_ASSET_POLICY_REPORT)
-        assert_frame_equal(results, expected_results)
+        expected_results = expected_assets_report(
+            TEST_EXPECTED_ASSET_POLICY_REPORT)
+        assert_frame_equal(report, expected_results)
 
     def test_combine_assets_reports_empty_customer(self):
         adgroup_gaarf_report = GaarfReport.from_pandas(
@@ -123,10 +276,9 @@ class GoogleAdsTestCase(unittest.TestCase):
             adgroup_gaarf_report, campaign_gaarf_report, customer_gaarf_report
         ])
 
-        results = report.to_pandas()
-        expected_results = pd.DataFrame(
+        expected_results = expected_assets_report(
             TEST_EXPECTED_ASSET_POLICY_REPORT_EMPTY_CUSTOMER)
-        assert_frame_equal(results, expected_results)
+        assert_frame_equal(report, expected_results)
 
     def test_combine_assets_reports_empty(self):
         adgroup_gaarf_report = GaarfReport.from_pandas(pd.DataFrame())
@@ -137,22 +289,210 @@ class GoogleAdsTestCase(unittest.TestCase):
             adgroup_gaarf_report, campaign_gaarf_report, customer_gaarf_report
         ])
 
-        results = report.to_pandas()
-        expected_results = GaarfReport.from_pandas(pd.DataFrame()).to_pandas()
-        assert_frame_equal(results, expected_results)
+        assert_frame_equal(report, pd.DataFrame())
+
+    @patch('google_ads.parsers.GoogleAdsRowParser')
+    def test_stream_query_yields_fixed_size_batches(self, mock_parser_class):
+        mock_parser_class.return_value.parse_ads_row.side_effect = (
+            lambda row: [row, '2024-01-01'])
+        self.mock_report_fetcher.api_client.api_version = (
+            api_clients.GOOGLE_ADS_API_VERSION)
+        self.mock_report_fetcher.api_client.get_response.side_effect = (
+            lambda entity_id, **kwargs: [
+                MagicMock(results=[int(entity_id),
+                                   int(entity_id) + 1]),
+                MagicMock(results=[int(entity_id) + 2]),
+            ])
+
+        batches = list(
+            google_ads.stream_query(
+                'SELECT customer.id, "2024-01-01" AS event_date '
+                'FROM customer', self.mock_report_fetcher, [10, 20], 2))
+
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 2])
+        self.assertEqual(list(batches[0].columns),
+                         ['customer_id', 'event_date'])
+        self.assertEqual(
+            pd.concat(batches)['customer_id'].tolist(),
+            [10, 11, 12, 20, 21, 22])
+
+    @patch('google_ads.parsers.GoogleAdsRowParser')
+    def test_stream_query_without_results(self, mock_parser_class):
+        mock_parser_class.return_value.parse_ads_row.return_value = [0]
+        self.mock_report_fetcher.api_client.api_version = (
+            api_clients.GOOGLE_ADS_API_VERSION)
+        self.mock_report_fetcher.api_client.get_response.return_value = []
+
+        batches = list(
+            google_ads.stream_query('SELECT customer.id FROM customer',
+                                    self.mock_report_fetcher, [10], 2))
+
+        self.assertEqual(len(batches), 1)
+        self.assertTrue(batches[0].empty)
+        self.assertEqual(list(batches[0].columns), ['customer_id'])
+
+    def test_combine_time_series(self):
+        mock_report_config = MagicMock()
+        mock_report_config.time_series_variable_column = 'asset_policy_summary_approval_status'
+        batches = [
+            pd.DataFrame(TEST_CAMPAIGN_ASSET_POLICY_DATA).iloc[:2],
+            pd.DataFrame(TEST_CAMPAIGN_ASSET_POLICY_DATA).iloc[2:],
+        ]
+
+        timeseries = google_ads.combine_time_series([
+            google_ads.extract_time_series(batch, mock_report_config)
+            for batch in batches
+        ], mock_report_config)
+
+        expected_results = pd.DataFrame(TEST_EXPECTED_TIME_SERIES)
+        assert_frame_equal(timeseries, expected_results)
+
+    def test_join_policy_topics(self):
+        rows = [[1, 'TRADEMARKS'], [2, ['TRADEMARKS', 'TOBACCO']], [3, []]]
+
+        results = google_ads.join_policy_topics(
+            google_ads.policy_topics_array(rows, 1))
+
+        self.assertEqual(results.to_pylist(),
+                         ['TRADEMARKS', 'TRADEMARKS | TOBACCO', ''])
+
+    def test_join_policy_topics_lists(self):
+        rows = [[['TRADEMARKS', 'TOBACCO']], [[]], [None]]
+
+        results = google_ads.join_policy_topics(
+            google_ads.policy_topics_array(rows, 0))
+
+        self.assertEqual(results.to_pylist(), ['TRADEMARKS | TOBACCO', '', ''])
+
+    def test_combine_assets_reports_keeps_topic_arrays(self):
+        rows = [
+            [
+                '2024-01-01', 1, 'Account', 10, 'ADVERTISER', 'TEXT',
+                'REVIEWED', ['A|B'], 'DISAPPROVED'
+            ],
+            [
+                '2024-01-01', 1, 'Account', 10, 'ADVERTISER', 'TEXT',
+                'REVIEWED', ['A', 'B'], 'DISAPPROVED'
+            ],
+            [
+                '2024-01-01', 1, 'Account', 10, 'ADVERTISER', 'TEXT',
+                'REVIEWED', ['A|B'], 'DISAPPROVED'
+            ],
+        ]
+        report = GaarfReport(results=rows,
+                             column_names=[
+                                 'event_date', 'customer_id',
+                                 'customer_descriptive_name', 'asset_id',
+                                 'asset_source', 'asset_type',
+                                 'asset_policy_summary_review_status',
+                                 google_ads.ASSET_POLICY_TOPICS_COLUMN,
+                                 'asset_policy_summary_approval_status'
+                             ])
+
+        combined_df = google_ads.combine_assets_reports(
+            [report], policy_topics_as_arrays=True)
+
+        self.assertNotIn(google_ads.ASSET_POLICY_TOPICS_COLUMN, combined_df)
+        self.assertEqual(combined_df['asset_policy_topics'].tolist(),
+                         [['A|B'], ['A', 'B']])
+        self.assertEqual(combined_df['counts'].tolist(), [2, 1])
 
     def test_extract_time_series(self):
         mock_report_config = MagicMock()
         mock_report_config.time_series_variable_column = 'asset_policy_summary_approval_status'
-        assets_report = GaarfReport.from_pandas(
-            pd.DataFrame(TEST_CAMPAIGN_ASSET_POLICY_DATA))
+        assets_report = pd.DataFrame(TEST_CAMPAIGN_ASSET_POLICY_DATA)
 
         timeseries = google_ads.extract_time_series(assets_report,
                                                     mock_report_config)
 
-        results = timeseries.to_pandas()
         expected_results = pd.DataFrame(TEST_EXPECTED_TIME_SERIES)
-        assert_frame_equal(results, expected_results)
+        assert_frame_equal(timeseries, expected_results)
+
+    def test_fetch_sharded_merges_shards_in_order(self):
+        self.mock_report_fetcher.fetch.side_effect = (
+            lambda query, customer_ids: GaarfReport(
+                results=[[customer_id] for customer_id in customer_ids],
+                column_names=['customer_id']))
+
+        report = google_ads.fetch_sharded('SELECT customer.id FROM customer',
+                                          self.mock_report_fetcher,
+                                          customer_ids=[1, 2, 3, 4, 5],
+                                          customer_ids_per_shard=2,
+                                          max_workers=3)
+
+        self.assertEqual(self.mock_report_fetcher.fetch.call_count, 3)
+        self.assertEqual(report.column_names, ['customer_id'])
+        self.assertEqual(report.results, [[1], [2], [3], [4], [5]])
+
+    def test_fetch_sharded_resumes_from_checkpoint(self):
+        self.mock_report_fetcher.fetch.side_effect = (
+            lambda query, customer_ids: GaarfReport(
+                results=[[customer_id] for customer_id in customer_ids],
+                column_names=['customer_id']))
+        with tempfile.TemporaryDirectory() as directory:
+            store = checkpoints.LocalCheckpointStore(directory)
+            checkpoints.ReportCheckpoint(store, 'Ocid').save_shard(
+                'query', [1, 2],
+                GaarfReport(results=[[1], [2]], column_names=['customer_id']))
+
+            report = google_ads.fetch_sharded(
+                'query',
+                self.mock_report_fetcher,
+                customer_ids=[1, 2, 3],
+                customer_ids_per_shard=2,
+                checkpoint=checkpoints.ReportCheckpoint(store, 'Ocid'))
+            rerun_report = google_ads.fetch_sharded(
+                'query',
+                self.mock_report_fetcher,
+                customer_ids=[1, 2, 3],
+                customer_ids_per_shard=2,
+                checkpoint=checkpoints.ReportCheckpoint(store, 'Ocid'))
+
+        self.mock_report_fetcher.fetch.assert_called_once_with('query', [3])
+        self.assertEqual(report.results, [[1], [2], [3]])
+        self.assertEqual(rerun_report.results, [[1], [2], [3]])
+
+    def test_split_into_shards(self):
+        self.assertEqual(google_ads.split_into_shards([1, 2, 3], None),
+                         [[1, 2, 3]])
+        self.assertEqual(google_ads.split_into_shards([1, 2, 3], 2),
+                         [[1, 2], [3]])
+
+    @patch('google_ads.rate_limiter')
+    @patch('google_ads.time.sleep')
+    def test_fetch_with_retry_on_quota_error(self, mock_sleep,
+                                             mock_rate_limiter):
+        mock_rate_limiter.acquire.return_value = 0.0
+        expected_report = GaarfReport(results=[[1]], column_names=['id'])
+        try:
+            raise api_exceptions.ResourceExhausted('Quota exceeded')
+        except api_exceptions.ResourceExhausted:
+            try:
+                raise GaarfExecutorException()
+            except GaarfExecutorException as err:
+                quota_error = err
+        self.mock_report_fetcher.fetch.side_effect = [
+            quota_error, quota_error, expected_report
+        ]
+
+        report = google_ads.fetch_with_retry('query', self.mock_report_fetcher,
+                                             [1])
+
+        self.assertEqual(report, expected_report)
+        self.assertEqual(mock_sleep.call_count, 2)
+        self.assertEqual(mock_rate_limiter.acquire.call_count, 3)
+        self.assertEqual(mock_rate_limiter.on_quota_error.call_count, 2)
+        mock_rate_limiter.on_success.assert_called_once_with(1)
+
+    @patch('google_ads.time.sleep')
+    def test_fetch_with_retry_raises_other_errors(self, mock_sleep):
+        self.mock_report_fetcher.fetch.side_effect = ValueError('Bad query')
+
+        with self.assertRaises(ValueError):
+            google_ads.fetch_with_retry('query', self.mock_report_fetcher, [1])
+
+        self.assertEqual(self.mock_report_fetcher.fetch.call_count, 1)
+        mock_sleep.assert_not_called()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,257 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Incremental snapshots: only write the rows that changed since the last run.
+
+Each row of a report is identified by its key columns, and hashed on its policy
+columns. The keys & hashes of the previous run are kept in a state store, and
+compared with the current report to find the new, changed & resolved rows.
+"""
+import abc
+import logging
+import os
+import sys
+from typing import Optional, Tuple
+
+from google.api_core import exceptions
+import numpy as np
+import pandas as pd
+
+import bigquery
+import models
+import utils
+
+logging.basicConfig(stream=sys.stdout)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+CHANGE_TYPE_COLUMN = 'change_type'
+ROW_HASH_COLUMN = 'row_hash'
+NEW = 'NEW'
+CHANGED = 'CHANGED'
+RESOLVED = 'RESOLVED'
+
+
+class StateStore(abc.ABC):
+    """Keeps the keys & row hashes of the last run of each report."""
+
+    @abc.abstractmethod
+    def load(self, name: str) -> Optional[pd.DataFrame]:
+        """Load the state, or None if there is no state yet."""
+
+    @abc.abstractmethod
+    def save(self, name: str, state_df: pd.DataFrame) -> None:
+        """Replace the state with state_df."""
+
+
+class LocalStateStore(StateStore):
+    """A state store of CSV files in a local directory."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def load(self, name: str) -> Optional[pd.DataFrame]:
+        path = self._get_path(name)
+        if not os.path.exists(path):
+            return None
+        return pd.read_csv(path)
+
+    def save(self, name: str, state_df: pd.DataFrame) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._get_path(name)
+        # Write to a temporary file first, so a failed run keeps the old state
+        state_df.to_csv(f'{path}.tmp', index=False)
+        os.replace(f'{path}.tmp', path)
+
+    def _get_path(self, name: str) -> str:
+        return os.path.join(self.directory, f'{name}.csv')
+
+
+class BigQueryStateStore(StateStore):
+    """A state store of tables in the output dataset."""
+
+    def __init__(self,
+                 payload: models.Payload,
+                 bq_writer: bigquery.DataFrameBigQueryWriter = None):
+        if bq_writer is None:
+            bq_writer = bigquery.DataFrameBigQueryWriter(
+                project=payload.project_id,
+                dataset=payload.bq_output_dataset,
+                location=payload.region,
+                write_disposition='WRITE_TRUNCATE')
+        self.bq_writer = bq_writer
+
+    def load(self, name: str) -> Optional[pd.DataFrame]:
+        self.bq_writer._init_client()  # pylint: disable=protected-access
+        query = f'SELECT * FROM `{self.bq_writer.dataset_id}.{name}`'
+        try:
+            rows = self.bq_writer.client.query(query).result()
+        except exceptions.NotFound:
+            return None
+        return pd.DataFrame.from_records(
+            [row.values() for row in rows],
+            columns=[field.name for field in rows.schema])
+
+    def save(self, name: str, state_df: pd.DataFrame) -> None:
+        self.bq_writer.write_dataframe(state_df, destination=name)
+
+
+def is_incremental(payload: models.Payload,
+                   report_config: models.ReportConfig) -> bool:
+    """Whether to write the changes of the report instead of a snapshot."""
+    return bool(payload.incremental_snapshots and
+                report_config.incremental_table_name)
+
+
+def get_state_store(payload: models.Payload) -> StateStore:
+    """Get the state store configured in the payload.
+
+    Runs with a local_output_path keep their state next to their tables, so
+    they don't read or write BigQuery, unless incremental_state_path is set.
+    """
+    if payload.incremental_state_path:
+        return LocalStateStore(payload.incremental_state_path)
+    if payload.local_output_path:
+        return LocalStateStore(payload.local_output_path)
+    return BigQueryStateStore(payload)
+
+
+def get_state_name(report_config: models.ReportConfig) -> str:
+    """Get the name the state of a report is stored under."""
+    return f'{report_config.table_name}State'
+
+
+def write_changes(payload: models.Payload,
+                  report_df: pd.DataFrame,
+                  report_config: models.ReportConfig,
+                  write_batch: bigquery.WriteBatch,
+                  state_store: StateStore = None) -> int:
+    """Add the changes since the last run of the report to the writes.
+
+    The state is only saved once the writes are committed, so a failed run is
+    compared with the same state when it is run again.
+
+    Args:
+        payload: the configuration used in this execution.
+        report_df: the full snapshot of the report.
+        report_config: the config of the report to run.
+        write_batch: the writes of the report.
+        state_store: for dependency injection, provide a state store.
+
+    Returns:
+        The number of changes.
+    """
+    if state_store is None:
+        state_store = get_state_store(payload)
+    state_name = get_state_name(report_config)
+
+    changes_df, state_df = compute_changes(report_df,
+                                           state_store.load(state_name),
+                                           report_config)
+    logger.info('Found %d changes in %d rows of %s', len(changes_df),
+                len(report_df), report_config.table_name)
+    if not changes_df.empty:
+        # Reruns find no changes, replacing the partition would delete them
+        write_batch.add(changes_df,
+                        report_config,
+                        report_config.incremental_table_name,
+                        write_disposition='WRITE_APPEND')
+    write_batch.on_commit(lambda: state_store.save(state_name, state_df))
+    return len(changes_df)
+
+
+def compute_changes(
+        report_df: pd.DataFrame, previous_state_df: Optional[pd.DataFrame],
+        report_config: models.ReportConfig
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Compare a report with the state of the previous run.
+
+    Args:
+        report_df: the full snapshot of the report.
+        previous_state_df: the keys & row hashes of the previous run, or None
+            on the first run.
+        report_config: the config of the report, with the key & hash columns.
+
+    Returns:
+        The changes, which are the new & changed rows of the report followed
+        by the keys of the resolved rows, and the state of this run.
+    """
+    key_columns = report_config.incremental_key_columns
+    hash_columns = report_config.incremental_hash_columns
+    if report_df.empty:
+        # An empty asset report has no columns
+        report_df = report_df.reindex(columns=list(
+            dict.fromkeys([*report_df, *key_columns, *hash_columns])))
+
+    num_rows = len(report_df)
+    report_df = report_df.drop_duplicates(subset=key_columns)
+    if len(report_df) < num_rows:
+        logger.warning('Dropped %d rows with duplicate keys from %s',
+                       num_rows - len(report_df), report_config.table_name)
+
+    row_hashes = hash_rows(report_df, hash_columns)
+    state_df = _to_plain_dtypes(
+        report_df[key_columns]).assign(**{ROW_HASH_COLUMN: row_hashes})
+    if previous_state_df is None:
+        previous_state_df = state_df.head(0)
+
+    current_keys = pd.MultiIndex.from_frame(state_df[key_columns])
+    previous_keys = pd.MultiIndex.from_frame(previous_state_df[key_columns])
+    previous_hashes = pd.Series(
+        previous_state_df[ROW_HASH_COLUMN].to_numpy(),
+        index=previous_keys).astype('Int64').reindex(current_keys)
+    is_new = previous_hashes.isna().to_numpy()
+    is_changed = ~is_new & (previous_hashes.fillna(0).to_numpy(dtype='int64')
+                            != row_hashes.to_numpy())
+
+    changed_mask = is_new | is_changed
+    changed_df = report_df[changed_mask].assign(
+        **{
+            CHANGE_TYPE_COLUMN: np.where(is_new[changed_mask], NEW, CHANGED),
+            ROW_HASH_COLUMN: row_hashes[changed_mask],
+        })
+    resolved_df = previous_state_df[~previous_keys.isin(current_keys)].assign(
+        event_date=utils.get_current_date(), **{CHANGE_TYPE_COLUMN: RESOLVED})
+    if resolved_df.empty:
+        return changed_df.reset_index(drop=True), state_df
+
+    changes_df = pd.concat([changed_df, resolved_df], ignore_index=True)
+    # The resolved rows only have keys, keep the other integers as integers
+    integer_columns = {
+        column: 'Int64'
+        for column, dtype in report_df.dtypes.items()
+        if dtype.kind in 'iu'
+    }
+    return changes_df.astype(integer_columns)[changed_df.columns], state_df
+
+
+def hash_rows(report_df: pd.DataFrame, hash_columns: list) -> pd.Series:
+    """Hash the policy columns of each row to a signed 64-bit integer.
+
+    Columns that are not in the report are skipped, as the policy topics are
+    either a string or an array column.
+    """
+    hash_columns = [column for column in hash_columns if column in report_df]
+    hash_df = bigquery.format_arrays(report_df[hash_columns], '|')
+    hashes = pd.util.hash_pandas_object(hash_df, index=False)
+    # BigQuery doesn't have unsigned integers
+    return pd.Series(hashes.to_numpy().view('int64'), index=report_df.index)
+
+
+def _to_plain_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """Convert categorical columns to the dtype of their categories."""
+    return df.astype({
+        column: dtype.categories.dtype
+        for column, dtype in df.dtypes.items()
+        if isinstance(dtype, pd.CategoricalDtype)
+    })
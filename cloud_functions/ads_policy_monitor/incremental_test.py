@@ -0,0 +1,149 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for incremental.py"""
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import pandas as pd
+
+import bigquery
+import incremental
+import models
+
+REPORT_CONFIG = models.ReportConfig(
+    table_name='AdPolicyData',
+    write_disposition='WRITE_APPEND',
+    incremental_table_name='AdPolicyDataChanges',
+    incremental_key_columns=['customer_id', 'ad_group_ad_ad_id'],
+    incremental_hash_columns=['approval_status', 'topics'])
+
+
+def policy_report(rows):
+    return pd.DataFrame(rows,
+                        columns=[
+                            'event_date', 'customer_id', 'ad_group_ad_ad_id',
+                            'approval_status', 'topics', 'impressions'
+                        ])
+
+
+class IncrementalTestCase(unittest.TestCase):
+
+    def test_compute_changes_first_run(self):
+        report_df = policy_report([
+            ['2024-01-01', 1, 11, 'DISAPPROVED', ['TRADEMARKS'], 5],
+            ['2024-01-01', 1, 12, 'APPROVED_LIMITED', ['ALCOHOL'], 7],
+        ])
+
+        changes_df, state_df = incremental.compute_changes(
+            report_df, None, REPORT_CONFIG)
+
+        self.assertEqual(changes_df['change_type'].tolist(), ['NEW', 'NEW'])
+        self.assertEqual(state_df.columns.tolist(),
+                         ['customer_id', 'ad_group_ad_ad_id', 'row_hash'])
+        self.assertEqual(state_df['row_hash'].tolist(),
+                         changes_df['row_hash'].tolist())
+
+    @patch('incremental.utils.get_current_date', return_value='2024-01-02')
+    def test_compute_changes_against_previous_state(self, _):
+        _, previous_state_df = incremental.compute_changes(
+            policy_report([
+                ['2024-01-01', 1, 11, 'DISAPPROVED', ['TRADEMARKS'], 5],
+                ['2024-01-01', 1, 12, 'APPROVED_LIMITED', ['ALCOHOL'], 7],
+                ['2024-01-01', 2, 21, 'DISAPPROVED', ['MALWARE'], 0],
+            ]), None, REPORT_CONFIG)
+        report_df = policy_report([
+            # Only the impressions changed
+            ['2024-01-02', 1, 11, 'DISAPPROVED', ['TRADEMARKS'], 9],
+            ['2024-01-02', 1, 12, 'DISAPPROVED', ['ALCOHOL'], 7],
+            ['2024-01-02', 2, 22, 'DISAPPROVED', ['MALWARE'], 0],
+        ])
+
+        changes_df, state_df = incremental.compute_changes(
+            report_df, previous_state_df, REPORT_CONFIG)
+
+        self.assertEqual(
+            changes_df[[
+                'event_date', 'customer_id', 'ad_group_ad_ad_id', 'change_type'
+            ]].values.tolist(), [
+                ['2024-01-02', 1, 12, 'CHANGED'],
+                ['2024-01-02', 2, 22, 'NEW'],
+                ['2024-01-02', 2, 21, 'RESOLVED'],
+            ])
+        self.assertEqual(changes_df['impressions'].dtype, 'Int64')
+        self.assertTrue(pd.isna(changes_df['impressions'][2]))
+        self.assertEqual(state_df['ad_group_ad_ad_id'].tolist(), [11, 12, 22])
+
+    def test_compute_changes_empty_report(self):
+        _, previous_state_df = incremental.compute_changes(
+            policy_report([
+                ['2024-01-01', 1, 11, 'DISAPPROVED', ['TRADEMARKS'], 5],
+            ]), None, REPORT_CONFIG)
+
+        changes_df, state_df = incremental.compute_changes(
+            pd.DataFrame(), previous_state_df, REPORT_CONFIG)
+
+        self.assertEqual(changes_df['change_type'].tolist(), ['RESOLVED'])
+        self.assertTrue(state_df.empty)
+
+    def test_write_changes_saves_state_on_commit(self):
+        report_df = policy_report([
+            ['2024-01-01', 1, 11, 'DISAPPROVED', ['TRADEMARKS'], 5],
+        ])
+        with tempfile.TemporaryDirectory() as directory:
+            payload = models.Payload(project_id='my_project',
+                                     bq_output_dataset='my_dataset',
+                                     region='europe-west2',
+                                     google_ads_login_customer_id=123,
+                                     customer_ids=[1],
+                                     local_output_path=directory)
+            state_store = incremental.LocalStateStore(directory)
+            num_changes = []
+            for _ in range(2):
+                write_batch = bigquery.WriteBatch(payload)
+                num_changes.append(
+                    incremental.write_changes(payload, report_df, REPORT_CONFIG,
+                                              write_batch, state_store))
+                write_batch.commit()
+
+            changes_df = bigquery.read_local_table(directory,
+                                                   'AdPolicyDataChanges')
+
+        self.assertEqual(num_changes, [1, 0])
+        self.assertEqual(changes_df['change_type'].tolist(), ['NEW'])
+
+    def test_get_state_store(self):
+        payload = models.Payload(project_id='my_project',
+                                 bq_output_dataset='my_dataset',
+                                 region='europe-west2',
+                                 google_ads_login_customer_id=123,
+                                 customer_ids=[1])
+
+        self.assertIsInstance(incremental.get_state_store(payload),
+                              incremental.BigQueryStateStore)
+        local_store = incremental.get_state_store(
+            payload.model_copy(update={'local_output_path': '/tmp/output'}))
+        self.assertIsInstance(local_store, incremental.LocalStateStore)
+        self.assertEqual(local_store.directory, '/tmp/output')
+        state_store = incremental.get_state_store(
+            payload.model_copy(
+                update={
+                    'local_output_path': '/tmp/output',
+                    'incremental_state_path': '/tmp/state',
+                }))
+        self.assertEqual(state_store.directory, '/tmp/state')
+
+
+if __name__ == '__main__':
+    unittest.main()
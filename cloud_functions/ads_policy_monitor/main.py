@@ -19,19 +19,33 @@ extracting data from the Google Ads API via GAQL.
 It pulls data from Google Ads & outputs it to BigQuery.
 """
 import argparse
+import collections
+import concurrent.futures
 import json
 import logging
 import sys
+from typing import Dict, Iterable, List, Optional
 
 import flask
 import functions_framework
 import jsonschema
 
-import bigquery
-import google_ads
 import models
+import rate_limit
+import telemetry
 import utils
 
+# Imported on first use, so invalid requests don't pay for GAARF, pandas and
+# the Google Ads API protos at cold start
+accounts = utils.LazyModule('accounts')
+bigquery = utils.LazyModule('bigquery')
+change_detection = utils.LazyModule('change_detection')
+checkpoints = utils.LazyModule('checkpoints')
+fanout = utils.LazyModule('fanout')
+google_ads = utils.LazyModule('google_ads')
+incremental = utils.LazyModule('incremental')
+rollups = utils.LazyModule('rollups')
+
 logging.basicConfig(stream=sys.stdout)
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -63,8 +77,110 @@ request_schema = {
         'customer_ids': {
             'type': 'array'
         },
+        'discover_customer_ids': {
+            'type': 'boolean',
+        },
         'use_synthetic_data': {
             'type': 'boolean',
+        },
+        'max_concurrent_reports': {
+            'type': 'integer',
+            'minimum': 1,
+        },
+        'customer_ids_per_shard': {
+            'type': 'integer',
+            'minimum': 1,
+        },
+        'max_fetch_workers': {
+            'type': 'integer',
+            'minimum': 1,
+        },
+        'stream_batch_size': {
+            'type': 'integer',
+            'minimum': 1,
+        },
+        'incremental_snapshots': {
+            'type': 'boolean',
+        },
+        'incremental_state_path': {
+            'type': 'string',
+        },
+        'bq_load_format': {
+            'type': 'string',
+            'enum': ['CSV', 'PARQUET'],
+        },
+        'local_output_path': {
+            'type': 'string',
+        },
+        'max_concurrent_writes': {
+            'type': 'integer',
+            'minimum': 1,
+        },
+        'materialize_views': {
+            'type': 'boolean',
+        },
+        'synthetic_num_rows': {
+            'type': 'integer',
+            'minimum': 1,
+        },
+        'synthetic_num_customers': {
+            'type': 'integer',
+            'minimum': 1,
+        },
+        'synthetic_seed': {
+            'type': 'integer',
+        },
+        'policy_topics_as_arrays': {
+            'type': 'boolean',
+        },
+        'manage_table_layouts': {
+            'type': 'boolean',
+        },
+        'recluster_tables': {
+            'type': 'boolean',
+        },
+        'partition_expiration_days': {
+            'type': 'integer',
+            'minimum': 1,
+        },
+        'opentelemetry_export': {
+            'type': 'boolean',
+        },
+        'resumable_runs': {
+            'type': 'boolean',
+        },
+        'checkpoint_path': {
+            'type': 'string',
+        },
+        'fan_out_customer_ids': {
+            'type': 'integer',
+            'minimum': 1,
+        },
+        'worker_url': {
+            'type': 'string',
+        },
+        'max_concurrent_workers': {
+            'type': 'integer',
+            'minimum': 1,
+        },
+        'work_item_id': {
+            'type': 'string',
+        },
+        'skip_unchanged_accounts': {
+            'type': 'boolean',
+        },
+        'max_snapshot_age_days': {
+            'type': 'integer',
+            'minimum': 1,
+            'description':
+                'Trades freshness for cost. New disapprovals of accounts '
+                'without changes are only fetched once their last fetch is '
+                'this many days old, as policy reviews do not show in '
+                'change_status.',
+        },
+        'max_requests_per_second': {
+            'type': 'number',
+            'exclusiveMinimum': 0,
         }
     },
     'required': [
@@ -72,8 +188,18 @@ request_schema = {
         'bq_output_dataset',
         'region',
         'google_ads_login_customer_id',
-        'customer_ids',
-    ]
+    ],
+    # The accounts are either listed, or discovered from the login customer
+    'anyOf': [{
+        'required': ['customer_ids'],
+    }, {
+        'properties': {
+            'discover_customer_ids': {
+                'const': True,
+            },
+        },
+        'required': ['discover_customer_ids'],
+    }],
 }
 
 
@@ -105,7 +231,27 @@ def main(request: flask.Request) -> flask.Response:
                               mimetype='application/json')
 
     config = models.Payload(**request_json)
-    run(config)
+    if config.work_item_id:
+        try:
+            fanout.verify_coordinator(request.headers.get('Authorization'),
+                                      config.worker_url)
+        except PermissionError as err:
+            logger.error('Rejected work item %s: %s', config.work_item_id, err)
+            response['status'] = 'Failed'
+            response['message'] = str(err)
+            return flask.Response(flask.json.dumps(response),
+                                  status=403,
+                                  mimetype='application/json')
+    try:
+        if config.work_item_id:
+            # A worker of a coordinator, which commits the writes, see fanout
+            response['staged_writes'] = [
+                staged_write._asdict() for staged_write in run_worker(config)
+            ]
+        else:
+            run(config)
+    finally:
+        telemetry.flush()
 
     response['status'] = 'Success'
     response['message'] = 'Execution ran successfully'
@@ -117,34 +263,301 @@ def main(request: flask.Request) -> flask.Response:
 def run(payload: models.Payload) -> None:
     """The orchestration for the function.
 
+    Reports are independent of each other, so they are run on a thread pool
+    capped at payload.max_concurrent_reports. A failing report is logged and
+    does not stop the others from running. The outputs of the reports that
+    succeeded are written to BigQuery together at the end of the run. With
+    payload.fan_out_customer_ids, the reports are split by accounts and run by
+    workers instead, see fanout. With payload.discover_customer_ids, the
+    accounts are discovered from the login customer first, see accounts.
+
     Args:
         payload: the configuration used in this execution.
+
+    Raises:
+        RuntimeError: if any of the reports failed.
     """
     logger.info('Running the orchestration for payload:')
     logger.info(payload)
+    telemetry.configure(payload.opentelemetry_export)
+    google_ads.rate_limiter.configure(payload.max_requests_per_second)
+
+    write_batch = bigquery.WriteBatch(payload)
+    with telemetry.attributes(run_id=write_batch.run_id):
+        with telemetry.stage('load_config') as record:
+            report_configs = utils.load_report_configs()
+            record.set_output(report_configs)
+        reports_to_run = payload.reports_to_run or report_configs.keys()
+        # Discovered once, so all the reports & workers share the same accounts
+        if not payload.use_synthetic_data:
+            payload = accounts.with_discovered_customer_ids(payload)
+
+        if payload.manage_table_layouts and not payload.local_output_path:
+            with telemetry.stage('update_table_layouts'):
+                bigquery.update_table_layouts(payload)
+        if payload.recluster_tables and not payload.local_output_path:
+            with telemetry.stage('recluster_tables'):
+                bigquery.recluster_tables(payload)
+
+        # The counter is kept by the instance across warm invocations
+        dataframe_conversions = google_ads.dataframe_conversions
+        if payload.fan_out_customer_ids:
+            failed_reports = fanout.run_coordinator(payload, report_configs,
+                                                    reports_to_run, run_worker)
+        else:
+            failed_reports = run_reports(payload, report_configs,
+                                         reports_to_run, write_batch)
+        # The views are only deployed to BigQuery
+        if payload.materialize_views and not payload.local_output_path:
+            with telemetry.stage('materialize_views'):
+                bigquery.materialize_views(payload)
 
+    if failed_reports:
+        raise RuntimeError(f'Failed to run reports: {sorted(failed_reports)}')
+    logger.info('Done. Converted %d GAARF reports to dataframes.',
+                google_ads.dataframe_conversions - dataframe_conversions)
+    logger.info(
+        'Client pools: Google Ads %d hits, %d misses; '
+        'BigQuery %d hits, %d misses.', google_ads.ads_client_pool.hits,
+        google_ads.ads_client_pool.misses, bigquery.client_pool.hits,
+        bigquery.client_pool.misses)
+    log_rate_limiter_stats()
+
+
+def log_rate_limiter_stats() -> None:
+    """Log the throughput & rate of the Google Ads API requests."""
+    stats = google_ads.rate_limiter.stats()
+    logger.info(
+        'Google Ads API: %d requests, %.1f/s over the last minute, '
+        'rate limit %s/s, %d quota errors, %.1fs throttled.', stats['requests'],
+        stats['throughput'],
+        'none' if stats['rate'] is None else round(stats['rate'], 1),
+        stats['quota_errors'], stats['throttled_seconds'])
+
+
+def run_reports(payload: models.Payload,
+                report_configs: Dict[str, models.ReportConfig],
+                reports_to_run: Iterable[str],
+                write_batch: 'bigquery.WriteBatch') -> List[str]:
+    """Run the reports on a thread pool, and commit their writes together.
+
+    Args:
+        payload: the configuration used in this execution.
+        report_configs: the configs of all the reports.
+        reports_to_run: the names of the reports to run.
+        write_batch: the writes of the run.
+
+    Returns:
+        The names of the reports that failed.
+    """
+    failed_reports = []
+    # The reports that matter most start first, and go first for the quota
+    reports_to_run = sorted(reports_to_run,
+                            key=lambda report: -report_configs[report].priority)
+    # Shared by the reports, so each account is only checked once
+    change_detector = (change_detection.ChangeDetector(payload)
+                       if payload.skip_unchanged_accounts else None)
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=payload.max_concurrent_reports) as executor:
+        futures = {}
+        for report in reports_to_run:
+            future = telemetry.submit(executor, run_report, payload,
+                                      report_configs[report], change_detector)
+            futures[future] = report
+        for future in concurrent.futures.as_completed(futures):
+            report = futures[future]
+            try:
+                write_batch.extend(future.result())
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('Report %s failed.', report)
+                failed_reports.append(report)
+    write_batch.commit()
+    return failed_reports
+
+
+def run_worker(payload: models.Payload) -> List['bigquery.StagedWrite']:
+    """Run the work item of a worker, see fanout.
+
+    Args:
+        payload: the payload of the work item, with a single report to run.
+
+    Returns:
+        The writes of the report loaded to staging tables, for the
+        coordinator to commit.
+    """
+    telemetry.configure(payload.opentelemetry_export)
+    google_ads.rate_limiter.configure(payload.max_requests_per_second)
     report_configs = utils.load_report_configs()
-    reports_to_run = payload.reports_to_run or report_configs.keys()
+    with telemetry.attributes(work_item=payload.work_item_id):
+        write_batch = run_report(payload,
+                                 report_configs[payload.reports_to_run[0]])
+        return write_batch.stage()
+
 
-    for report in reports_to_run:
-        report_config = report_configs[report]
-        gaarf_report = google_ads.run_gaarf_report(payload, report_config)
-        if gaarf_report is None:
+def run_report(
+    payload: models.Payload,
+    report_config: models.ReportConfig,
+    change_detector: 'change_detection.ChangeDetector' = None
+) -> 'bigquery.WriteBatch':
+    """Fetch a single report from Google Ads.
+
+    Args:
+        payload: the configuration used in this execution.
+        report_config: the config of the report to run.
+        change_detector: finds the accounts that changed, to only fetch
+            those with payload.skip_unchanged_accounts, see change_detection.
+
+    Returns:
+        The writes of the report, to commit with the rest of the run.
+    """
+    with telemetry.attributes(report=report_config.table_name), \
+            rate_limit.priority(report_config.priority), \
+            telemetry.stage('report') as record:
+        write_batch = bigquery.WriteBatch(payload)
+        checkpoint = None
+        if payload.resumable_runs:
+            checkpoint = checkpoints.ReportCheckpoint(
+                checkpoints.get_checkpoint_store(payload),
+                report_config.table_name, write_batch.run_date)
+            if checkpoint.is_done():
+                logger.info('Skipping report %s, already written on %s.',
+                            report_config.table_name, write_batch.run_date)
+                return write_batch
+            write_batch.on_commit(checkpoint.mark_done)
+        # The changes are found by comparing the whole report, so it can't be
+        # streamed in incremental mode
+        is_incremental = incremental.is_incremental(payload, report_config)
+        time_series_dfs = []
+        if (change_detector is not None and
+                change_detection.can_reuse_snapshots(payload, report_config)):
+            plan, reused_time_series = (
+                change_detection.reuse_unchanged_accounts(
+                    payload, report_config, change_detector, write_batch))
+            if reused_time_series is not None:
+                time_series_dfs.append(reused_time_series)
+            if not plan.fetch_customer_ids:
+                add_time_series(time_series_dfs, report_config, write_batch)
+                return write_batch
+            payload = payload.model_copy(
+                update={'customer_ids': plan.fetch_customer_ids})
+        if (payload.stream_batch_size and not payload.use_synthetic_data and
+                not is_incremental and google_ads.is_streamable(report_config)):
+            run_streaming_report(payload, report_config, write_batch,
+                                 time_series_dfs)
+            return write_batch
+
+        try:
+            report_df = google_ads.run_gaarf_report(payload,
+                                                    report_config,
+                                                    checkpoint=checkpoint)
+        finally:
+            # The shards are saved in batches, keep the fetched ones for a
+            # rerun, whether the fetch or the write fails
+            if checkpoint is not None:
+                checkpoint.flush()
+        if report_df is None:
             logger.warning('GAARF report is None, check configuration.')
-            return None
-        bigquery.write_gaarf_report_to_bigquery(payload, gaarf_report,
-                                                report_config,
-                                                report_config.table_name)
-
-        if (report_config.time_series_table_name and
-                len(gaarf_report.results) > 0):
-            report_time_series = google_ads.extract_time_series(
-                gaarf_report, report_config)
-            bigquery.write_gaarf_report_to_bigquery(
-                payload, report_time_series, report_config,
-                report_config.time_series_table_name)
-
-    logger.info('Done.')
+            return write_batch
+        record.set_output(report_df)
+        if is_incremental:
+            incremental.write_changes(payload, report_df, report_config,
+                                      write_batch)
+        else:
+            write_batch.add(report_df, report_config, report_config.table_name)
+
+        if report_config.time_series_table_name and not report_df.empty:
+            time_series_dfs.append(extract_time_series(report_df,
+                                                       report_config))
+        add_time_series(time_series_dfs, report_config, write_batch)
+
+        if report_config.rollups and not report_df.empty:
+            for table_name, rollup_df in compute_rollups(
+                    report_df, report_config).items():
+                write_batch.add(rollup_df, report_config, table_name)
+
+        logger.info('Finished report %s with %d rows, peak memory %.0f MiB',
+                    report_config.table_name, len(report_df),
+                    utils.get_peak_memory_mib())
+        return write_batch
+
+
+def run_streaming_report(
+        payload: models.Payload,
+        report_config: models.ReportConfig,
+        write_batch: 'bigquery.WriteBatch',
+        time_series_dfs: Optional[List['pd.DataFrame']] = None) -> None:
+    """Stream a report from Google Ads to BigQuery in fixed-size batches.
+
+    The batches are loaded to a staging table as they are fetched. The time
+    series & rollups are computed for each batch and added up at the end, so
+    the memory used doesn't depend on the number of rows in the report.
+
+    Args:
+        payload: the configuration used in this execution.
+        report_config: the config of the report to run.
+        write_batch: the writes of the report.
+        time_series_dfs: time series to add to those of the report, e.g. of
+            the accounts copied from the last snapshot.
+    """
+    time_series_dfs = list(time_series_dfs or [])
+    rollup_dfs = collections.defaultdict(list)
+
+    def report_batches():
+        for report_df in google_ads.stream_gaarf_report(payload, report_config):
+            if report_config.time_series_table_name and not report_df.empty:
+                time_series_dfs.append(
+                    extract_time_series(report_df, report_config))
+            if report_config.rollups and not report_df.empty:
+                for table_name, rollup_df in compute_rollups(
+                        report_df, report_config).items():
+                    rollup_dfs[table_name].append(rollup_df)
+            yield report_df
+
+    write_batch.stage_stream(report_batches(), report_config,
+                             report_config.table_name)
+
+    add_time_series(time_series_dfs, report_config, write_batch)
+
+    for rollup_config in report_config.rollups or []:
+        if rollup_dfs[rollup_config.table_name]:
+            write_batch.add(
+                rollups.combine_rollups(rollup_dfs[rollup_config.table_name],
+                                        rollup_config), report_config,
+                rollup_config.table_name)
+
+
+def add_time_series(time_series_dfs: List['pd.DataFrame'],
+                    report_config: models.ReportConfig,
+                    write_batch: 'bigquery.WriteBatch') -> None:
+    """Add up the time series of a report, and add them to the writes."""
+    if not time_series_dfs:
+        return
+    report_time_series = time_series_dfs[0]
+    if len(time_series_dfs) > 1:
+        report_time_series = google_ads.combine_time_series(
+            time_series_dfs, report_config)
+    write_batch.add(report_time_series, report_config,
+                    report_config.time_series_table_name)
+
+
+def extract_time_series(report_df: 'pd.DataFrame',
+                        report_config: models.ReportConfig) -> 'pd.DataFrame':
+    """Extract the time series of a report, as a stage of the run."""
+    with telemetry.stage('time_series') as record:
+        report_time_series = google_ads.extract_time_series(
+            report_df, report_config)
+        record.set_output(report_time_series)
+    return report_time_series
+
+
+def compute_rollups(
+        report_df: 'pd.DataFrame',
+        report_config: models.ReportConfig) -> Dict[str, 'pd.DataFrame']:
+    """Compute the rollups of a report, as a stage of the run."""
+    with telemetry.stage('rollups') as record:
+        rollup_dfs = rollups.compute_rollups(report_df, report_config)
+        record.rows = sum(len(rollup_df) for rollup_df in rollup_dfs.values())
+    return rollup_dfs
 
 
 if __name__ == '__main__':
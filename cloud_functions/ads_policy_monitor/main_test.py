@@ -13,9 +13,18 @@
 # limitations under the License.
 """Unit tests for main.py"""
 import json
+import os
+import tempfile
 import unittest
 from unittest.mock import MagicMock, patch
+import pandas as pd
+from pandas.testing import assert_frame_equal
+from gaarf.report import GaarfReport
+
+import bigquery
 import main
+import models
+import synthetic
 
 
 class MainTestCase(unittest.TestCase):
@@ -34,6 +43,262 @@ class MainTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         mock_run.assert_called_once()
 
+    @patch('main.run')
+    def test_main_requires_customer_ids_or_discovery(self, mock_run):
+        with open('example.json', 'r') as f:
+            json_config = json.loads(f.read())
+        del json_config['customer_ids']
+        mock_request = MagicMock()
+        mock_request.get_json.return_value = json_config
+        self.assertEqual(main.main(mock_request).status_code, 400)
+
+        json_config['discover_customer_ids'] = True
+        self.assertEqual(main.main(mock_request).status_code, 200)
+        mock_run.assert_called_once()
+
+    @patch('main.run_worker', return_value=[])
+    def test_main_rejects_work_items_of_other_callers(self, mock_run_worker):
+        with open('example.json', 'r') as f:
+            json_config = json.loads(f.read())
+        json_config['work_item_id'] = 'job/AdPolicyData/0'
+        json_config['worker_url'] = 'https://worker'
+        mock_request = MagicMock()
+        mock_request.get_json.return_value = json_config
+        mock_request.headers = {}
+        self.assertEqual(main.main(mock_request).status_code, 403)
+        mock_run_worker.assert_not_called()
+
+        mock_request.headers = {'Authorization': 'Bearer token'}
+        with patch('fanout.verify_coordinator') as mock_verify_coordinator:
+            self.assertEqual(main.main(mock_request).status_code, 200)
+        mock_verify_coordinator.assert_called_once_with('Bearer token',
+                                                        'https://worker')
+        mock_run_worker.assert_called_once()
+
+    @patch('main.google_ads')
+    def test_run_isolates_failed_reports(self, mock_google_ads):
+
+        def run_gaarf_report(payload, report_config, checkpoint=None):
+            if report_config.table_name == 'AdPolicyData':
+                raise ValueError('Quota exceeded')
+            return pd.DataFrame()
+
+        mock_google_ads.run_gaarf_report.side_effect = run_gaarf_report
+        with tempfile.TemporaryDirectory() as directory:
+            payload = models.Payload(project_id='my_project',
+                                     bq_output_dataset='my_dataset',
+                                     region='europe-west2',
+                                     google_ads_login_customer_id=123,
+                                     customer_ids=[1, 2],
+                                     max_concurrent_reports=3,
+                                     local_output_path=directory)
+
+            with self.assertRaisesRegex(RuntimeError, 'AdPolicyData'):
+                main.run(payload)
+
+            written_tables = set(os.listdir(directory))
+        self.assertEqual(written_tables, {'Ocid', 'AssetPolicyData'})
+
+    @patch('main.google_ads')
+    def test_run_resumes_failed_reports(self, mock_google_ads):
+        run_reports = []
+
+        def run_gaarf_report(payload, report_config, checkpoint=None):
+            run_reports.append(report_config.table_name)
+            if (report_config.table_name == 'AdPolicyData' and
+                    len(run_reports) <= 3):
+                raise ValueError('Quota exceeded')
+            return pd.DataFrame()
+
+        mock_google_ads.run_gaarf_report.side_effect = run_gaarf_report
+        with tempfile.TemporaryDirectory() as directory:
+            payload = models.Payload(
+                project_id='my_project',
+                bq_output_dataset='my_dataset',
+                region='europe-west2',
+                google_ads_login_customer_id=123,
+                customer_ids=[1, 2],
+                resumable_runs=True,
+                checkpoint_path=os.path.join(directory, 'checkpoints'),
+                local_output_path=os.path.join(directory, 'output'))
+
+            with self.assertRaisesRegex(RuntimeError, 'AdPolicyData'):
+                main.run(payload)
+            main.run(payload)
+
+        self.assertCountEqual(
+            run_reports,
+            ['Ocid', 'AdPolicyData', 'AssetPolicyData', 'AdPolicyData'])
+
+    @patch('main.google_ads.run_gaarf_report')
+    def test_run_fans_out_to_workers(self, mock_run_gaarf_report):
+
+        def run_gaarf_report(payload, report_config, checkpoint=None):
+            report_dfs = []
+            for customer_id in payload.customer_ids:
+                report_df = synthetic.generate_report(report_config.table_name,
+                                                      num_rows=20,
+                                                      num_customers=1,
+                                                      seed=customer_id,
+                                                      event_date='2024-01-01')
+                report_dfs.append(report_df.assign(customer_id=customer_id))
+            return pd.concat(report_dfs, ignore_index=True)
+
+        mock_run_gaarf_report.side_effect = run_gaarf_report
+        tables = {}
+        with tempfile.TemporaryDirectory() as directory:
+            for fan_out_customer_ids in (None, 2):
+                output_path = os.path.join(directory, str(fan_out_customer_ids))
+                main.run(
+                    models.Payload(project_id='my_project',
+                                   bq_output_dataset='my_dataset',
+                                   region='europe-west2',
+                                   google_ads_login_customer_id=123,
+                                   customer_ids=[1, 2, 3, 4, 5],
+                                   reports_to_run=['AdPolicyData'],
+                                   fan_out_customer_ids=fan_out_customer_ids,
+                                   local_output_path=output_path))
+                tables[fan_out_customer_ids] = {
+                    table_name:
+                        bigquery.read_local_table(output_path, table_name)
+                    for table_name in os.listdir(output_path)
+                }
+
+        self.assertEqual(mock_run_gaarf_report.call_count, 4)
+        self.assertEqual(tables[2].keys(), tables[None].keys())
+        for table_name, table_df in tables[None].items():
+            # Arrays can't be sorted on
+            columns = [
+                column for column in table_df.columns
+                if column != 'ad_policy_topics'
+            ]
+            assert_frame_equal(
+                tables[2][table_name][columns].sort_values(columns).reset_index(
+                    drop=True),
+                table_df[columns].sort_values(columns).reset_index(drop=True))
+
+    @patch('google_ads.get_ads_client')
+    @patch('google_ads.AdsReportFetcher')
+    @patch('google_ads.fetch_sharded')
+    @patch('main.google_ads.run_gaarf_report')
+    def test_run_copies_unchanged_accounts(self, mock_run_gaarf_report,
+                                           mock_fetch_sharded, *_):
+        fetched_customer_ids = []
+
+        def run_gaarf_report(payload, report_config, checkpoint=None):
+            fetched_customer_ids.append(payload.customer_ids)
+            return pd.concat([
+                synthetic.generate_report(
+                    report_config.table_name,
+                    num_rows=20,
+                    num_customers=1,
+                    seed=customer_id,
+                    event_date=main.utils.get_current_date()).assign(
+                        customer_id=customer_id)
+                for customer_id in payload.customer_ids
+            ],
+                             ignore_index=True)
+
+        mock_run_gaarf_report.side_effect = run_gaarf_report
+        # Only the second account changed since the first run
+        mock_fetch_sharded.return_value = GaarfReport(
+            results=[[2, '2024-01-01 10:00:00']],
+            column_names=['customer_id', 'last_change_date_time'])
+        report_configs = main.utils.load_report_configs()
+        report_configs['AdPolicyData'] = report_configs[
+            'AdPolicyData'].model_copy(
+                update={
+                    'rollups': [
+                        models.RollupConfig(
+                            table_name='AdPolicyDataCustomerRollup',
+                            group_by_columns=['event_date', 'customer_id'],
+                            sum_columns=['impressions'])
+                    ]
+                })
+        with tempfile.TemporaryDirectory() as directory, \
+                patch('utils.load_report_configs', return_value=report_configs):
+            payload = models.Payload(
+                project_id='my_project',
+                bq_output_dataset='my_dataset',
+                region='europe-west2',
+                google_ads_login_customer_id=123,
+                customer_ids=[1, 2, 3],
+                reports_to_run=['AdPolicyData'],
+                skip_unchanged_accounts=True,
+                max_snapshot_age_days=7,
+                incremental_state_path=os.path.join(directory, 'state'),
+                local_output_path=os.path.join(directory, 'output'))
+            for run_date in ('2024-01-01', '2024-01-02'):
+                with patch('utils.get_current_date', return_value=run_date):
+                    main.run(payload)
+            tables = {
+                table_name:
+                    bigquery.read_local_table(payload.local_output_path,
+                                              table_name)
+                for table_name in os.listdir(payload.local_output_path)
+            }
+
+        self.assertEqual(fetched_customer_ids, [[1, 2, 3], [2]])
+        self.assertIn('AdPolicyDataCustomerRollup', tables)
+        for table_name, table_df in tables.items():
+            columns = [
+                column for column in table_df.columns
+                if column != 'ad_policy_topics'
+            ]
+            first_df, second_df = [
+                table_df[table_df['event_date'] == run_date][columns].assign(
+                    event_date='2024-01-02').sort_values(columns).reset_index(
+                        drop=True) for run_date in ('2024-01-01', '2024-01-02')
+            ]
+            self.assertFalse(first_df.empty)
+            assert_frame_equal(second_df, first_df, check_dtype=False)
+
+    @patch('main.bigquery')
+    @patch('main.google_ads.stream_gaarf_report')
+    def test_run_report_streams_batches(self, mock_stream_gaarf_report,
+                                        mock_bigquery):
+        mock_stream_gaarf_report.return_value = iter([
+            pd.DataFrame({
+                'event_date': ['2024-01-01', '2024-01-01'],
+                'status': ['DISAPPROVED', 'APPROVED_LIMITED'],
+            }),
+            pd.DataFrame({
+                'event_date': ['2024-01-01'],
+                'status': ['DISAPPROVED'],
+            }),
+        ])
+        write_batch = mock_bigquery.WriteBatch.return_value
+        write_batch.stage_stream.side_effect = (lambda report_dfs, *args: sum(
+            len(report_df) for report_df in report_dfs))
+        payload = models.Payload(project_id='my_project',
+                                 bq_output_dataset='my_dataset',
+                                 region='europe-west2',
+                                 google_ads_login_customer_id=123,
+                                 customer_ids=[1, 2],
+                                 stream_batch_size=2)
+        report_config = models.ReportConfig(
+            table_name='AdPolicyData',
+            write_disposition='WRITE_APPEND',
+            gaql_filenames='ad_policy_data.sql',
+            time_series_table_name='AdPolicyDataTimeSeries',
+            time_series_variable_column='status')
+
+        main.run_report(payload, report_config)
+
+        time_series = write_batch.add.call_args.args[0]
+        self.assertEqual(time_series.to_dict('records'), [
+            {
+                'event_date': '2024-01-01',
+                'status': 'APPROVED_LIMITED',
+                'counts': 1
+            },
+            {
+                'event_date': '2024-01-01',
+                'status': 'DISAPPROVED',
+                'counts': 2
+            },
+        ])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -16,6 +16,12 @@ from typing import List, Optional, Union
 from pydantic import BaseModel
 
 
+class RollupConfig(BaseModel):
+    table_name: str
+    group_by_columns: List[str]
+    sum_columns: List[str] = []
+
+
 class ReportConfig(BaseModel):
     table_name: str
     write_disposition: str
@@ -25,6 +31,11 @@ class ReportConfig(BaseModel):
     gaql_filenames: Optional[Union[str, List[str]]] = None
     time_series_table_name: Optional[str] = None
     time_series_variable_column: Optional[str] = None
+    incremental_table_name: Optional[str] = None
+    incremental_key_columns: Optional[List[str]] = None
+    incremental_hash_columns: Optional[List[str]] = None
+    rollups: Optional[List[RollupConfig]] = None
+    priority: int = 0
 
 
 class Payload(BaseModel):
@@ -33,5 +44,36 @@ class Payload(BaseModel):
     bq_output_dataset: str
     region: str
     google_ads_login_customer_id: int
-    customer_ids: List[int]
+    customer_ids: List[int] = []
+    discover_customer_ids: bool = False
     use_synthetic_data: bool = False
+    synthetic_num_rows: Optional[int] = None
+    synthetic_num_customers: Optional[int] = None
+    synthetic_seed: Optional[int] = None
+    max_concurrent_reports: int = 1
+    customer_ids_per_shard: Optional[int] = None
+    max_fetch_workers: int = 1
+    stream_batch_size: Optional[int] = None
+    incremental_snapshots: bool = False
+    incremental_state_path: Optional[str] = None
+    bq_load_format: str = 'CSV'
+    local_output_path: Optional[str] = None
+    max_concurrent_writes: int = 4
+    materialize_views: bool = False
+    policy_topics_as_arrays: bool = False
+    manage_table_layouts: bool = False
+    recluster_tables: bool = False
+    partition_expiration_days: Optional[int] = None
+    opentelemetry_export: bool = False
+    resumable_runs: bool = False
+    checkpoint_path: Optional[str] = None
+    fan_out_customer_ids: Optional[int] = None
+    worker_url: Optional[str] = None
+    max_concurrent_workers: int = 10
+    work_item_id: Optional[str] = None
+    skip_unchanged_accounts: bool = False
+    # Trades freshness for cost: policy reviews don't show in change_status,
+    # so a new disapproval of an unchanged account is only fetched once its
+    # last fetch is this old
+    max_snapshot_age_days: int = 1
+    max_requests_per_second: Optional[float] = None
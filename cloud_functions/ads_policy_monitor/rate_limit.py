@@ -0,0 +1,195 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""An adaptive rate limiter of the requests to the Google Ads API.
+
+All the fetches of an instance take their requests from a shared token bucket,
+one token per account queried. The rate of the bucket is adapted with additive
+increase & multiplicative decrease (AIMD): it's halved on each quota error and
+grows back by ADDITIVE_INCREASE requests per second, every second of requests,
+up to the maximum rate. Without a maximum rate, requests are not limited until
+the first quota error, which sets the rate from the throughput that hit it.
+
+When requests wait for tokens, they are served by the priority of their report
+first, then in the order they arrived. The priority is set for the context of a
+report, like the telemetry attributes, so the fetches of the report inherit it.
+"""
+import collections
+import contextlib
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+from typing import Callable, Dict, Iterator, Optional
+
+# Halve the rate on a quota error
+MULTIPLICATIVE_DECREASE = 0.5
+# Requests per second added to the rate for each second of requests
+ADDITIVE_INCREASE = 1.0
+# The rate is never decreased below this, so requests always make progress
+MIN_RATE = 0.2
+# The bucket holds the tokens of this many seconds at the current rate
+BURST_SECONDS = 1.0
+# The window the throughput is measured over
+THROUGHPUT_WINDOW_SECONDS = 60.0
+
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar(
+    'rate_limit_priority', default=0)
+
+
+@contextlib.contextmanager
+def priority(value: int) -> Iterator[None]:
+    """Set the priority of the requests made in the context, higher first."""
+    token = _priority.set(value)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class AdaptiveRateLimiter:
+    """A thread-safe token bucket with an AIMD rate and priority queue.
+
+    Attributes:
+        max_rate: the maximum requests per second, or None for no maximum.
+        rate: the current requests per second, or None while unlimited.
+        requests: the number of requests let through.
+        quota_errors: the number of quota errors reported.
+        throttled_seconds: the time requests waited for tokens, in total.
+    """
+
+    def __init__(self,
+                 max_rate: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_rate = max_rate
+        self.rate = max_rate
+        self.requests = 0
+        self.quota_errors = 0
+        self.throttled_seconds = 0.0
+        self._clock = clock
+        self._tokens = self._get_capacity()
+        self._updated_at = clock()
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._sent = collections.deque()
+        self._condition = threading.Condition()
+
+    def configure(self, max_rate: Optional[float]) -> None:
+        """Set the maximum rate, keeping the rate learned below it."""
+        with self._condition:
+            self._refill()
+            self.max_rate = max_rate
+            if max_rate is not None and (self.rate is None or
+                                         self.rate > max_rate):
+                self.rate = max_rate
+                self._tokens = min(self._tokens, self._get_capacity())
+            self._condition.notify_all()
+
+    def acquire(self, cost: int = 1) -> float:
+        """Wait for the tokens of a request.
+
+        Args:
+            cost: the number of API requests, e.g. the accounts queried.
+
+        Returns:
+            The seconds waited for the tokens.
+        """
+        cost = max(cost, 1)
+        start = self._clock()
+        with self._condition:
+            ticket = (-_priority.get(), next(self._sequence))
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while True:
+                    self._refill()
+                    if self._waiters[0] != ticket:
+                        # Woken up when the first waiter leaves
+                        self._condition.wait()
+                    elif self.rate is None or self._tokens >= 1:
+                        break
+                    else:
+                        self._condition.wait((1 - self._tokens) / self.rate)
+            finally:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                self._condition.notify_all()
+            if self.rate is not None:
+                # Larger requests take the tokens ahead, the next ones wait
+                self._tokens -= cost
+            now = self._clock()
+            self.requests += cost
+            self._sent.append((now, cost))
+            waited = now - start
+            self.throttled_seconds += waited
+        return waited
+
+    def on_success(self, cost: int = 1) -> None:
+        """Increase the rate additively, after a request succeeded."""
+        with self._condition:
+            if self.rate is None:
+                return
+            self._refill()
+            self.rate += ADDITIVE_INCREASE * max(cost, 1) / self.rate
+            if self.max_rate is not None:
+                self.rate = min(self.rate, self.max_rate)
+
+    def on_quota_error(self) -> None:
+        """Decrease the rate multiplicatively, after a quota error."""
+        with self._condition:
+            self._refill()
+            self.quota_errors += 1
+            rate = self.rate if self.rate is not None else self.throughput()
+            self.rate = max(rate * MULTIPLICATIVE_DECREASE, MIN_RATE)
+            # Start from an empty bucket, the quota is already used up
+            self._tokens = min(self._tokens, 0)
+            self._condition.notify_all()
+
+    def throughput(self) -> float:
+        """Get the requests per second let through in the last window."""
+        with self._condition:
+            now = self._clock()
+            while (self._sent and
+                   self._sent[0][0] < now - THROUGHPUT_WINDOW_SECONDS):
+                self._sent.popleft()
+            if not self._sent:
+                return 0.0
+            elapsed = max(now - self._sent[0][0], 1.0)
+            return sum(cost for _, cost in self._sent) / elapsed
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        """Get the current rate, throughput and counters of the limiter."""
+        throughput = self.throughput()
+        with self._condition:
+            return {
+                'rate': self.rate,
+                'max_rate': self.max_rate,
+                'throughput': throughput,
+                'requests': self.requests,
+                'quota_errors': self.quota_errors,
+                'throttled_seconds': self.throttled_seconds,
+                'waiting': len(self._waiters),
+            }
+
+    def _get_capacity(self) -> float:
+        if self.rate is None:
+            return 0.0
+        return max(1.0, self.rate * BURST_SECONDS)
+
+    def _refill(self) -> None:
+        now = self._clock()
+        if self.rate is not None:
+            self._tokens = min(
+                self._tokens + (now - self._updated_at) * self.rate,
+                self._get_capacity())
+        self._updated_at = now
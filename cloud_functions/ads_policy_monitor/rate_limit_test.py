@@ -0,0 +1,79 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for rate_limit.py"""
+import threading
+import time
+import unittest
+
+import rate_limit
+
+
+class RateLimitTestCase(unittest.TestCase):
+
+    def test_rate_is_increased_additively_and_decreased_multiplicatively(self):
+        limiter = rate_limit.AdaptiveRateLimiter(max_rate=10)
+
+        limiter.on_quota_error()
+        self.assertEqual(limiter.rate, 5)
+        limiter.on_success(5)
+        self.assertEqual(limiter.rate, 6)
+        for _ in range(100):
+            limiter.on_success()
+        self.assertEqual(limiter.rate, 10)
+        self.assertEqual(limiter.quota_errors, 1)
+
+    def test_first_quota_error_limits_to_the_throughput(self):
+        limiter = rate_limit.AdaptiveRateLimiter(clock=lambda: 0.0)
+        for _ in range(30):
+            self.assertEqual(limiter.acquire(), 0)
+        self.assertIsNone(limiter.rate)
+
+        limiter.on_quota_error()
+
+        self.assertEqual(limiter.throughput(), 30)
+        self.assertEqual(limiter.rate, 15)
+        self.assertEqual(limiter.stats()['requests'], 30)
+
+    def test_acquire_waits_for_tokens(self):
+        limiter = rate_limit.AdaptiveRateLimiter(max_rate=100)
+        self.assertLess(limiter.acquire(100), 0.005)
+
+        self.assertGreater(limiter.acquire(), 0.005)
+        self.assertGreater(limiter.throttled_seconds, 0.005)
+
+    def test_acquire_serves_higher_priorities_first(self):
+        limiter = rate_limit.AdaptiveRateLimiter(max_rate=10)
+        limiter.acquire(10)
+        order = []
+
+        def acquire(name, value):
+            with rate_limit.priority(value):
+                limiter.acquire()
+            order.append(name)
+
+        threads = []
+        for name, value in (('low', 0), ('high', 1)):
+            thread = threading.Thread(target=acquire, args=(name, value))
+            thread.start()
+            threads.append(thread)
+            while limiter.stats()['waiting'] < len(threads):
+                time.sleep(0.001)
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(order, ['high', 'low'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Rollups: pre-aggregated counts of a report at coarser grains.
+
+Each rollup in the config of a report groups the rows by its columns, counts
+them and adds up its sum columns. The rollups that share a grain family are
+computed from a single group by of the report at the union of their columns,
+so the report is only grouped once per family however many rollups there are.
+"""
+import logging
+import sys
+from typing import Dict, List
+
+import pandas as pd
+
+import google_ads
+import models
+
+logging.basicConfig(stream=sys.stdout)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+COUNT_COLUMN = 'counts'
+# Grouping by this column counts each policy topic of a row once
+POLICY_TOPIC_COLUMN = 'policy_topic'
+
+
+def compute_rollups(
+        report_df: pd.DataFrame,
+        report_config: models.ReportConfig) -> Dict[str, pd.DataFrame]:
+    """Compute all the rollups of a report.
+
+    Rows are counted once in the rollups without POLICY_TOPIC_COLUMN, and
+    once per policy topic in the ones with it. These are the two grain
+    families, each grouped once at its finest grain.
+
+    Args:
+        report_df: the dataframe of the report.
+        report_config: the config of the report, with the rollups.
+
+    Returns:
+        The dataframe of each rollup, by the name of its table.
+    """
+    rollup_configs = report_config.rollups or []
+    families = [[
+        rollup
+        for rollup in rollup_configs
+        if (POLICY_TOPIC_COLUMN in rollup.group_by_columns) == by_topic
+    ]
+                for by_topic in (False, True)]
+    rollup_dfs = {}
+    for by_topic, family in enumerate(families):
+        if not family:
+            continue
+        base_df = report_df
+        if by_topic:
+            base_df = explode_policy_topics(report_df)
+        finest_df = aggregate(
+            base_df, _union(rollup.group_by_columns for rollup in family),
+            _union(rollup.sum_columns for rollup in family))
+        for rollup in family:
+            rollup_dfs[rollup.table_name] = aggregate(finest_df,
+                                                      rollup.group_by_columns,
+                                                      rollup.sum_columns,
+                                                      regroup=True)
+            logger.info('Rolled up %d rows of %s into %d rows of %s',
+                        len(report_df), report_config.table_name,
+                        len(rollup_dfs[rollup.table_name]), rollup.table_name)
+    return rollup_dfs
+
+
+def combine_rollups(rollup_dfs: List[pd.DataFrame],
+                    rollup_config: models.RollupConfig) -> pd.DataFrame:
+    """Add up the rollups computed from batches of the same report."""
+    return aggregate(pd.concat(rollup_dfs, ignore_index=True),
+                     rollup_config.group_by_columns,
+                     rollup_config.sum_columns,
+                     regroup=True)
+
+
+def aggregate(report_df: pd.DataFrame,
+              group_by_columns: List[str],
+              sum_columns: List[str],
+              regroup: bool = False) -> pd.DataFrame:
+    """Group a dataframe, adding up the sum columns and counting the rows.
+
+    Args:
+        report_df: the dataframe to group.
+        group_by_columns: the columns to group by. Missing values are a group
+            of their own, e.g. the ad group of campaign level assets.
+        sum_columns: the columns to add up.
+        regroup: whether the dataframe is already an aggregate, so the
+            COUNT_COLUMN is added up instead of counting the rows.
+
+    Returns:
+        A dataframe with one row per group, with the group by columns, the sum
+        columns and the COUNT_COLUMN.
+    """
+    if not regroup:
+        report_df = report_df.assign(**{COUNT_COLUMN: 1})
+    return report_df.groupby(group_by_columns,
+                             observed=True,
+                             dropna=False,
+                             sort=False)[[*sum_columns,
+                                          COUNT_COLUMN]].sum().reset_index()
+
+
+def explode_policy_topics(report_df: pd.DataFrame) -> pd.DataFrame:
+    """Repeat each row of a report once per policy topic.
+
+    The topics are taken from the array column of the topics if the report
+    has one, otherwise from the topic string column. Rows without a topic
+    are dropped.
+
+    Args:
+        report_df: the dataframe of the report.
+
+    Returns:
+        The dataframe with a POLICY_TOPIC_COLUMN of single topics.
+    """
+    topics_column = _get_topics_column(report_df)
+    topics = [
+        google_ads.split_policy_topics(topic)
+        for topic in report_df[topics_column]
+    ]
+    return report_df.assign(**{
+        POLICY_TOPIC_COLUMN: topics
+    }).explode(POLICY_TOPIC_COLUMN).dropna(subset=[POLICY_TOPIC_COLUMN])
+
+
+def _get_topics_column(report_df: pd.DataFrame) -> str:
+    for topics_column, array_column in (
+            google_ads.POLICY_TOPICS_ARRAY_COLUMNS.items()):
+        if array_column in report_df:
+            return array_column
+        if topics_column in report_df:
+            return topics_column
+    raise ValueError('The report has no policy topics to roll up')
+
+
+def _union(column_lists) -> List[str]:
+    return list(
+        dict.fromkeys(column for columns in column_lists for column in columns))
@@ -0,0 +1,126 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for rollups.py"""
+import unittest
+
+import numpy as np
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+import models
+import rollups
+
+REPORT_CONFIG = models.ReportConfig(
+    table_name='AdPolicyData',
+    write_disposition='WRITE_APPEND',
+    rollups=[
+        models.RollupConfig(table_name='CustomerRollup',
+                            group_by_columns=['event_date', 'customer_id'],
+                            sum_columns=['impressions']),
+        models.RollupConfig(
+            table_name='CampaignRollup',
+            group_by_columns=['event_date', 'customer_id', 'campaign_id']),
+        models.RollupConfig(table_name='TopicRollup',
+                            group_by_columns=['event_date', 'policy_topic'],
+                            sum_columns=['impressions']),
+    ])
+
+
+def make_report() -> pd.DataFrame:
+    return pd.DataFrame({
+        'event_date': ['2024-01-01'] * 4,
+        'customer_id': [1, 1, 1, 2],
+        'campaign_id': [11, 11, np.nan, 21],
+        'ad_group_ad_policy_summary_policy_topic_entries': [
+            ['TRADEMARKS', 'TOBACCO'],
+            ['TRADEMARKS'],
+            [],
+            'TOBACCO',
+        ],
+        'impressions': [10, 20, 30, 40],
+    })
+
+
+class RollupsTestCase(unittest.TestCase):
+
+    def test_compute_rollups(self):
+        rollup_dfs = rollups.compute_rollups(make_report(), REPORT_CONFIG)
+
+        self.assertEqual(rollup_dfs['CustomerRollup'].to_dict('records'), [
+            {
+                'event_date': '2024-01-01',
+                'customer_id': 1,
+                'impressions': 60,
+                'counts': 3
+            },
+            {
+                'event_date': '2024-01-01',
+                'customer_id': 2,
+                'impressions': 40,
+                'counts': 1
+            },
+        ])
+        self.assertEqual(
+            rollup_dfs['CampaignRollup'][['customer_id',
+                                          'counts']].values.tolist(),
+            [[1, 2], [1, 1], [2, 1]])
+        self.assertTrue(np.isnan(
+            rollup_dfs['CampaignRollup']['campaign_id'][1]))
+
+    def test_compute_rollups_per_topic(self):
+        rollup_dfs = rollups.compute_rollups(make_report(), REPORT_CONFIG)
+
+        self.assertEqual(rollup_dfs['TopicRollup'].to_dict('records'), [
+            {
+                'event_date': '2024-01-01',
+                'policy_topic': 'TRADEMARKS',
+                'impressions': 30,
+                'counts': 2
+            },
+            {
+                'event_date': '2024-01-01',
+                'policy_topic': 'TOBACCO',
+                'impressions': 50,
+                'counts': 2
+            },
+        ])
+
+    def test_explode_policy_topics_prefers_arrays(self):
+        report_df = pd.DataFrame({
+            'ad_group_ad_policy_summary_policy_topic_entries': [None, None],
+            'ad_policy_topics': [['TRADEMARKS', 'TOBACCO'], []],
+        })
+
+        results = rollups.explode_policy_topics(report_df)
+
+        self.assertEqual(results['policy_topic'].tolist(),
+                         ['TRADEMARKS', 'TOBACCO'])
+
+    def test_combine_rollups(self):
+        report_df = make_report()
+        rollup_config = REPORT_CONFIG.rollups[0]
+        batch_rollups = [
+            rollups.compute_rollups(batch_df, REPORT_CONFIG)['CustomerRollup']
+            for batch_df in (report_df.iloc[:3], report_df.iloc[3:])
+        ]
+
+        results = rollups.combine_rollups(batch_rollups, rollup_config)
+
+        assert_frame_equal(
+            results,
+            rollups.compute_rollups(report_df, REPORT_CONFIG)['CustomerRollup'])
+
+
+if __name__ == '__main__':
+    unittest.main()
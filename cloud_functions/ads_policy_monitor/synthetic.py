@@ -0,0 +1,257 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""A seeded generator of synthetic reports of any size, for load testing.
+
+The reports have the columns & dtypes of the Google Ads reports, and the
+distributions of the statuses & policy topics of the files in synthetic_data.
+Accounts follow a long tail, with a few accounts holding most of the rows.
+Every column is drawn as a whole with numpy, and string columns are built as
+categoricals of their distinct values, so tens of millions of rows take seconds.
+"""
+import logging
+import sys
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+logging.basicConfig(stream=sys.stdout)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+FIRST_CUSTOMER_ID = 1000000000
+CAMPAIGNS_PER_CUSTOMER = 50
+AD_GROUPS_PER_CAMPAIGN = 20
+ASSETS_PER_CUSTOMER = 2000
+# The exponent of the long tail of the number of rows per account
+CUSTOMER_SIZE_EXPONENT = 1.2
+# The default number of report rows per account, if it's not set
+ROWS_PER_CUSTOMER = 1000
+
+AD_APPROVAL_STATUSES = {
+    'DISAPPROVED': 0.42,
+    'APPROVED': 0.29,
+    'APPROVED_LIMITED': 0.19,
+    'UNDER_REVIEW': 0.10,
+}
+AD_REVIEW_STATUSES = {'REVIEWED': 0.95, 'REVIEW_IN_PROGRESS': 0.05}
+AD_STATUSES = {'ENABLED': 0.9, 'PAUSED': 0.1}
+CAMPAIGN_PRIMARY_STATUSES = {'ELIGIBLE': 0.8, 'LIMITED': 0.15, 'PAUSED': 0.05}
+AD_POLICY_TOPICS = {
+    'TRADEMARKS_IN_AD_TEXT': 0.25,
+    'DESTINATION_NOT_WORKING': 0.15,
+    'TRADEMARKS|TRADEMARKS_IN_AD_TEXT': 0.1,
+    'PHONE_NUMBER_IN_AD_TEXT': 0.1,
+    'STALE_DISAPPROVAL': 0.08,
+    'RESTRICTED_MEDICAL_CONTENT|RESTRICTED_DRUG_TERM': 0.07,
+    'GOVERNMENT_DOCUMENTS_AND_OFFICIAL_SERVICES': 0.06,
+    'INSUFFICIENT_ORIGINAL_CONTENT': 0.05,
+    'STALE_DISAPPROVAL|GOVERNMENT_DOCUMENTS_AND_OFFICIAL_SERVICES': 0.05,
+    'ALCOHOL': 0.04,
+    'GAMBLING_AND_GAMES': 0.03,
+    'TOBACCO|RECREATIONAL_DRUGS': 0.02,
+}
+
+ASSET_APPROVAL_STATUSES = {'APPROVED_LIMITED': 0.83, 'DISAPPROVED': 0.17}
+ASSET_TYPES = {
+    'CALLOUT': 0.56,
+    'STRUCTURED_SNIPPET': 0.23,
+    'SITELINK': 0.18,
+    'MOBILE_APP': 0.03,
+}
+ASSET_LEVELS = {'Ad Group': 0.83, 'Campaign': 0.14, 'Account': 0.03}
+ASSET_POLICY_TOPICS = {
+    'TRADEMARKS_IN_AD_TEXT': 0.81,
+    'DESTINATION_NOT_WORKING': 0.07,
+    'TOBACCO | RECREATIONAL_DRUGS': 0.06,
+    'INSUFFICIENT_ORIGINAL_CONTENT': 0.04,
+    'TRADEMARKS | TRADEMARKS_IN_AD_TEXT': 0.02,
+}
+
+
+def generate_report(table_name: str,
+                    num_rows: int,
+                    num_customers: Optional[int] = None,
+                    seed: Optional[int] = None,
+                    event_date: str = '') -> pd.DataFrame:
+    """Generate a synthetic report.
+
+    Args:
+        table_name: the table of the report, AdPolicyData, AssetPolicyData or
+            Ocid.
+        num_rows: the number of rows of the policy reports.
+        num_customers: the number of accounts, by default one per
+            ROWS_PER_CUSTOMER rows. It's also the number of rows of Ocid.
+        seed: the seed of the random generator, the same seed generates the
+            same report.
+        event_date: the date of the rows of the policy reports.
+
+    Returns:
+        The dataframe of the report.
+
+    Raises:
+        ValueError: if there is no generator for the table.
+    """
+    if num_customers is None:
+        num_customers = max(1, num_rows // ROWS_PER_CUSTOMER)
+    rng = np.random.default_rng(seed)
+    logger.info('Generating %s synthetic data for %d accounts', table_name,
+                num_customers)
+    if table_name == 'Ocid':
+        return generate_ocid(num_customers, rng)
+    if table_name == 'AdPolicyData':
+        return generate_ad_policy_data(num_rows, num_customers, rng, event_date)
+    if table_name == 'AssetPolicyData':
+        return generate_asset_policy_data(num_rows, num_customers, rng,
+                                          event_date)
+    raise ValueError(f'No synthetic data generator for {table_name}')
+
+
+def generate_ocid(num_customers: int, rng: np.random.Generator) -> pd.DataFrame:
+    """Generate the Ocid of each account."""
+    return pd.DataFrame({
+        'account_id':
+            FIRST_CUSTOMER_ID + np.arange(num_customers, dtype='int64'),
+        'ocid':
+            rng.choice(10**9, num_customers, replace=False),
+    })
+
+
+def generate_ad_policy_data(num_rows: int, num_customers: int,
+                            rng: np.random.Generator,
+                            event_date: str) -> pd.DataFrame:
+    """Generate an AdPolicyData report of one row per ad.
+
+    Approved ads have no policy topics.
+    """
+    customer_index = _sample_customers(num_rows, num_customers, rng)
+    campaign_index = (customer_index * CAMPAIGNS_PER_CUSTOMER +
+                      rng.integers(0, CAMPAIGNS_PER_CUSTOMER, num_rows))
+    ad_group_index = (campaign_index * AD_GROUPS_PER_CAMPAIGN +
+                      rng.integers(0, AD_GROUPS_PER_CAMPAIGN, num_rows))
+    approval_status = _sample_categories(AD_APPROVAL_STATUSES, num_rows, rng)
+    policy_topics = _sample_categories(AD_POLICY_TOPICS, num_rows, rng)
+    policy_topics[approval_status == 'APPROVED'] = np.nan
+    impressions = rng.lognormal(mean=8, sigma=1.5,
+                                size=num_rows).astype('int64')
+    return pd.DataFrame({
+        'event_date':
+            _constant(event_date, num_rows),
+        'customer_id':
+            FIRST_CUSTOMER_ID + customer_index,
+        'customer_descriptive_name':
+            _names('Account', customer_index),
+        'campaign_id':
+            campaign_index + 1,
+        'campaign_name':
+            _names('Campaign', campaign_index),
+        'campaign_status':
+            _constant('ENABLED', num_rows),
+        'campaign_primary_status':
+            _sample_categories(CAMPAIGN_PRIMARY_STATUSES, num_rows, rng),
+        'ad_group_id':
+            ad_group_index + 1,
+        'ad_group_name':
+            _names('Ad group', ad_group_index),
+        'ad_group_status':
+            _constant('ENABLED', num_rows),
+        'ad_group_ad_ad_id':
+            np.arange(1, num_rows + 1, dtype='int64'),
+        'ad_group_ad_status':
+            _sample_categories(AD_STATUSES, num_rows, rng),
+        'ad_group_ad_policy_summary_approval_status':
+            approval_status,
+        'ad_group_ad_policy_summary_policy_topic_entries':
+            policy_topics,
+        'ad_group_ad_policy_summary_review_status':
+            _sample_categories(AD_REVIEW_STATUSES, num_rows, rng),
+        'impressions':
+            impressions,
+        'clicks':
+            rng.binomial(impressions, 0.03),
+    })
+
+
+def generate_asset_policy_data(num_rows: int, num_customers: int,
+                               rng: np.random.Generator,
+                               event_date: str) -> pd.DataFrame:
+    """Generate an AssetPolicyData report of one row per asset and level.
+
+    The rows have the columns of the combined assets report, see
+    google_ads.concat_assets_reports.
+    """
+    customer_index = _sample_customers(num_rows, num_customers, rng)
+    asset_level = _sample_categories(ASSET_LEVELS, num_rows, rng)
+    campaign_ids = (customer_index * CAMPAIGNS_PER_CUSTOMER +
+                    rng.integers(1, CAMPAIGNS_PER_CUSTOMER + 1, num_rows))
+    ad_group_ids = (campaign_ids * AD_GROUPS_PER_CAMPAIGN +
+                    rng.integers(1, AD_GROUPS_PER_CAMPAIGN + 1, num_rows))
+    is_account = np.asarray(asset_level == 'Account')
+    is_ad_group = np.asarray(asset_level == 'Ad Group')
+    return pd.DataFrame({
+        'event_date':
+            _constant(event_date, num_rows),
+        'customer_id':
+            FIRST_CUSTOMER_ID + customer_index,
+        'customer_descriptive_name':
+            _names('Account', customer_index),
+        'asset_id': (customer_index * ASSETS_PER_CUSTOMER +
+                     rng.integers(1, ASSETS_PER_CUSTOMER + 1, num_rows)),
+        'asset_source':
+            _constant('ADVERTISER', num_rows),
+        'asset_type':
+            _sample_categories(ASSET_TYPES, num_rows, rng),
+        'asset_policy_summary_review_status':
+            _constant('REVIEWED', num_rows),
+        'asset_policy_summary_policy_topic_entries_topics':
+            _sample_categories(ASSET_POLICY_TOPICS, num_rows, rng),
+        'asset_policy_summary_approval_status':
+            _sample_categories(ASSET_APPROVAL_STATUSES, num_rows, rng),
+        'asset_level':
+            asset_level,
+        'example_campaign_id':
+            np.where(is_account, 0, campaign_ids),
+        'example_ad_group_id':
+            np.where(is_ad_group, ad_group_ids, 0),
+        # Most assets are used once, a few are shared by many campaigns
+        'counts':
+            rng.zipf(2.0, num_rows).clip(max=1000),
+    })
+
+
+def _sample_customers(num_rows: int, num_customers: int,
+                      rng: np.random.Generator) -> np.ndarray:
+    weights = 1 / np.arange(1, num_customers + 1)**CUSTOMER_SIZE_EXPONENT
+    return rng.choice(num_customers, num_rows, p=weights / weights.sum())
+
+
+def _sample_categories(distribution: Dict[str, float], num_rows: int,
+                       rng: np.random.Generator) -> pd.Categorical:
+    probabilities = np.array(list(distribution.values()))
+    codes = rng.choice(len(distribution),
+                       num_rows,
+                       p=probabilities / probabilities.sum())
+    return pd.Categorical.from_codes(codes, categories=list(distribution))
+
+
+def _names(prefix: str, index: np.ndarray) -> pd.Categorical:
+    """Name each id, only building the strings of the ids that are used."""
+    codes, used = pd.factorize(index)
+    return pd.Categorical.from_codes(
+        codes, categories=[f'{prefix} {i + 1}' for i in used])
+
+
+def _constant(value: str, num_rows: int) -> pd.Categorical:
+    return pd.Categorical.from_codes(np.zeros(num_rows, dtype='int8'),
+                                     categories=[value])
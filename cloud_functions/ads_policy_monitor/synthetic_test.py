@@ -0,0 +1,87 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for synthetic.py"""
+import unittest
+
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+import synthetic
+
+
+class SyntheticTestCase(unittest.TestCase):
+
+    def test_generate_report_has_the_columns_of_the_files(self):
+        for table_name in ('AdPolicyData', 'AssetPolicyData', 'Ocid'):
+            report_df = synthetic.generate_report(table_name,
+                                                  num_rows=100,
+                                                  seed=1,
+                                                  event_date='2024-01-01')
+            file_df = pd.read_csv(f'synthetic_data/{table_name}.csv')
+            self.assertEqual(list(report_df.columns), list(file_df.columns))
+
+    def test_generate_report_is_seeded(self):
+        report_df = synthetic.generate_report('AdPolicyData',
+                                              num_rows=1000,
+                                              seed=42)
+
+        assert_frame_equal(
+            report_df,
+            synthetic.generate_report('AdPolicyData', num_rows=1000, seed=42))
+        self.assertFalse(
+            report_df.equals(
+                synthetic.generate_report('AdPolicyData',
+                                          num_rows=1000,
+                                          seed=43)))
+
+    def test_generate_ad_policy_data(self):
+        report_df = synthetic.generate_report('AdPolicyData',
+                                              num_rows=100000,
+                                              num_customers=50,
+                                              seed=1,
+                                              event_date='2024-01-01')
+
+        self.assertEqual(len(report_df), 100000)
+        self.assertTrue(report_df['ad_group_ad_ad_id'].is_unique)
+        self.assertEqual(report_df['customer_id'].nunique(), 50)
+        self.assertEqual(set(report_df['event_date']), {'2024-01-01'})
+        approved = (report_df['ad_group_ad_policy_summary_approval_status'] ==
+                    'APPROVED')
+        self.assertTrue(report_df.loc[
+            approved,
+            'ad_group_ad_policy_summary_policy_topic_entries'].isna().all())
+        self.assertAlmostEqual(approved.mean(), 0.29, delta=0.01)
+        # The accounts have a long tail of sizes
+        account_sizes = report_df['customer_id'].value_counts()
+        self.assertGreater(account_sizes.iloc[0], 10 * account_sizes.iloc[-1])
+
+    def test_generate_asset_policy_data(self):
+        report_df = synthetic.generate_report('AssetPolicyData',
+                                              num_rows=10000,
+                                              seed=1)
+
+        account_level = report_df['asset_level'] == 'Account'
+        self.assertTrue((report_df.loc[account_level,
+                                       'example_campaign_id'] == 0).all())
+        self.assertTrue((report_df.loc[report_df['asset_level'] != 'Ad Group',
+                                       'example_ad_group_id'] == 0).all())
+        self.assertEqual(report_df['customer_id'].nunique(), 10)
+
+    def test_generate_report_unknown_table(self):
+        with self.assertRaises(ValueError):
+            synthetic.generate_report('Unknown', num_rows=10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,290 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Timing & metrics of the stages of a run.
+
+Each stage is wrapped in the stage context manager, which logs one JSON line
+with its duration, output rows & bytes and the memory of the process. Cloud
+Logging parses JSON lines on stdout as structured logs, so the stages can be
+filtered by run, report, query or table to find what takes the time of a run.
+
+With payload.opentelemetry_export, the stages are also recorded as
+OpenTelemetry spans & histograms, exported over OTLP by the OpenTelemetry SDK.
+The SDK & exporter are optional dependencies: without them the stages are only
+logged.
+"""
+import concurrent.futures
+import contextlib
+import contextvars
+import json
+import logging
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+import utils
+
+logging.basicConfig(stream=sys.stdout)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# The stage records are printed as they are, one JSON object per line
+stage_logger = logging.getLogger(f'{__name__}.stages')
+stage_logger.setLevel(logging.INFO)
+stage_logger.propagate = False
+_handler = logging.StreamHandler(sys.stdout)
+_handler.setFormatter(logging.Formatter('%(message)s'))
+stage_logger.addHandler(_handler)
+
+# The attributes of the stage records of the current context, like the run ID
+# and the report. The dict is replaced, never changed in place.
+_attributes: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar(
+    'telemetry_attributes', default={})
+
+# The attributes exported as metric attributes, the others have too many
+# values to aggregate on
+METRIC_ATTRIBUTES = ['stage', 'status', 'report', 'query', 'table']
+
+_tracer = None
+_histograms = {}
+# The providers of the current export, flushed at the end of an invocation
+_providers = []
+_sdk_providers = None
+_sdk_providers_lock = threading.Lock()
+
+
+class StageRecord:
+    """The metrics of a stage, completed by the stage with its output."""
+
+    def __init__(self, name: str, attributes: Dict[str, Any]):
+        self.name = name
+        self.attributes = attributes
+        self.rows: Optional[int] = None
+        self.bytes: Optional[int] = None
+
+    def set_output(self, output: Any) -> None:
+        """Record the rows & bytes of the output of the stage.
+
+        Dataframes are measured without their Python objects, so the bytes
+        are a lower bound for object columns but don't cost a pass over the
+        rows. Arrow tables record the size of their buffers. Other outputs
+        only record their length.
+        """
+        if output is None:
+            return
+        self.rows = len(output)
+        if hasattr(output, 'memory_usage'):
+            self.bytes = int(output.memory_usage(index=False).sum())
+        elif hasattr(output, 'nbytes'):
+            self.bytes = int(output.nbytes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'rows': self.rows, 'bytes': self.bytes, **self.attributes}
+
+
+def configure(opentelemetry_export: bool,
+              tracer_provider: Any = None,
+              meter_provider: Any = None) -> None:
+    """Turn the OpenTelemetry export of the stages on or off.
+
+    By default the stages are exported over OTLP by the OpenTelemetry SDK,
+    see get_sdk_providers. Without the SDK, they go to the global providers of
+    the OpenTelemetry API, which record nothing unless the environment set
+    them up. The export is off if the OpenTelemetry API isn't installed.
+
+    Args:
+        opentelemetry_export: whether to export the stages.
+        tracer_provider: for dependency injection, the provider of the spans.
+        meter_provider: for dependency injection, the provider of the metrics.
+    """
+    global _tracer, _providers
+    if not opentelemetry_export:
+        _tracer = None
+        _providers = []
+        return
+    if _tracer is not None and tracer_provider is None and meter_provider is None:
+        return
+    try:
+        from opentelemetry import metrics  # pylint: disable=import-outside-toplevel
+        from opentelemetry import trace  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        logger.warning('opentelemetry_export is set, but opentelemetry-api '
+                       'is not installed. Only logging the stages.')
+        return
+    if tracer_provider is None and meter_provider is None:
+        tracer_provider, meter_provider = get_sdk_providers()
+    _providers = [
+        provider for provider in (tracer_provider, meter_provider)
+        if provider is not None
+    ]
+    meter = metrics.get_meter(__name__, meter_provider=meter_provider)
+    _histograms['duration'] = meter.create_histogram(
+        'ads_policy_monitor.stage.duration',
+        unit='s',
+        description='The duration of the stages of a run')
+    _histograms['rows'] = meter.create_histogram(
+        'ads_policy_monitor.stage.rows',
+        description='The rows output by the stages of a run')
+    _histograms['memory'] = meter.create_histogram(
+        'ads_policy_monitor.stage.memory',
+        unit='MiB',
+        description='The resident memory at the end of the stages of a run')
+    _tracer = trace.get_tracer(__name__, tracer_provider=tracer_provider)
+
+
+def get_sdk_providers() -> Tuple[Any, Any]:
+    """Get the SDK providers that export the stages over OTLP.
+
+    The providers are created once per instance. The OTLP exporters are set
+    up by the standard OTEL_EXPORTER_OTLP_* environment variables, e.g. the
+    endpoint of a collector.
+
+    Returns:
+        The tracer & meter providers, or None for both if the SDK or the OTLP
+        exporter isn't installed.
+    """
+    global _sdk_providers
+    with _sdk_providers_lock:
+        if _sdk_providers is not None:
+            return _sdk_providers
+        try:
+            # pylint: disable=import-outside-toplevel
+            from opentelemetry.exporter.otlp.proto.http import metric_exporter
+            from opentelemetry.exporter.otlp.proto.http import trace_exporter
+            from opentelemetry.sdk import metrics as sdk_metrics
+            from opentelemetry.sdk import trace as sdk_trace
+            from opentelemetry.sdk.metrics import export as metrics_export
+            from opentelemetry.sdk.trace import export as trace_export
+        except ImportError:
+            logger.warning('opentelemetry-sdk or the OTLP exporter is not '
+                           'installed. Exporting to the global providers.')
+            return None, None
+        tracer_provider = sdk_trace.TracerProvider()
+        tracer_provider.add_span_processor(
+            trace_export.BatchSpanProcessor(trace_exporter.OTLPSpanExporter()))
+        meter_provider = sdk_metrics.MeterProvider(metric_readers=[
+            metrics_export.PeriodicExportingMetricReader(
+                metric_exporter.OTLPMetricExporter())
+        ])
+        _sdk_providers = (tracer_provider, meter_provider)
+        return _sdk_providers
+
+
+def flush() -> None:
+    """Export the spans & metrics that are still pending.
+
+    The exporters send in the background, and the instance can be throttled
+    once the response is sent, so this is called before responding.
+    """
+    for provider in _providers:
+        if hasattr(provider, 'force_flush'):
+            provider.force_flush()
+
+
+@contextlib.contextmanager
+def attributes(**values: Any) -> Iterator[None]:
+    """Add attributes to the records of the stages run in the context."""
+    token = _attributes.set({**_attributes.get(), **values})
+    try:
+        yield
+    finally:
+        _attributes.reset(token)
+
+
+@contextlib.contextmanager
+def stage(name: str, **values: Any) -> Iterator[StageRecord]:
+    """Time a stage, and log its record once it's done.
+
+    Args:
+        name: the name of the stage, e.g. fetch or write.
+        **values: attributes of this stage, on top of those of the context.
+
+    Yields:
+        The record of the stage, to set the output of the stage on.
+    """
+    record = StageRecord(name, {**_attributes.get(), **values})
+    span = (_tracer.start_as_current_span(f'ads_policy_monitor.{name}')
+            if _tracer else contextlib.nullcontext())
+    with span:
+        start_memory = utils.get_current_memory_mib()
+        start = time.perf_counter()
+        status = 'ok'
+        try:
+            yield record
+        except BaseException as err:
+            status = 'error'
+            record.attributes['error'] = type(err).__name__
+            raise
+        finally:
+            _emit(record, status, time.perf_counter() - start, start_memory)
+
+
+def submit(executor: concurrent.futures.Executor, function: Callable, *args,
+           **kwargs) -> concurrent.futures.Future:
+    """Submit a function to an executor, with the attributes of the caller.
+
+    Threads don't inherit the context of the thread that started them, so
+    without it the stages of the function would lose the run & report.
+    """
+    context = contextvars.copy_context()
+    return executor.submit(context.run, function, *args, **kwargs)
+
+
+def _emit(record: StageRecord, status: str, duration_seconds: float,
+          start_memory_mib: float) -> None:
+    memory_mib = utils.get_current_memory_mib()
+    fields = {
+        'severity':
+            'INFO' if status == 'ok' else 'ERROR',
+        'message':
+            f'Stage {record.name} {status} in {duration_seconds:.3f}s',
+        'stage':
+            record.name,
+        'status':
+            status,
+        'duration_seconds':
+            round(duration_seconds, 6),
+        'memory_mib':
+            round(memory_mib, 1),
+        'memory_delta_mib':
+            round(memory_mib - start_memory_mib, 1),
+        # The peak is measured differently, so it can lag the current memory
+        'peak_memory_mib':
+            round(max(utils.get_peak_memory_mib(), memory_mib), 1),
+        **{
+            key: value for key, value in record.to_dict().items() if value is not None
+        },
+    }
+    stage_logger.info(json.dumps(fields, default=str))
+    if _tracer is not None:
+        _export(fields, duration_seconds, memory_mib)
+
+
+def _export(fields: Dict[str, Any], duration_seconds: float,
+            memory_mib: float) -> None:
+    from opentelemetry import trace  # pylint: disable=import-outside-toplevel
+    span = trace.get_current_span()
+    for key, value in fields.items():
+        if key not in ('severity', 'message'):
+            span.set_attribute(
+                key,
+                value if isinstance(value,
+                                    (bool, int, float, str)) else str(value))
+    metric_attributes = {
+        key: str(fields[key]) for key in METRIC_ATTRIBUTES if key in fields
+    }
+    _histograms['duration'].record(duration_seconds, metric_attributes)
+    _histograms['memory'].record(memory_mib, metric_attributes)
+    if 'rows' in fields:
+        _histograms['rows'].record(fields['rows'], metric_attributes)
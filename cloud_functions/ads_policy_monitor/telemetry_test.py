@@ -0,0 +1,133 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for telemetry.py"""
+import concurrent.futures
+import json
+import unittest
+
+from opentelemetry.sdk import metrics as sdk_metrics
+from opentelemetry.sdk import trace as sdk_trace
+from opentelemetry.sdk.metrics import export as metrics_export
+from opentelemetry.sdk.trace import export as trace_export
+from opentelemetry.sdk.trace.export import in_memory_span_exporter
+import pandas as pd
+
+import telemetry
+
+
+class TelemetryTestCase(unittest.TestCase):
+
+    def get_records(self, logs):
+        return [json.loads(line.split(':', 2)[2]) for line in logs.output]
+
+    def test_stage_logs_a_json_record(self):
+        with self.assertLogs(telemetry.stage_logger) as logs:
+            with telemetry.attributes(run_id='run'):
+                with telemetry.stage('write', table='AdPolicyData') as record:
+                    record.set_output(pd.DataFrame({'clicks': [1, 2, 3]}))
+
+        [record] = self.get_records(logs)
+        self.assertEqual(record['stage'], 'write')
+        self.assertEqual(record['status'], 'ok')
+        self.assertEqual(record['severity'], 'INFO')
+        self.assertEqual(record['rows'], 3)
+        self.assertEqual(record['bytes'], 24)
+        self.assertEqual(record['run_id'], 'run')
+        self.assertEqual(record['table'], 'AdPolicyData')
+        self.assertGreaterEqual(record['duration_seconds'], 0)
+        self.assertIn('memory_mib', record)
+        self.assertIn('peak_memory_mib', record)
+
+    def test_stage_logs_errors(self):
+        with self.assertLogs(telemetry.stage_logger) as logs:
+            with self.assertRaises(ValueError):
+                with telemetry.stage('fetch'):
+                    raise ValueError('Quota exhausted')
+
+        [record] = self.get_records(logs)
+        self.assertEqual(record['status'], 'error')
+        self.assertEqual(record['severity'], 'ERROR')
+        self.assertEqual(record['error'], 'ValueError')
+
+    def test_submit_keeps_the_attributes(self):
+
+        def run_stage():
+            with telemetry.stage('fetch'):
+                pass
+
+        with self.assertLogs(telemetry.stage_logger) as logs:
+            with telemetry.attributes(run_id='run', report='AdPolicyData'), \
+                    concurrent.futures.ThreadPoolExecutor() as executor:
+                telemetry.submit(executor, run_stage).result()
+
+        [record] = self.get_records(logs)
+        self.assertEqual(record['run_id'], 'run')
+        self.assertEqual(record['report'], 'AdPolicyData')
+
+    def test_configure_exports_stages(self):
+        span_exporter = in_memory_span_exporter.InMemorySpanExporter()
+        tracer_provider = sdk_trace.TracerProvider()
+        tracer_provider.add_span_processor(
+            trace_export.BatchSpanProcessor(span_exporter))
+        metric_reader = metrics_export.InMemoryMetricReader()
+        meter_provider = sdk_metrics.MeterProvider(
+            metric_readers=[metric_reader])
+
+        telemetry.configure(True, tracer_provider, meter_provider)
+        try:
+            with self.assertLogs(telemetry.stage_logger):
+                with telemetry.attributes(report='AdPolicyData'), \
+                        telemetry.stage('combine') as record:
+                    record.rows = 2
+            telemetry.flush()
+        finally:
+            telemetry.configure(False)
+
+        [span] = span_exporter.get_finished_spans()
+        self.assertEqual(span.name, 'ads_policy_monitor.combine')
+        self.assertEqual(span.attributes['rows'], 2)
+        self.assertEqual(span.attributes['report'], 'AdPolicyData')
+        metrics = {
+            metric.name: metric for resource_metrics in
+            metric_reader.get_metrics_data().resource_metrics
+            for scope_metrics in resource_metrics.scope_metrics
+            for metric in scope_metrics.metrics
+        }
+        [rows] = metrics['ads_policy_monitor.stage.rows'].data.data_points
+        self.assertEqual(rows.sum, 2)
+        self.assertEqual(dict(rows.attributes), {
+            'stage': 'combine',
+            'status': 'ok',
+            'report': 'AdPolicyData'
+        })
+        self.assertIn('ads_policy_monitor.stage.duration', metrics)
+
+    def test_configure_off_stops_the_export(self):
+        span_exporter = in_memory_span_exporter.InMemorySpanExporter()
+        tracer_provider = sdk_trace.TracerProvider()
+        tracer_provider.add_span_processor(
+            trace_export.SimpleSpanProcessor(span_exporter))
+
+        telemetry.configure(True, tracer_provider, sdk_metrics.MeterProvider())
+        telemetry.configure(False)
+        with self.assertLogs(telemetry.stage_logger) as logs:
+            with telemetry.stage('combine'):
+                pass
+
+        self.assertEqual(span_exporter.get_finished_spans(), ())
+        self.assertEqual(len(self.get_records(logs)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
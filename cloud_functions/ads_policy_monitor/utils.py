@@ -13,10 +13,126 @@
 # limitations under the License.
 """Helpful functions"""
 from datetime import datetime
+import importlib
 import json
-from typing import Dict
+import os
+import resource
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Tuple
 from models import ReportConfig
 
+# The deployed files never change, so only check their mtime when running
+# locally. Cloud Functions sets K_SERVICE.
+CHECK_FILE_MTIME = 'K_SERVICE' not in os.environ
+
+
+class LazyModule:
+    """A module that is only imported when one of its attributes is used.
+
+    Keeps heavy dependencies, like GAARF and the Google Ads API protos, out of
+    the cold start of the code paths that don't need them.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, attribute: str) -> Any:
+        # Only called for the attributes missing on the proxy itself
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
+
+
+class ClientPool:
+    """A thread-safe cache of API clients that expire after a time to live.
+
+    Pools kept at module level live as long as the Cloud Function instance, so
+    a client is shared by all the reports of a run and by the warm invocations
+    that follow, instead of paying for the OAuth & channel setup every time.
+    """
+
+    def __init__(self,
+                 ttl_seconds: float,
+                 clock: Callable[[], float] = time.monotonic):
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._clients: Dict[Hashable, Tuple[float, Any]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, create_client: Callable[[], Any]) -> Any:
+        """Get the client for the key, creating it if missing or expired.
+
+        Args:
+            key: what the client is specific to, e.g. the login customer ID.
+            create_client: builds a new client for the key.
+
+        Returns:
+            The cached or the new client.
+        """
+        with self._lock:
+            now = self._clock()
+            created_at, client = self._clients.get(key, (None, None))
+            if created_at is not None and now - created_at < self.ttl_seconds:
+                self.hits += 1
+                return client
+            self.misses += 1
+            self._clients = {
+                cached_key: entry
+                for cached_key, entry in self._clients.items()
+                if now - entry[0] < self.ttl_seconds
+            }
+            client = create_client()
+            self._clients[key] = (now, client)
+            return client
+
+    def clear(self) -> None:
+        """Drop all the clients."""
+        with self._lock:
+            self._clients = {}
+
+
+class FileRegistry:
+    """A thread-safe cache of files that are parsed once per instance.
+
+    A file is parsed again when its mtime changes, if check_mtime is set.
+    """
+
+    def __init__(self, check_mtime: bool = CHECK_FILE_MTIME):
+        self.check_mtime = check_mtime
+        self._files: Dict[Tuple[str, Callable], Tuple[float, Any]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, path: str, parse: Callable[[str], Any]) -> Any:
+        """Get the parsed contents of a file.
+
+        Args:
+            path: the path of the file.
+            parse: turns the text of the file into the value to cache.
+
+        Returns:
+            The cached value, or the newly parsed one.
+        """
+        with self._lock:
+            mtime, value = self._files.get((path, parse), (None, None))
+            if mtime is not None and (not self.check_mtime or
+                                      mtime == os.path.getmtime(path)):
+                return value
+            mtime = os.path.getmtime(path)
+            with open(path, 'r') as f:
+                value = parse(f.read())
+            self._files[(path, parse)] = (mtime, value)
+            return value
+
+
+file_registry = FileRegistry()
+
 
 def get_current_date():
     current_date = datetime.now()
@@ -24,10 +140,29 @@ def get_current_date():
     return current_date.strftime('%Y-%m-%d')
 
 
+def get_peak_memory_mib() -> float:
+    """Get the peak resident memory of this process in MiB."""
+    # On Linux ru_maxrss is in kilobytes
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def get_current_memory_mib() -> float:
+    """Get the current resident memory of this process in MiB."""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * resource.getpagesize() / 1024**2
+    except OSError:
+        # /proc is only available on Linux, fall back to the peak memory
+        return get_peak_memory_mib()
+
+
 def load_report_configs(
         filename: str = 'config.json') -> Dict[str, ReportConfig]:
     """Load the reports based on the json configuration file.
 
+    The configuration is validated once, and cached in the file registry.
+
     Params:
         filename: the name of the json config file
 
@@ -39,9 +174,11 @@ def load_report_configs(
            AdPolicyData: ReportConfig for AdPolicyData,
         }
     """
+    return dict(file_registry.get(filename, _parse_report_configs))
+
+
+def _parse_report_configs(text: str) -> Dict[str, ReportConfig]:
     reports_dict = {}
-    with open(filename, 'r') as f:
-        raw_config = json.load(f)
-    for report in raw_config['reports']:
+    for report in json.loads(text)['reports']:
         reports_dict[report['table_name']] = ReportConfig(**report)
     return reports_dict
@@ -12,6 +12,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """Unit tests for utils.py"""
+import os
+import tempfile
 import unittest
 import utils
 
@@ -25,6 +27,35 @@ class UtilsTestCase(unittest.TestCase):
         self.assertIsNotNone(response.get('AdPolicyData'))
         self.assertIsNotNone(response.get('AssetPolicyData'))
 
+    def test_client_pool(self):
+        now = [0]
+        pool = utils.ClientPool(ttl_seconds=60, clock=lambda: now[0])
+
+        first_client = pool.get('key', object)
+        now[0] = 59
+        self.assertIs(pool.get('key', object), first_client)
+        pool.get('other_key', object)
+        now[0] = 60
+        self.assertIsNot(pool.get('key', object), first_client)
+
+        self.assertEqual((pool.hits, pool.misses), (1, 3))
+
+    def test_file_registry_reparses_modified_files(self):
+        registry = utils.FileRegistry(check_mtime=True)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'query.sql')
+            with open(path, 'w') as f:
+                f.write('SELECT 1')
+            os.utime(path, (0, 0))
+
+            first = registry.get(path, str.split)
+            self.assertIs(registry.get(path, str.split), first)
+            with open(path, 'w') as f:
+                f.write('SELECT 2')
+            os.utime(path, (1, 1))
+
+            self.assertEqual(registry.get(path, str.split), ['SELECT', '2'])
+
 
 if __name__ == '__main__':
     unittest.main()
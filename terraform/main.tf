@@ -69,6 +69,10 @@ resource "google_bigquery_table" "ad_policy_data_table" {
     type          = "DAY"
     expiration_ms = 86400000 * var.bq_expiration_days
   }
+  # The clustering is managed by the function, see manage_table_layouts
+  lifecycle {
+    ignore_changes = [clustering]
+  }
 }
 
 resource "google_bigquery_table" "ad_policy_time_series_table" {
@@ -89,6 +93,10 @@ resource "google_bigquery_table" "asset_policy_data_table" {
     type          = "DAY"
     expiration_ms = 86400000 * var.bq_expiration_days
   }
+  # The clustering is managed by the function, see manage_table_layouts
+  lifecycle {
+    ignore_changes = [clustering]
+  }
 }
 
 resource "google_bigquery_table" "asset_policy_time_series_table" {
@@ -99,6 +107,38 @@ resource "google_bigquery_table" "asset_policy_time_series_table" {
   labels              = local.labels
 }
 
+resource "google_bigquery_table" "ad_policy_data_changes_table" {
+  dataset_id          = google_bigquery_dataset.dataset.dataset_id
+  table_id            = "AdPolicyDataChanges"
+  deletion_protection = false
+  schema              = file("../bigquery/schema/ad_policy_data_changes_schema.json")
+  labels              = local.labels
+  time_partitioning {
+    type          = "DAY"
+    expiration_ms = 86400000 * var.bq_expiration_days
+  }
+  # The clustering is managed by the function, see manage_table_layouts
+  lifecycle {
+    ignore_changes = [clustering]
+  }
+}
+
+resource "google_bigquery_table" "asset_policy_data_changes_table" {
+  dataset_id          = google_bigquery_dataset.dataset.dataset_id
+  table_id            = "AssetPolicyDataChanges"
+  deletion_protection = false
+  schema              = file("../bigquery/schema/asset_policy_data_changes_schema.json")
+  labels              = local.labels
+  time_partitioning {
+    type          = "DAY"
+    expiration_ms = 86400000 * var.bq_expiration_days
+  }
+  # The clustering is managed by the function, see manage_table_layouts
+  lifecycle {
+    ignore_changes = [clustering]
+  }
+}
+
 resource "google_bigquery_table" "ocid_table" {
   dataset_id          = google_bigquery_dataset.dataset.dataset_id
   table_id            = "Ocid"
@@ -186,6 +226,56 @@ resource "google_bigquery_table" "latest_asset_policy_data_report" {
   }
 }
 
+resource "google_bigquery_table" "ad_policy_data_snapshot_report" {
+  dataset_id          = google_bigquery_dataset.dataset.dataset_id
+  table_id            = "AdPolicyDataSnapshot"
+  deletion_protection = false
+  labels              = local.labels
+  depends_on          = [
+    google_bigquery_dataset.dataset,
+    google_bigquery_table.ad_policy_data_changes_table,
+  ]
+  view {
+    query = templatefile(
+      "../bigquery/views/ad_policy_data_snapshot.sql",
+      {
+        BQ_DATASET = google_bigquery_dataset.dataset.dataset_id
+      }
+    )
+    use_legacy_sql = false
+  }
+  lifecycle {
+    replace_triggered_by = [
+      google_bigquery_table.ad_policy_data_changes_table
+    ]
+  }
+}
+
+resource "google_bigquery_table" "asset_policy_data_snapshot_report" {
+  dataset_id          = google_bigquery_dataset.dataset.dataset_id
+  table_id            = "AssetPolicyDataSnapshot"
+  deletion_protection = false
+  labels              = local.labels
+  depends_on          = [
+    google_bigquery_dataset.dataset,
+    google_bigquery_table.asset_policy_data_changes_table,
+  ]
+  view {
+    query = templatefile(
+      "../bigquery/views/asset_policy_data_snapshot.sql",
+      {
+        BQ_DATASET = google_bigquery_dataset.dataset.dataset_id
+      }
+    )
+    use_legacy_sql = false
+  }
+  lifecycle {
+    replace_triggered_by = [
+      google_bigquery_table.asset_policy_data_changes_table
+    ]
+  }
+}
+
 # CLOUD STORAGE ----------------------------------------------------------------
 # This bucket is used to store the cloud functions for deployment.
 # The project ID is used to make sure the name is globally unique
@@ -275,7 +365,11 @@ locals {
     region = var.region
     google_ads_login_customer_id = var.google_ads_login_customer_id
     customer_ids = var.customer_ids
+    discover_customer_ids = var.discover_customer_ids
     use_synthetic_data = var.use_synthetic_data
+    bq_expiration_days = var.bq_expiration_days
+    materialize_views = var.materialize_views
+    manage_table_layouts = var.manage_table_layouts
   })
 }
 resource "google_cloud_scheduler_job" "ads_policy_daily_scheduler" {
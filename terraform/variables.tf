@@ -49,12 +49,30 @@ variable "customer_ids" {
   default     = []
 }
 
+variable "discover_customer_ids" {
+  type        = bool
+  description = "Set true to scan all the enabled accounts under the login customer ID, instead of customer_ids."
+  default     = false
+}
+
 variable "bq_expiration_days" {
   type        = number
   description = "The number of days to keep data in a BigQuery partition."
   default     = 3
 }
 
+variable "materialize_views" {
+  type        = bool
+  description = "Set true to rebuild the materialized dashboard tables on every run."
+  default     = false
+}
+
+variable "manage_table_layouts" {
+  type        = bool
+  description = "Set true to update the clustering & partition expiration of the policy tables on every run."
+  default     = false
+}
+
 variable "use_synthetic_data" {
   type        = bool
   description = "Set true to use synthetic dummy data instead of Google Ads data."